@@ -25,3 +25,4 @@ class OMBusEvents(object):
     CLIENT_DISCOVERY = 'CLIENT_DISCOVERY'
     CONNECTIVITY = 'CONNECTIVITY'
     TIME_CHANGED = 'TIME_CHANGED'
+    CONFIG_CHANGE = 'CONFIG_CHANGE'
@@ -18,16 +18,21 @@ Cloud API Client
 from __future__ import absolute_import
 
 import logging
+import zlib
 
 import requests
 import ujson as json
 from requests import ConnectionError
 from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlencode
 
 from gateway.models import Config
 from ioc import INJECTED, Inject, Injectable
 from platform_utils import System
 
+if False:  # MYPY
+    from typing import Any
+
 logger = logging.getLogger(__name__)
 
 
@@ -97,10 +102,19 @@ class CloudAPIClient(object):
         metrics_endpoint = self._get_endpoint(Config.get_entry('cloud_endpoint_metrics', '') or 'portal/metrics/')
         query_params = {'uuid': self._gateway_uuid}
         logger.info('Uploading %d metrics to cloud...', len(metrics))
+        data = {'metrics': json.dumps(metrics)}  # type: Any
+        headers = None
+        if Config.get_entry('cloud_metrics_compression', False):
+            # Only when enabled, since the Cloud endpoint must support gzip encoded requests
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+            data = compressor.compress(urlencode(data).encode('utf-8')) + compressor.flush()
+            headers = {'Content-Type': 'application/x-www-form-urlencoded',
+                       'Content-Encoding': 'gzip'}
         try:
             response = self._session.post(metrics_endpoint,
                                           params=query_params,
-                                          data={'metrics': json.dumps(metrics)},
+                                          data=data,
+                                          headers=headers,
                                           timeout=30.0,
                                           verify=System.get_operating_system().get('ID') != System.OS.ANGSTROM)
             if not response:
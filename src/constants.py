@@ -77,6 +77,11 @@ def get_pulse_counter_database_file():
     return os.path.join(OPENMOTICS_PREFIX, 'etc/pulse.db')
 
 
+def get_memory_cache_file():
+    """ Get the filename of the persistent Core memory cache file. """
+    return os.path.join(OPENMOTICS_PREFIX, 'etc/memory_cache.bin')
+
+
 def get_all_database_files():
     return [
         get_config_database_file(),
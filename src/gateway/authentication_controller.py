@@ -19,10 +19,12 @@ authentication manager manages logged in users in the system.
 from __future__ import absolute_import
 
 from enum import Enum
+import heapq
 import logging
 import json
 import time
 import uuid
+from threading import Lock
 
 import constants
 from ioc import Injectable, Inject, Singleton, INJECTED
@@ -149,12 +151,18 @@ class AuthenticationController(object):
 
 @Injectable.named('token_store')
 class TokenStore(object):
+    """
+    Keeps the authentication tokens by token string, together with a heap ordered on
+    expire timestamp so expired tokens can be purged without walking all tokens.
+    """
 
     @Inject
     def __init__(self, token_timeout=INJECTED):
         # type: (int) -> None
         self.token_timeout = token_timeout
         self.tokens = {}  # type: Dict[str, AuthenticationToken]
+        self._expiry_heap = []  # type: List[Tuple[int, str]]
+        self._lock = Lock()
 
     def remove_token(self, token):
         if isinstance(token, AuthenticationToken):
@@ -164,16 +172,23 @@ class TokenStore(object):
 
     def _remove_token_str(self, token):
         # type: (str) -> None
-        if token in self.tokens:
-            del self.tokens[token]
-        else:
-            raise ItemDoesNotExistException('Token does not exist in the token store')
+        with self._lock:
+            if token in self.tokens:
+                del self.tokens[token]
+            else:
+                raise ItemDoesNotExistException('Token does not exist in the token store')
 
     def remove_tokens_for_user(self, user_dto):
-        full_user = self._get_full_user_dto(user_dto)
-        for token in list(self.tokens.values()):
-            if token.user.id == full_user.id:
-                del self.tokens[token.token]
+        # type: (UserDTO) -> None
+        # The tokens hold the full user, so there is no need to load it from the database
+        username = user_dto.username.lower() if user_dto.username is not None else None
+        with self._lock:
+            for token in list(self.tokens.values()):
+                if user_dto.id is not None:
+                    if token.user.id == user_dto.id:
+                        del self.tokens[token.token]
+                elif username is not None and token.user.username.lower() == username:
+                    del self.tokens[token.token]
 
     def create_token(self, user_dto, login_method, timeout=None, impersonator=None):
         # type: (UserDTO, LoginMethod, int, Optional[UserDTO]) -> AuthenticationToken
@@ -186,8 +201,10 @@ class TokenStore(object):
 
         generated_token = AuthenticationToken.generate(user_dto=full_user, token_timeout=timeout, impersonator=impersonator, login_method=login_method)
         token_id = generated_token.token
-        self.tokens[token_id] = generated_token
-        return self.tokens[token_id]
+        with self._lock:
+            self.tokens[token_id] = generated_token
+            heapq.heappush(self._expiry_heap, (generated_token.expire_timestamp, token_id))
+        return generated_token
 
     def check_token(self, token):
         # type: (Union[str, AuthenticationToken]) -> Optional[AuthenticationToken]
@@ -197,12 +214,27 @@ class TokenStore(object):
 
     def _check_token_str(self, token_str):
         # type: (str) -> Optional[AuthenticationToken]
-        # clear all the expired tokens before checking the actual token
-        for token in list(self.tokens.values()):
-            if token.is_expired():
-                del self.tokens[token.token]
-        found_token = self.tokens.get(token_str, None)
-        return found_token
+        with self._lock:
+            self._purge_expired_tokens()
+            found_token = self.tokens.get(token_str, None)
+            if found_token is not None and found_token.is_expired():
+                del self.tokens[token_str]
+                return None
+            return found_token
+
+    def _purge_expired_tokens(self):
+        # type: () -> None
+        """ Pops the expired entries from the heap, only touching tokens that actually expired """
+        now = time.time()
+        while self._expiry_heap and now > self._expiry_heap[0][0]:
+            _, token_str = heapq.heappop(self._expiry_heap)
+            token = self.tokens.get(token_str)
+            if token is not None and token.is_expired():
+                del self.tokens[token_str]
+        # Removed tokens leave stale heap entries until they expire, rebuild when those pile up
+        if len(self._expiry_heap) > 2 * len(self.tokens) + 64:
+            self._expiry_heap = [(token.expire_timestamp, token_str) for token_str, token in self.tokens.items()]
+            heapq.heapify(self._expiry_heap)
 
     def _get_full_user_dto(self, user_dto):
         _ = self
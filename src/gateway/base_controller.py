@@ -47,7 +47,6 @@ class SyncStructure(object):
 
 class BaseController(object):
     SYNC_STRUCTURES = None  # type: Optional[List[SyncStructure]]
-    SYNC_LOCK = Lock()
 
     @Inject
     def __init__(self, master_controller, maintenance_controller=INJECTED, pubsub=INJECTED, sync_interval=900):
@@ -58,6 +57,7 @@ class BaseController(object):
         self._sync_orm_thread = None  # type: Optional[DaemonThread]
         self._sync_orm_interval = sync_interval
         self._sync_running = False
+        self._sync_lock = Lock()
 
         self._sync_structures = True
         self._send_config_event = True
@@ -91,7 +91,7 @@ class BaseController(object):
             self._sync_orm_thread.request_single_run()
 
     def run_sync_orm(self):
-        with BaseController.SYNC_LOCK:
+        with self._sync_lock:
             self._sync_orm()
 
     def _sync_orm(self):
@@ -145,14 +145,18 @@ class BaseController(object):
 
         assert issubclass(model_cls, MasterNumber)
 
-        numbers = []
+        # Load from the master first, so the session isn't kept open during the master communication
+        numbers = set()
+        for dto in getattr(self._master_controller, 'load_{0}s'.format(name))():
+            if skip is not None and skip(dto):
+                continue
+            numbers.add(dto.id)
         with Database.get_session() as db:
-            for dto in getattr(self._master_controller, 'load_{0}s'.format(name))():
-                if skip is not None and skip(dto):
-                    continue
-                n = dto.id
-                numbers.append(n)
-                if not db.query(db.query(model_cls).filter(model_cls.number == n).exists()).scalar():
-                    db.add(model_cls(number=n))
-            db.query(model_cls).where(model_cls.number.notin_(numbers)).delete()
+            existing_numbers = set(number for number, in db.query(model_cls.number))
+            new_numbers = numbers - existing_numbers
+            if new_numbers:
+                db.bulk_insert_mappings(model_cls, [{'number': n} for n in sorted(new_numbers)])
+            removed_numbers = existing_numbers - numbers
+            if removed_numbers:
+                db.query(model_cls).where(model_cls.number.in_(removed_numbers)).delete(synchronize_session=False)
             db.commit()
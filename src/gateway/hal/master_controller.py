@@ -64,6 +64,11 @@ class MasterController(object):
     def reset_communication_statistics(self):
         self._master_communicator.reset_communication_statistics()
 
+    def get_memory_statistics(self):
+        # type: () -> Dict[str, int]
+        """ Returns the memory write/activation statistics, if applicable for the master """
+        return {}
+
     def get_communicator_health(self):
         # type: () -> HEALTH
         raise NotImplementedError()
@@ -52,7 +52,8 @@ from master.core.memory_models import CanControlModuleConfiguration, \
     GlobalConfiguration, InputConfiguration, InputModuleConfiguration, \
     OutputConfiguration, OutputModuleConfiguration, SensorConfiguration, \
     SensorModuleConfiguration, ShutterConfiguration, UCanModuleConfiguration
-from master.core.memory_types import MemoryCommitter, MemoryAddress
+from master.core.memory_types import MemoryCommitter, MemoryAddress, \
+    MemoryModelDefinition
 from master.core.slave_communicator import SlaveCommunicator
 from master.core.slave_updater import SlaveUpdater
 from master.core.system_value import Dimmer, Humidity, Temperature
@@ -73,6 +74,10 @@ class MasterCoreController(MasterController):
 
     MASTER_RESTARTING_TIMEOUT = 15
     MASTER_UPDATING_TIMEOUT = 600
+    # Memory models (and the amount of instances per module) that are (re)written when a module is discovered
+    MODULE_MODELS = {ModuleType.OUTPUT: [(OutputModuleConfiguration, 1), (OutputConfiguration, 8)],
+                     ModuleType.INPUT: [(InputModuleConfiguration, 1), (InputConfiguration, 8)],
+                     ModuleType.SENSOR: [(SensorModuleConfiguration, 1), (SensorConfiguration, 8)]}  # type: Dict[str, List[Tuple[Type[MemoryModelDefinition], int]]]
 
     @Inject
     def __init__(self, master_communicator=INJECTED, slave_communicator=INJECTED, core_updater=INJECTED, memory_file=INJECTED, pubsub=INJECTED):
@@ -88,6 +93,7 @@ class MasterCoreController(MasterController):
         self._discover_mode_timer = None  # type: Optional[Timer]
         self._input_state = MasterInputState()
         self._output_states = {}  # type: Dict[int,OutputStatusDTO]
+        self._output_locks = {}  # type: Dict[int,bool]
         self._sensor_interval = 300
         self._sensor_last_updated = 0.0
         self._sensor_states = {}  # type: Dict[int,Dict[str,None]]
@@ -102,6 +108,7 @@ class MasterCoreController(MasterController):
         self._last_health_warning_timestamp = 0.0
         self._pulse_counter_values = {}  # type: Dict[int, Optional[int]]
         self._new_modules_found = False
+        self._discovered_addresses = []  # type: Optional[List[MemoryAddress]]
         self._rogue_module_timer = None  # type: Optional[Timer]
 
         self._pubsub.subscribe_master_events(PubSub.MasterTopics.EEPROM, self._handle_master_event)
@@ -136,6 +143,7 @@ class MasterCoreController(MasterController):
         # type: (MasterEvent) -> None
         if master_event.type == MasterEvent.Types.EEPROM_CHANGE:
             self._output_shutter_map = {}
+            self._output_locks = {}
             self._shutters_last_updated = 0.0
             self._sensor_last_updated = 0.0
             self._input_last_updated = 0.0
@@ -184,6 +192,7 @@ class MasterCoreController(MasterController):
                 else:  # elif core_event.data['type'] == MasterCoreEvent.IOEventTypes.LOCKING:
                     state_dto = OutputStatusDTO(id=output_id,
                                                 locked=core_event.data['locked'])
+                    self._output_locks[output_id] = core_event.data['locked']
                 self._handle_output_state(output_id, state_dto)
             elif core_event.type == MasterCoreEvent.Types.INPUT:
                 if core_event.data['type'] == MasterCoreEvent.IOEventTypes.STATUS:
@@ -226,6 +235,7 @@ class MasterCoreController(MasterController):
                     self._finish_module_discovery(reason='automatic discovery')
             elif core_event.type == MasterCoreEvent.Types.SYSTEM:
                 if core_event.data.get('type') == MasterCoreEvent.SystemEventTypes.STARTUP_COMPLETED:
+                    self._output_locks = {}  # Locking events might have been missed during the restart
                     self._master_communicator.report_blockage(blocker=CommunicationBlocker.RESTART,
                                                               active=False)
             elif core_event.type == MasterCoreEvent.Types.FACTORY_RESET:
@@ -236,7 +246,13 @@ class MasterCoreController(MasterController):
                     self._master_communicator.report_blockage(blocker=CommunicationBlocker.FACTORY_RESET,
                                                               active=active_map[phase])
             elif core_event.type == MasterCoreEvent.Types.MODULE_DISCOVERY:
-                # TODO: Add partial EEPROM invalidation to speed things up
+                if core_event.data['discovery_type'] == MasterCoreEvent.DiscoveryTypes.NEW:
+                    addresses = MasterCoreController._get_module_addresses(module_type=core_event.data['module_type'],
+                                                                           module_number=core_event.data['module_number'])
+                    if addresses is None or self._discovered_addresses is None:
+                        self._discovered_addresses = None  # Unknown impact, the complete cache needs to be invalidated
+                    else:
+                        self._discovered_addresses += addresses
                 address_letter = chr(int(core_event.data['address'].split('.')[0]))
                 entry = {'code': core_event.data['discovery_type'],
                          'module_nr': 0, 'category': '',  # Legacy, not used anymore
@@ -387,6 +403,8 @@ class MasterCoreController(MasterController):
 
     def _set_master_state(self, online):
         if online != self._master_online:
+            if online:
+                self._output_locks = {}  # Locking events might have been missed while offline
             self._master_online = online
 
     @staticmethod
@@ -469,6 +487,10 @@ class MasterCoreController(MasterController):
         # type: () -> bool
         return self._master_online
 
+    def get_memory_statistics(self):
+        # type: () -> Dict[str, int]
+        return self._memory_file.get_write_statistics()
+
     def get_communicator_health(self):
         # type: () -> HEALTH
         stats = self._master_communicator.get_communication_statistics()
@@ -575,8 +597,8 @@ class MasterCoreController(MasterController):
     def load_inputs(self):  # type: () -> List[InputDTO]
         inputs = []
         module_dtos = {module_dto.id: module_dto for module_dto in self._get_input_modules_information()}
-        for input_id in MasterCoreController._enumerate_io_modules('input'):
-            input_orm = InputConfiguration(input_id)
+        input_ids = list(MasterCoreController._enumerate_io_modules('input'))
+        for input_orm in InputConfiguration.load_batch(input_ids):
             inputs.append(self._load_input(input_orm=input_orm,
                                            module_dto=module_dtos.get(input_orm.module.id)))
         return inputs
@@ -657,10 +679,10 @@ class MasterCoreController(MasterController):
         outputs = []
         module_dtos, _ = self._get_output_modules_information()
         module_dto_map = {module_dto.id: module_dto for module_dto in module_dtos}
-        for output_id in MasterCoreController._enumerate_io_modules('output'):
-            output_orm = OutputConfiguration(output_id)
+        output_ids = list(MasterCoreController._enumerate_io_modules('output'))
+        for output_orm in OutputConfiguration.load_batch(output_ids):
             outputs.append(self._load_output(output_orm=output_orm,
-                                             module_dto=module_dto_map.get(output_id // 8)))
+                                             module_dto=module_dto_map.get(output_orm.id // 8)))
         return outputs
 
     def save_outputs(self, outputs):  # type: (List[OutputDTO]) -> None
@@ -682,18 +704,35 @@ class MasterCoreController(MasterController):
     def load_output_status(self):
         # type: () -> List[OutputStatusDTO]
         output_status = []
-        for i in MasterCoreController._enumerate_io_modules('output'):
-            data = self._master_communicator.do_command(command=CoreAPI.output_detail(),
-                                                        fields={'device_nr': i})
+        output_ids = list(MasterCoreController._enumerate_io_modules('output'))
+        responses = self._master_communicator.do_commands(commands=[(CoreAPI.output_detail(), {'device_nr': i})
+                                                                    for i in output_ids])
+        output_locks = self._load_output_locks(output_ids)
+        for i, data in zip(output_ids, responses):
             timer = SVTTimer.event_timer_type_to_seconds(data['timer_type'], data['timer'])
-            output = OutputConfiguration(i)
             output_status.append(OutputStatusDTO(id=i,
                                                  status=bool(data['status']),
                                                  ctimer=timer,
                                                  dimmer=Dimmer.system_value_to_dimmer(data['dimmer']),
-                                                 locked=output.locking.locked))
+                                                 locked=output_locks[i]))
         return output_status
 
+    def _load_output_locks(self, output_ids):  # type: (List[int]) -> Dict[int, bool]
+        """
+        Returns the locked flag of the given outputs. Missing flags are read from the locking bytes
+        in FRAM at once, afterwards they are kept up to date by the locking events.
+        """
+        output_locks = self._output_locks
+        missing_ids = [i for i in output_ids if i not in output_locks]
+        if missing_ids:
+            locking_field = OutputConfiguration._get_composite_fields()['locking']._field
+            addresses = dict((i, locking_field.get_address(i)) for i in missing_ids)
+            data = self._memory_file.read(list(set(addresses.values())))
+            for i, address in addresses.items():
+                # A locking event received in the meantime is more recent
+                output_locks.setdefault(i, bool(data[address][0] >> (i % 8) & 1))
+        return output_locks
+
     def _configure_output_shutter(self, output, is_shutter):  # type: (OutputConfiguration, bool) -> None
         output_set = ['01', '23', '45', '67'][output.id % 8 // 2]
         base_output = output.id // 2 * 2
@@ -920,8 +959,9 @@ class MasterCoreController(MasterController):
 
     def load_sensors(self):  # type: () -> List[MasterSensorDTO]
         sensors = []
-        for i in MasterCoreController._enumerate_io_modules('sensor'):
-            sensors.append(self.load_sensor(i))
+        sensor_ids = list(MasterCoreController._enumerate_io_modules('sensor'))
+        for sensor in SensorConfiguration.load_batch(sensor_ids):
+            sensors.append(SensorMapper.orm_to_dto(sensor))
         return sensors
 
     def save_sensors(self, sensors):  # type: (List[MasterSensorDTO]) -> None
@@ -1158,9 +1198,27 @@ class MasterCoreController(MasterController):
         # type: (str) -> None
         if self._new_modules_found:
             logger.info('New modules were discovered')
-            self._memory_file.invalidate_cache(reason=reason)
+            addresses, self._discovered_addresses = self._discovered_addresses, []
+            if not addresses:
+                addresses = None  # Unknown impact (e.g. virtual modules), the complete cache needs to be invalidated
+            self._memory_file.invalidate_cache(reason=reason, addresses=addresses)
             self._new_modules_found = False
 
+    @staticmethod
+    def _get_module_addresses(module_type, module_number):
+        # type: (str, Optional[int]) -> Optional[List[MemoryAddress]]
+        """
+        Returns the memory addresses that depend on the given module, including the global
+        configuration (which holds e.g. the amount of modules). Returns None if unknown.
+        """
+        if module_type not in MasterCoreController.MODULE_MODELS or module_number is None:
+            return None
+        addresses = GlobalConfiguration.get_addresses([None])
+        for model, instances_per_module in MasterCoreController.MODULE_MODELS[module_type]:
+            addresses += model.get_addresses(list(range(module_number * instances_per_module,
+                                                        (module_number + 1) * instances_per_module)))
+        return addresses
+
     def get_module_log(self):  # type: () -> List[Dict[str, Any]]
         with self._discovery_log_lock:
             log = self._discovery_log
@@ -1603,9 +1661,11 @@ class MasterCoreController(MasterController):
         # type: () -> bytearray
         data = bytearray()
         pages, page_length = MemoryFile.SIZES[MemoryTypes.EEPROM]
-        for page in range(pages):
-            page_address = MemoryAddress(memory_type=MemoryTypes.EEPROM, page=page, offset=0, length=page_length)
-            data += self._memory_file.read([page_address])[page_address]
+        page_addresses = [MemoryAddress(memory_type=MemoryTypes.EEPROM, page=page, offset=0, length=page_length)
+                          for page in range(pages)]
+        page_data = self._memory_file.read(page_addresses)
+        for page_address in page_addresses:
+            data += page_data[page_address]
         return data
 
     def restore(self, data):
@@ -34,7 +34,7 @@ from master.core.group_action import GroupActionController
 from ioc import Inject, INJECTED, Singleton
 
 if False:  # MYPY
-    from typing import List, Dict, Any, Union, Optional, TypeVar
+    from typing import List, Dict, Any, Union, Optional, TypeVar, Tuple
     from master.core.memory_file import MemoryAddress
     from master.core.core_command import CoreCommandSpec
     from master.core.core_communicator import Consumer
@@ -79,12 +79,18 @@ class DummyMemoryFile(object):
             response[address] = data
         return response
 
+    def prefetch(self, addresses):  # type: (List[MemoryAddress]) -> None
+        pass
+
     def write(self, data_map):  # type: (Dict[MemoryAddress, bytearray]) -> None
         for address, data in data_map.items():
             page_memory = self._memory.setdefault(str(address.page), {})
             for index, position in enumerate(range(address.offset, address.offset + address.length)):
                 page_memory[str(position)] = data[index]
 
+    def get_write_statistics(self):  # type: () -> Dict[str, int]
+        return {}
+
     def commit(self):
         if self._persistent_eeprom:
             with open(self._eeprom_path, 'w') as fp:
@@ -134,6 +140,12 @@ class DummyCommunicator(object):
         return {'calls_succeeded': [], 'calls_timedout': [],
                 'bytes_written': 0, 'bytes_read': 0}
 
+    def do_commands(self, commands, timeout=2, bypass_blockers=None, window=None):
+        # type: (List[Tuple[CoreCommandSpec, Dict[str, Any]]], Union[T_co, int], Optional[List], Optional[int]) -> List[Union[T_co, Dict[str, Any]]]
+        _ = window
+        return [self.do_command(command, fields, timeout=timeout, bypass_blockers=bypass_blockers)
+                for command, fields in commands]
+
     def do_command(self, command, fields, timeout=2, bypass_blockers=None):
         # type: (CoreCommandSpec, Dict[str, Any], Union[T_co, int], Optional[List]) -> Union[T_co, Dict[str, Any]]
         """
@@ -196,6 +196,13 @@ def setup_target_platform(target_platform, message_client_name):
     Injectable.value(ssl_private_key=constants.get_ssl_private_key_file())
     Injectable.value(ssl_certificate=constants.get_ssl_certificate_file())
 
+    # Event distribution
+    try:
+        state_coalesce_window = float(config.get('OpenMotics', 'state_coalesce_window'))
+    except NoOptionError:
+        state_coalesce_window = 0.0
+    Injectable.value(state_coalesce_window=state_coalesce_window)
+
     # TODO: Clean up dependencies more to reduce complexity
 
     # IOC announcements
@@ -324,7 +331,12 @@ def setup_target_platform(target_platform, message_client_name):
         Injectable.value(eeprom_db=constants.get_eeprom_extension_database_file())
 
         Injectable.value(master_communicator=CoreCommunicator())
-        Injectable.value(memory_file=MemoryFile())
+        try:
+            persistent_memory_cache = config.getboolean('OpenMotics', 'persistent_memory_cache')
+        except NoOptionError:
+            persistent_memory_cache = False
+        memory_cache_file = constants.get_memory_cache_file() if persistent_memory_cache else None
+        Injectable.value(memory_file=MemoryFile(cache_path=memory_cache_file))
         Injectable.value(maintenance_communicator=MaintenanceCoreCommunicator())
         Injectable.value(master_controller=MasterCoreController())
     elif target_platform in Platform.ClassicTypes:
@@ -22,14 +22,29 @@ import sqlite3
 import logging
 import ujson as json
 from random import randint
+from threading import Lock
+from gateway.daemon_thread import DaemonThread
 from ioc import Injectable, Inject, INJECTED, Singleton
 
+if False:  # MYPY
+    from typing import Any, Dict, List, Optional, Set, Tuple
+
 logger = logging.getLogger(__name__)
 
 
 @Injectable.named('metrics_cache_controller')
 @Singleton
 class MetricsCacheController(object):
+    """
+    Keeps the counter state in memory and writes it back to the database (write-back, not write-through): dirty
+    counters are persisted by a background writer in a single transaction every FLUSH_INTERVAL seconds, or when
+    flushed explicitly (e.g. on stop or before a backup). When persisted counter state is lagging behind after an
+    unclean shutdown, the counter still catches up since the next value delta is calculated from the older last value.
+    """
+
+
+    FLUSH_INTERVAL = 30
+    MAX_SPOOL_LENGTH = 100000
 
     @Inject
     def __init__(self, metrics_db=INJECTED, metrics_db_lock=INJECTED):
@@ -45,8 +60,25 @@ class MetricsCacheController(object):
                                            check_same_thread=False,
                                            isolation_level=None)
         self._cursor = self._connection.cursor()
+        self._source_ids = {}  # type: Dict[Tuple[str, str, str], int]
+        self._counters = {}  # type: Dict[Tuple[int, str], List]  # [last_value, counter, timestamp, persisted]
+        self._dirty_counters = set()  # type: Set[Tuple[int, str]]
+        self._counters_lock = Lock()
+        self._writer_thread = None  # type: Optional[DaemonThread]
         self._check_tables()
 
+    def start(self):  # type: () -> None
+        self._writer_thread = DaemonThread(name='metricscachewriter',
+                                           target=self.flush,
+                                           interval=MetricsCacheController.FLUSH_INTERVAL)
+        self._writer_thread.start()
+
+    def stop(self):  # type: () -> None
+        if self._writer_thread is not None:
+            self._writer_thread.stop()
+            self._writer_thread = None
+        self.flush()
+
     def _execute(self, *args, **kwargs):
         with self._lock:
             return self._execute_unlocked(*args, **kwargs)
@@ -69,29 +101,79 @@ class MetricsCacheController(object):
         self._execute("CREATE TABLE IF NOT EXISTS counter_sources (id INTEGER PRIMARY KEY, source TEXT, type TEXT, identifier TEXT);")
         self._execute("CREATE TABLE IF NOT EXISTS counters (id INTEGER PRIMARY KEY, source_id INTEGER , name TEXT, last_value REAL, counter REAL, timestamp INTEGER);")
         self._execute("CREATE TABLE IF NOT EXISTS counters_buffer (id INTEGER PRIMARY KEY, source_id INTEGER, counters TEXT, timestamp INTEGER);")
+        self._execute("CREATE TABLE IF NOT EXISTS metrics_spool (id INTEGER PRIMARY KEY, metrics TEXT);")
+        self._execute("CREATE INDEX IF NOT EXISTS counter_sources_identifier ON counter_sources (source, type, identifier);")
+        self._execute("CREATE INDEX IF NOT EXISTS counters_source_name ON counters (source_id, name);")
+        self._execute("CREATE INDEX IF NOT EXISTS counters_buffer_source_timestamp ON counters_buffer (source_id, timestamp);")
+        self._execute("PRAGMA journal_mode=WAL;")
+        self._execute("PRAGMA synchronous=NORMAL;")
 
     def process_counter(self, source, mtype, tags, name, value, timestamp):
-        with self._lock:
-            identifier = json.dumps(tags, sort_keys=True)
+        identifier = json.dumps(tags, sort_keys=True)
+        with self._counters_lock:
             id = self._get_counter_id(source, mtype, identifier)
-            data = self._execute_unlocked("SELECT last_value, counter FROM counters WHERE source_id=? AND name=?;", (id, name))
-            for entry in data:
-                last_value, counter = entry
-                if last_value == value:
-                    return counter
-                if last_value < value:
-                    counter += (value - last_value)
-                else:
-                    counter += value
-                self._execute_unlocked("UPDATE counters SET last_value=?, counter=?, timestamp=? WHERE source_id=? AND name=?;", (value, counter, timestamp, id, name))
+            key = (id, name)
+            entry = self._counters.get(key)
+            if entry is None:
+                with self._lock:
+                    data = self._execute_unlocked("SELECT last_value, counter FROM counters WHERE source_id=? AND name=?;", (id, name)).fetchone()
+                if data is None:
+                    self._counters[key] = [value, value, timestamp, False]
+                    self._dirty_counters.add(key)
+                    return value
+                entry = [data[0], data[1], timestamp, True]
+                self._counters[key] = entry
+            last_value, counter = entry[0], entry[1]
+            if last_value == value:
                 return counter
-            self._execute_unlocked("INSERT INTO counters (source_id, name, last_value, counter, timestamp) VALUES (?, ?, ?, ?, ?);", (id, name, value, value, timestamp))
-            return value
+            if last_value < value:
+                counter += (value - last_value)
+            else:
+                counter += value
+            entry[0], entry[1], entry[2] = value, counter, timestamp
+            self._dirty_counters.add(key)
+            return counter
+
+    def flush(self):  # type: () -> None
+        """ Persists all dirty counters in a single transaction """
+        with self._counters_lock:
+            if not self._dirty_counters:
+                return
+            keys = list(self._dirty_counters)
+            updates, inserts = [], []
+            for key in keys:
+                entry = self._counters[key]
+                if entry[3]:
+                    updates.append((entry[0], entry[1], entry[2], key[0], key[1]))
+                else:
+                    inserts.append((key[0], key[1], entry[0], entry[1], entry[2]))
+                    entry[3] = True
+            self._dirty_counters.clear()
+        try:
+            with self._lock:
+                self._execute_unlocked("BEGIN;")
+                try:
+                    if updates:
+                        self._cursor.executemany("UPDATE counters SET last_value=?, counter=?, timestamp=? WHERE source_id=? AND name=?;", updates)
+                    if inserts:
+                        self._cursor.executemany("INSERT INTO counters (source_id, name, last_value, counter, timestamp) VALUES (?, ?, ?, ?, ?);", inserts)
+                    self._execute_unlocked("COMMIT;")
+                except Exception:
+                    self._execute_unlocked("ROLLBACK;")
+                    raise
+        except Exception:
+            logger.exception('Could not persist %s counters', len(keys))
+            with self._counters_lock:
+                for id, name, _, _, _ in inserts:
+                    self._counters[(id, name)][3] = False
+                self._dirty_counters.update(keys)
+            raise
 
     def buffer_counter(self, source, mtype, tags, counters, timestamp):
-        with self._lock:
-            identifier = json.dumps(tags, sort_keys=True)
+        identifier = json.dumps(tags, sort_keys=True)
+        with self._counters_lock:
             id = self._get_counter_id(source, mtype, identifier)
+        with self._lock:
             data = self._execute_unlocked("SELECT timestamp FROM counters_buffer WHERE source_id=? ORDER BY timestamp DESC LIMIT 1;", (id,)).fetchone()
             if data is None or MetricsCacheController._floored_timestamp(data[0]) < MetricsCacheController._floored_timestamp(timestamp):
                 self._execute_unlocked("INSERT INTO counters_buffer (source_id, counters, timestamp) VALUES (?, ?, ?);", (id, json.dumps(counters), timestamp))
@@ -118,13 +200,51 @@ class MetricsCacheController(object):
             self._execute_unlocked("DELETE FROM counters_buffer WHERE timestamp < ?;", (timestamp,))
             return self._execute_unlocked("SELECT changes();").fetchone()[0]
 
+    def spool_metrics(self, metrics):  # type: (List[List[Dict[str, Any]]]) -> None
+        """ Appends metrics that could not be kept in memory to the on-disk spool """
+        with self._lock:
+            self._execute_unlocked("BEGIN;")
+            try:
+                self._cursor.executemany("INSERT INTO metrics_spool (metrics) VALUES (?);", [(json.dumps(entry),) for entry in metrics])
+                # Keep the spool bounded, the oldest metrics are dropped first
+                self._execute_unlocked("DELETE FROM metrics_spool WHERE id <= (SELECT MAX(id) FROM metrics_spool) - ?;", (MetricsCacheController.MAX_SPOOL_LENGTH,))
+                self._execute_unlocked("COMMIT;")
+            except Exception:
+                self._execute_unlocked("ROLLBACK;")
+                raise
+
+    def get_spool_length(self):  # type: () -> int
+        with self._lock:
+            return self._execute_unlocked("SELECT COUNT(*) FROM metrics_spool;").fetchone()[0]
+
+    def load_spool(self, limit):  # type: (int) -> Tuple[Optional[int], List[List[Dict[str, Any]]]]
+        """ Loads the oldest spooled metrics, returns the last loaded spool id and the metrics """
+        with self._lock:
+            items = self._execute_unlocked("SELECT id, metrics FROM metrics_spool ORDER BY id LIMIT ?;", (limit,)).fetchall()
+        if not items:
+            return None, []
+        return items[-1][0], [json.loads(item[1]) for item in items]
+
+    def clear_spool(self, last_id):  # type: (int) -> None
+        """ Removes the spooled metrics up to the given id """
+        with self._lock:
+            self._execute_unlocked("DELETE FROM metrics_spool WHERE id <= ?;", (last_id,))
+
     def _get_counter_id(self, source, mtype, identifier):
-        data = self._execute_unlocked("SELECT id FROM counter_sources WHERE source=? AND type=? AND identifier=?;", (source, mtype, identifier)).fetchone()
-        if data is not None:
-            return data[0]
-        result = self._execute_unlocked("INSERT INTO counter_sources (source, type, identifier) VALUES (?, ?, ?);", (source, mtype, identifier))
-        return result.lastrowid
+        key = (source, mtype, identifier)
+        id = self._source_ids.get(key)
+        if id is not None:
+            return id
+        with self._lock:
+            data = self._execute_unlocked("SELECT id FROM counter_sources WHERE source=? AND type=? AND identifier=?;", key).fetchone()
+            if data is not None:
+                id = data[0]
+            else:
+                id = self._execute_unlocked("INSERT INTO counter_sources (source, type, identifier) VALUES (?, ?, ?);", key).lastrowid
+        self._source_ids[key] = id
+        return id
 
     def close(self):
         """ Close the database connection. """
+        self.flush()
         self._connection.close()
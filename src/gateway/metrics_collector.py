@@ -18,12 +18,15 @@ This module collects OpenMotics metrics and makes them available to the MetricsC
 
 from __future__ import absolute_import
 
+import heapq
 import logging
 import time
 from collections import deque
-from threading import Event
+from functools import partial
+from threading import Condition, Lock
 
 import six
+from six.moves.queue import Queue
 
 from enums import OutputType
 from gateway.daemon_thread import BaseThread
@@ -36,7 +39,7 @@ from platform_utils import Hardware
 from gateway.thermostat.thermostat_controller import ThermostatController
 
 if False:  # MYPY
-    from typing import Dict, Any, List, Optional, Tuple, Union
+    from typing import Callable, Dict, Any, List, Optional, Tuple, Union
     from gateway.energy_module_controller import EnergyModuleController
     from gateway.input_controller import InputController
     from gateway.output_controller import OutputController
@@ -49,6 +52,108 @@ if False:  # MYPY
 logger = logging.getLogger(__name__)
 
 
+class CollectorScheduler(object):
+    """
+    Runs periodic jobs on a small pool of workers. The jobs are kept in a heap ordered by deadline, so a single
+    thread sleeps until the next job is due instead of polling. A job never runs concurrently with itself and its
+    next deadline is calculated from the start of its previous run.
+    """
+
+    def __init__(self, name, workers):  # type: (str, int) -> None
+        self._name = name
+        self._workers = workers
+        self._jobs = {}  # type: Dict[str, Dict[str, Any]]
+        self._heap = []  # type: List[Tuple[float, int, str]]
+        self._sequence = 0
+        self._condition = Condition()
+        self._ready_queue = Queue()  # type: Queue  # Queue[Optional[str]]
+        self._stopped = True
+
+    def add_job(self, name, target, get_interval):
+        # type: (str, Callable[[], None], Callable[[], float]) -> None
+        with self._condition:
+            self._jobs[name] = {'target': target,
+                                'get_interval': get_interval,
+                                'start': 0.0,
+                                'deadline': 0.0,
+                                'running': False,
+                                'lateness': 0.0,
+                                'max_lateness': 0.0}
+            self._schedule(name, time.time())
+
+    def reschedule(self, name, interval):  # type: (str, float) -> None
+        """ Moves the next run of a job earlier when its interval got shorter """
+        with self._condition:
+            job = self._jobs.get(name)
+            if job is None or job['running']:
+                return  # A running job picks up the new interval when it finishes
+            deadline = max(time.time(), job['start'] + interval)
+            if deadline < job['deadline']:
+                self._schedule(name, deadline)
+
+    def get_statistics(self):  # type: () -> Dict[str, Dict[str, float]]
+        with self._condition:
+            return {name: {'lateness': job['lateness'],
+                           'max_lateness': job['max_lateness']}
+                    for name, job in self._jobs.items()}
+
+    def start(self):  # type: () -> None
+        self._stopped = False
+        threads = [BaseThread(name='{0}sched'.format(self._name), target=self._scheduler_loop)]
+        for i in range(self._workers):
+            threads.append(BaseThread(name='{0}{1}'.format(self._name, i), target=self._worker_loop))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):  # type: () -> None
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        for _ in range(self._workers):
+            self._ready_queue.put(None)
+
+    def _schedule(self, name, deadline):  # type: (str, float) -> None
+        # Must be called with the condition acquired. Older heap entries of the job become stale.
+        self._jobs[name]['deadline'] = deadline
+        heapq.heappush(self._heap, (deadline, self._sequence, name))
+        self._sequence += 1
+        self._condition.notify()
+
+    def _scheduler_loop(self):  # type: () -> None
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.time()):
+                    self._condition.wait(None if not self._heap else self._heap[0][0] - time.time())
+                if self._stopped:
+                    return
+                deadline, _, name = heapq.heappop(self._heap)
+                job = self._jobs[name]
+                if job['running'] or deadline != job['deadline']:
+                    continue
+                now = time.time()
+                job['running'] = True
+                job['start'] = now
+                job['lateness'] = now - deadline
+                job['max_lateness'] = max(job['max_lateness'], job['lateness'])
+            self._ready_queue.put(name)
+
+    def _worker_loop(self):  # type: () -> None
+        while True:
+            name = self._ready_queue.get()
+            if name is None:
+                return
+            job = self._jobs[name]
+            try:
+                job['target']()
+            except Exception:
+                logger.exception('Error while running metric job %s', name)
+            with self._condition:
+                job['running'] = False
+                if not self._stopped:
+                    self._schedule(name, job['start'] + job['get_interval']())
+
+
 @Injectable.named('metrics_collector')
 @Singleton
 class MetricsCollector(object):
@@ -73,6 +178,15 @@ class MetricsCollector(object):
                            OutputType.SHUTTER_RELAY: 'shutter_relay',
                            OutputType.LIGHT: 'light'}
 
+    WORKERS = 3
+    CONFIGURATION_INTERVAL = 900
+    KEYFRAME_INTERVAL = 300  # Unchanged (delta) series are still emitted at least this often
+    PLUGIN_LATENCY_BUCKETS = [('<1ms', 'command_latency_1ms'),
+                              ('<10ms', 'command_latency_10ms'),
+                              ('<100ms', 'command_latency_100ms'),
+                              ('<1s', 'command_latency_1s'),
+                              ('>=1s', 'command_latency_slow')]
+
     @Inject
     def __init__(self, pulse_counter_controller=INJECTED, thermostat_controller=INJECTED,
                  output_controller=INJECTED, shutter_controller=INJECTED, input_controller=INJECTED,
@@ -100,9 +214,9 @@ class MetricsCollector(object):
         self._plugin_intervals = {metric_type: [] for metric_type in self._min_intervals}  # type: Dict[str, List[Any]]
         self._websocket_intervals = {metric_type: {} for metric_type in self._min_intervals}  # type: Dict[str, Dict[Any, Any]]
         self._cloud_intervals = {metric_type: 900 for metric_type in self._min_intervals}
-        self._sleepers = {metric_type: {'event': Event(),
-                                        'start': 0,
-                                        'end': 0} for metric_type in self._min_intervals}  # type: Dict[str,Dict[str,Any]]
+        self._scheduler = CollectorScheduler(name='metric', workers=MetricsCollector.WORKERS)
+        self._last_values = {}  # type: Dict[Tuple[str, Any], Tuple[Dict[str, Any], Dict[str, Any], float]]
+        self._last_values_lock = Lock()
 
         self._thermostat_controller = thermostat_controller  # type: ThermostatController
         self._pulse_counter_controller = pulse_counter_controller  # type: PulseCounterController
@@ -117,22 +231,23 @@ class MetricsCollector(object):
     def start(self):
         self._start = time.time()
         self._stopped = False
-        MetricsCollector._start_thread(self._load_environment_configurations, 'load_configuration', 900)
-        MetricsCollector._start_thread(self._run_system, 'system')
-        MetricsCollector._start_thread(self._run_outputs, 'output')
-        MetricsCollector._start_thread(self._run_shutters, 'shutter')
-        MetricsCollector._start_thread(self._run_sensors, 'sensor')
-        MetricsCollector._start_thread(self._run_thermostats, 'thermostat')
-        MetricsCollector._start_thread(self._run_errors, 'error')
-        MetricsCollector._start_thread(self._run_pulsecounters, 'counter')
-        MetricsCollector._start_thread(self._run_energy_openmotics, 'energy')
-        MetricsCollector._start_thread(self._run_energy_openmotics_analytics, 'energy_analytics')
-        thread = BaseThread(target=self._sleep_manager, name='metricsleep')
-        thread.daemon = True
-        thread.start()
+        self._scheduler.add_job('load_configuration', self._load_environment_configurations,
+                                lambda: MetricsCollector.CONFIGURATION_INTERVAL)
+        for metric_type, workload in [('system', self._run_system),
+                                      ('output', self._run_outputs),
+                                      ('shutter', self._run_shutters),
+                                      ('sensor', self._run_sensors),
+                                      ('thermostat', self._run_thermostats),
+                                      ('error', self._run_errors),
+                                      ('counter', self._run_pulsecounters),
+                                      ('energy', self._run_energy_openmotics),
+                                      ('energy_analytics', self._run_energy_openmotics_analytics)]:
+            self._scheduler.add_job(metric_type, partial(workload, metric_type), partial(self.intervals.get, metric_type))
+        self._scheduler.start()
 
     def stop(self):
         self._stopped = True
+        self._scheduler.stop()
 
     def collect_metrics(self):
         # Yield all metrics in the Queue
@@ -188,6 +303,7 @@ class MetricsCollector(object):
         if len(self._websocket_intervals[metric_type]) > 0:
             interval = min(interval, *[max(min_interval, i) for i in self._websocket_intervals[metric_type].values()])
         self.intervals[metric_type] = interval
+        self._reset_last_values(metric_type)  # Make sure new consumers receive a full keyframe
         self.maybe_wake_earlier(metric_type, interval)
 
     def _enqueue_metrics(self, metric_type, values, tags, timestamp):
@@ -203,42 +319,34 @@ class MetricsCollector(object):
                                         'tags': tags,
                                         'values': values})
 
-    def maybe_wake_earlier(self, metric_type, duration):
-        if metric_type in self._sleepers:
-            current_end = self._sleepers[metric_type]['end']
-            new_end = self._sleepers[metric_type]['start'] + duration
-            self._sleepers[metric_type]['end'] = min(current_end, new_end)
+    def _enqueue_changed_metrics(self, metric_type, values, tags, timestamp):
+        """
+        Only enqueues the metric if its values (or tags) changed since it was last emitted. An unchanged
+        metric is still emitted as a keyframe once per cloud interval and at least every KEYFRAME_INTERVAL.
+        """
+        key = (metric_type, tags['id'])
+        cloud_interval = self._cloud_intervals.get(metric_type, 900)
+        with self._last_values_lock:
+            last = self._last_values.get(key)
+            if last is not None:
+                last_values, last_tags, last_timestamp = last
+                if (last_values == values and last_tags == tags and
+                        timestamp - last_timestamp < MetricsCollector.KEYFRAME_INTERVAL and
+                        timestamp // cloud_interval == last_timestamp // cloud_interval):
+                    return
+            self._last_values[key] = (values, tags, timestamp)
+        self._enqueue_metrics(metric_type=metric_type,
+                              values=values,
+                              tags=tags,
+                              timestamp=timestamp)
 
-    def _sleep_manager(self):
-        while True:
-            for sleep_data in self._sleepers.values():
-                if not sleep_data['event'].is_set() and sleep_data['end'] < time.time():
-                    sleep_data['event'].set()
-            time.sleep(0.1)
-
-    @staticmethod
-    def _start_thread(workload, name, interval=None):
-        args = [name]
-        if interval is not None:
-            args.append(interval)
-        thread = BaseThread(name='metric{0}'.format(name), target=workload, args=args)
-        thread.daemon = True
-        thread.start()
-        return thread
-
-    def _pause(self, start, metric_type, interval=None):
-        if interval is None:
-            interval = self.intervals[metric_type]
-        if metric_type in self._sleepers:
-            sleep_data = self._sleepers[metric_type]
-            sleep_data['start'] = start
-            sleep_data['end'] = start + interval
-            sleep_data['event'].clear()
-            sleep_data['event'].wait()
-        else:
-            elapsed = time.time() - start
-            sleep = max(0.1, interval - elapsed)
-            time.sleep(sleep)
+    def _reset_last_values(self, metric_type):  # type: (str) -> None
+        with self._last_values_lock:
+            for key in [key for key in self._last_values if key[0] == metric_type]:
+                del self._last_values[key]
+
+    def maybe_wake_earlier(self, metric_type, duration):
+        self._scheduler.reschedule(metric_type, duration)
 
     def process_gateway_event(self, event):
         # type: (GatewayEvent) -> None
@@ -277,10 +385,10 @@ class MetricsCollector(object):
                             'name': output_dto.name,
                             'module_type': MetricsCollector.OUTPUT_MODULE_TYPES.get(output_dto.module_type, 'unknown'),
                             'type': MetricsCollector.OUTPUT_OUTPUT_TYPES.get(output_dto.output_type, 'unknown')}
-                    self._enqueue_metrics(metric_type=metric_type,
-                                          values={'value': int(level)},
-                                          tags=tags,
-                                          timestamp=now)
+                    self._enqueue_changed_metrics(metric_type=metric_type,
+                                                  values={'value': int(level)},
+                                                  tags=tags,
+                                                  timestamp=now)
         except Exception as ex:
             logger.exception('Error processing outputs {0}: {1}'.format(output_ids, ex))
 
@@ -304,223 +412,237 @@ class MetricsCollector(object):
             logger.exception('Error processing input: {0}'.format(ex))
 
     def _run_system(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            now = time.time()
-            plugin_system_metrics = {}
+        now = time.time()
+        plugin_system_metrics = {}
+        try:
+            values = {}
+            with open('/proc/uptime', 'r') as f:
+                system_uptime = float(f.readline().split()[0])
+            service_uptime = time.time() - self._start
+            if service_uptime > self._last_service_uptime + 3600:
+                self._start = time.time()
+                service_uptime = 0
+            self._last_service_uptime = service_uptime
+
+            values['service_uptime'] = float(service_uptime)
+            values['system_uptime'] = float(system_uptime)
+
             try:
-                values = {}
-                with open('/proc/uptime', 'r') as f:
-                    system_uptime = float(f.readline().split()[0])
-                service_uptime = time.time() - self._start
-                if service_uptime > self._last_service_uptime + 3600:
-                    self._start = time.time()
-                    service_uptime = 0
-                self._last_service_uptime = service_uptime
-
-                values['service_uptime'] = float(service_uptime)
-                values['system_uptime'] = float(system_uptime)
+                # On some older environments `psutil` doesn't work properly.
+                # Since these metrics are not critical they can be skipped
+                import psutil
+                collect_psutil_metrics = True
+            except ImportError:
+                psutil = None
+                collect_psutil_metrics = False
 
+            if collect_psutil_metrics:
                 try:
-                    # On some older environments `psutil` doesn't work properly.
-                    # Since these metrics are not critical they can be skipped
-                    import psutil
-                    collect_psutil_metrics = True
-                except ImportError:
-                    psutil = None
-                    collect_psutil_metrics = False
-
-                if collect_psutil_metrics:
-                    try:
-                        values['cpu_percent'] = float(psutil.cpu_percent())
-                        cpu_load = [x / psutil.cpu_count() * 100 for x in psutil.getloadavg()]
-                        values['cpu_load_1'] = float(cpu_load[0])
-                        values['cpu_load_5'] = float(cpu_load[1])
-                        values['cpu_load_15'] = float(cpu_load[2])
-                    except Exception as ex:
-                        logger.error('Error loading cpu metrics: {0}'.format(ex))
-
-                    try:
-                        memory = dict(psutil.virtual_memory()._asdict())
-                        for reading in ['available', 'used', 'percent', 'free', 'inactive', 'shared', 'active', 'total']:
-                            try:
-                                key = 'memory_{0}'.format(reading)
-                                value = memory[reading]
-                                values[key] = int(value) if reading != 'percent' else float(value)
-                            except Exception as ex:
-                                logger.error('error loading memory metric: {0}'.format(ex))
-                    except Exception as ex:
-                        logger.error('Error loading memory metrics: {0}'.format(ex))
-
-                    try:
-                        disk = dict(psutil.disk_usage('/')._asdict())
-                        for reading in ['total', 'used', 'percent', 'free']:
-                            try:
-                                key = 'disk_{0}'.format(reading)
-                                value = disk[reading]
-                                values[key] = int(value) if reading != 'percent' else float(value)
-                            except Exception as ex:
-                                logger.error('Error loading disk metric: {0}'.format(ex))
-
-                        disk_io = dict(psutil.disk_io_counters()._asdict())
-                        for reading in ['read_count', 'write_count', 'read_bytes', 'write_bytes']:
-                            try:
-                                key = 'disk_{0}'.format(reading)
-                                value = disk_io[reading]
-                                values[key] = int(value)
-                            except Exception as ex:
-                                logger.error('Error loading disk io metric: {0}'.format(ex))
-                    except Exception as ex:
-                        logger.error('Error loading disk metrics: {0}'.format(ex))
-
-                    try:
-                        network = dict(psutil.net_io_counters()._asdict())
-                        for reading in ['bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv']:
-                            try:
-                                key = 'net_{0}'.format(reading)
-                                value = network[reading]
-                                values[key] = int(value)
-                            except Exception as ex:
-                                logger.error('Error loading network metric: {0}'.format(ex))
-                    except Exception as ex:
-                        logger.error('Error loading network metrics: {0}'.format(ex))
-
-                    try:
-                        import openmotics_service
-                        import watchdog
-                        import vpn_service
-                        from plugin_runtime import runtime
-                        openmotics_service_filename = openmotics_service.__file__.split('/')[-1].replace('.pyc', '.py')
-                        watchdog_filename = watchdog.__file__.split('/')[-1].replace('.pyc', '.py')
-                        vpn_service_filename = vpn_service.__file__.split('/')[-1].replace('.pyc', '.py')
-                        runtime_filename = runtime.__file__.split('/')[-1].replace('.pyc', '.py')
-                        num_file_descriptors = {'fds_total': 0, 'fds_service_vpn': 0, 'fds_service_api': 0, 'fds_service_watchdog': 0,
-                                                'ofs_total': 0, 'ofs_service_vpn': 0, 'ofs_service_api': 0, 'ofs_service_watchdog': 0}
-                        for proc in psutil.process_iter():
-                            try:
-                                proc_data = proc.as_dict(attrs=['num_fds', 'cmdline', 'open_files'])
-                                nfds = int(proc_data['num_fds'])
-                                nofs = len(proc_data['open_files'])
-                                cmd_line = proc_data['cmdline']
-                                cmd_line_length = len(cmd_line)
-                                num_file_descriptors['fds_total'] += nfds
-                                num_file_descriptors['ofs_total'] += nofs
-                                if cmd_line_length < 2:
-                                    continue
-                                if vpn_service_filename in cmd_line[1]:
-                                    num_file_descriptors['fds_service_vpn'] = nfds
-                                    num_file_descriptors['ofs_service_vpn'] = nofs
-                                elif openmotics_service_filename in cmd_line[1]:
-                                    num_file_descriptors['fds_service_api'] = nfds
-                                    num_file_descriptors['ofs_service_api'] = nofs
-                                elif watchdog_filename in cmd_line[1]:
-                                    num_file_descriptors['fds_service_watchdog'] = nfds
-                                    num_file_descriptors['ofs_service_watchdog'] = nofs
-                                elif cmd_line_length == 4 and runtime_filename in cmd_line[1]:
-                                    plugin_name = cmd_line[-1].split('/')[-1]
-                                    plugin_system_metrics[plugin_name] = {'fds_total': nfds,
-                                                                          'ofs_total': nofs}
-                            except psutil.AccessDenied:
-                                pass
-                        values.update(num_file_descriptors)
-                    except Exception as ex:
-                        logger.error('Error loading pid/fd metrics: {0}'.format(ex))
+                    values['cpu_percent'] = float(psutil.cpu_percent())
+                    cpu_load = [x / psutil.cpu_count() * 100 for x in psutil.getloadavg()]
+                    values['cpu_load_1'] = float(cpu_load[0])
+                    values['cpu_load_5'] = float(cpu_load[1])
+                    values['cpu_load_15'] = float(cpu_load[2])
+                except Exception as ex:
+                    logger.error('Error loading cpu metrics: {0}'.format(ex))
 
                 try:
-                    for key, val in Hardware.read_mmc_ext_csd().items():
-                        values['disk_{}'.format(key)] = val
+                    memory = dict(psutil.virtual_memory()._asdict())
+                    for reading in ['available', 'used', 'percent', 'free', 'inactive', 'shared', 'active', 'total']:
+                        try:
+                            key = 'memory_{0}'.format(reading)
+                            value = memory[reading]
+                            values[key] = int(value) if reading != 'percent' else float(value)
+                        except Exception as ex:
+                            logger.error('error loading memory metric: {0}'.format(ex))
                 except Exception as ex:
-                    logger.error('Error loading disk eMMC metrics: {0}'.format(ex))
+                    logger.error('Error loading memory metrics: {0}'.format(ex))
+
+                try:
+                    disk = dict(psutil.disk_usage('/')._asdict())
+                    for reading in ['total', 'used', 'percent', 'free']:
+                        try:
+                            key = 'disk_{0}'.format(reading)
+                            value = disk[reading]
+                            values[key] = int(value) if reading != 'percent' else float(value)
+                        except Exception as ex:
+                            logger.error('Error loading disk metric: {0}'.format(ex))
 
+                    disk_io = dict(psutil.disk_io_counters()._asdict())
+                    for reading in ['read_count', 'write_count', 'read_bytes', 'write_bytes']:
+                        try:
+                            key = 'disk_{0}'.format(reading)
+                            value = disk_io[reading]
+                            values[key] = int(value)
+                        except Exception as ex:
+                            logger.error('Error loading disk io metric: {0}'.format(ex))
+                except Exception as ex:
+                    logger.error('Error loading disk metrics: {0}'.format(ex))
+
+                try:
+                    network = dict(psutil.net_io_counters()._asdict())
+                    for reading in ['bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv']:
+                        try:
+                            key = 'net_{0}'.format(reading)
+                            value = network[reading]
+                            values[key] = int(value)
+                        except Exception as ex:
+                            logger.error('Error loading network metric: {0}'.format(ex))
+                except Exception as ex:
+                    logger.error('Error loading network metrics: {0}'.format(ex))
+
+                try:
+                    import openmotics_service
+                    import watchdog
+                    import vpn_service
+                    from plugin_runtime import runtime
+                    openmotics_service_filename = openmotics_service.__file__.split('/')[-1].replace('.pyc', '.py')
+                    watchdog_filename = watchdog.__file__.split('/')[-1].replace('.pyc', '.py')
+                    vpn_service_filename = vpn_service.__file__.split('/')[-1].replace('.pyc', '.py')
+                    runtime_filename = runtime.__file__.split('/')[-1].replace('.pyc', '.py')
+                    num_file_descriptors = {'fds_total': 0, 'fds_service_vpn': 0, 'fds_service_api': 0, 'fds_service_watchdog': 0,
+                                            'ofs_total': 0, 'ofs_service_vpn': 0, 'ofs_service_api': 0, 'ofs_service_watchdog': 0}
+                    for proc in psutil.process_iter():
+                        try:
+                            proc_data = proc.as_dict(attrs=['num_fds', 'cmdline', 'open_files'])
+                            nfds = int(proc_data['num_fds'])
+                            nofs = len(proc_data['open_files'])
+                            cmd_line = proc_data['cmdline']
+                            cmd_line_length = len(cmd_line)
+                            num_file_descriptors['fds_total'] += nfds
+                            num_file_descriptors['ofs_total'] += nofs
+                            if cmd_line_length < 2:
+                                continue
+                            if vpn_service_filename in cmd_line[1]:
+                                num_file_descriptors['fds_service_vpn'] = nfds
+                                num_file_descriptors['ofs_service_vpn'] = nofs
+                            elif openmotics_service_filename in cmd_line[1]:
+                                num_file_descriptors['fds_service_api'] = nfds
+                                num_file_descriptors['ofs_service_api'] = nofs
+                            elif watchdog_filename in cmd_line[1]:
+                                num_file_descriptors['fds_service_watchdog'] = nfds
+                                num_file_descriptors['ofs_service_watchdog'] = nofs
+                            elif cmd_line_length == 4 and runtime_filename in cmd_line[1]:
+                                plugin_name = cmd_line[-1].split('/')[-1]
+                                plugin_system_metrics[plugin_name] = {'fds_total': nfds,
+                                                                      'ofs_total': nofs}
+                        except psutil.AccessDenied:
+                            pass
+                    values.update(num_file_descriptors)
+                except Exception as ex:
+                    logger.error('Error loading pid/fd metrics: {0}'.format(ex))
+
+            try:
+                for key, val in Hardware.read_mmc_ext_csd().items():
+                    values['disk_{}'.format(key)] = val
+            except Exception as ex:
+                logger.error('Error loading disk eMMC metrics: {0}'.format(ex))
+
+            self._enqueue_metrics(metric_type=metric_type,
+                                  values=values,
+                                  tags={'name': 'gateway',
+                                        'section': 'main'},
+                                  timestamp=now)
+            database_statistics = Database.get_statistics()
+            self._enqueue_metrics(metric_type=metric_type,
+                                  values={'db_queries': database_statistics['queries'],
+                                          'db_query_time': database_statistics['query_time'],
+                                          'db_slow_queries': database_statistics['slow_queries'],
+                                          'db_locked': database_statistics['locked'],
+                                          'db_connections': database_statistics['connections']},
+                                  tags={'name': 'gateway',
+                                        'section': 'database'},
+                                  timestamp=now)
+            memory_statistics = self._module_controller.get_master_memory_statistics()
+            if memory_statistics:
                 self._enqueue_metrics(metric_type=metric_type,
-                                      values=values,
+                                      values={'memory_bytes_written': memory_statistics['bytes_written'],
+                                              'memory_bytes_skipped': memory_statistics['bytes_skipped'],
+                                              'memory_write_commands': memory_statistics['write_commands'],
+                                              'memory_commits': memory_statistics['commits'],
+                                              'memory_activations': memory_statistics['activations'],
+                                              'memory_activations_avoided': memory_statistics['activations_avoided']},
                                       tags={'name': 'gateway',
-                                            'section': 'main'},
+                                            'section': 'master'},
                                       timestamp=now)
-            except Exception as ex:
-                logger.exception('Error sending system data: {0}'.format(ex))
-            if self._metrics_controller is not None:
-                try:
+        except Exception as ex:
+            logger.exception('Error sending system data: {0}'.format(ex))
+        if self._metrics_controller is not None:
+            try:
+                self._enqueue_metrics(metric_type=metric_type,
+                                      tags={'name': 'gateway',
+                                            'section': 'plugins'},
+                                      values={'queue_length': len(self._metrics_controller.metrics_queue_plugins)},
+                                      timestamp=now)
+                self._enqueue_metrics(metric_type=metric_type,
+                                      tags={'name': 'gateway',
+                                            'section': 'openmotics'},
+                                      values={'queue_length': len(self._metrics_controller.metrics_queue_openmotics)},
+                                      timestamp=now)
+                self._enqueue_metrics(metric_type=metric_type,
+                                      tags={'name': 'gateway',
+                                            'section': 'cloud'},
+                                      values={'cloud_queue_length': self._metrics_controller.cloud_stats['queue'],
+                                              'cloud_buffer_length': self._metrics_controller.cloud_stats['buffer'],
+                                              'cloud_spool_length': self._metrics_controller.cloud_stats['spool'],
+                                              'cloud_time_ago_send': self._metrics_controller.cloud_stats['time_ago_send'],
+                                              'cloud_time_ago_try': self._metrics_controller.cloud_stats['time_ago_try']},
+                                      timestamp=now)
+                assert self._plugin_controller
+                for plugin in self._plugin_controller.get_plugins():
+                    latency_statistics = plugin.get_latency_statistics()
+                    plugin_values = {'queue_length': plugin.get_queue_length(),
+                                     'command_latency': latency_statistics['average']}
+                    for bucket, value_name in MetricsCollector.PLUGIN_LATENCY_BUCKETS:
+                        plugin_values[value_name] = latency_statistics['histogram'].get(bucket, 0)
+                    if plugin.name in plugin_system_metrics:
+                        plugin_values.update(plugin_system_metrics[plugin.name])
                     self._enqueue_metrics(metric_type=metric_type,
                                           tags={'name': 'gateway',
-                                                'section': 'plugins'},
-                                          values={'queue_length': len(self._metrics_controller.metrics_queue_plugins)},
+                                                'section': plugin.name},
+                                          values=plugin_values,
                                           timestamp=now)
+                for key in set(self._metrics_controller.inbound_rates.keys()) | set(self._metrics_controller.outbound_rates.keys()):
                     self._enqueue_metrics(metric_type=metric_type,
                                           tags={'name': 'gateway',
-                                                'section': 'openmotics'},
-                                          values={'queue_length': len(self._metrics_controller.metrics_queue_openmotics)},
+                                                'section': key},
+                                          values={'metrics_in': self._metrics_controller.inbound_rates.get(key, 0),
+                                                  'metrics_out': self._metrics_controller.outbound_rates.get(key, 0)},
                                           timestamp=now)
+                scheduler_statistics = self._scheduler.get_statistics()
+                for mtype in self.intervals:
                     self._enqueue_metrics(metric_type=metric_type,
                                           tags={'name': 'gateway',
-                                                'section': 'cloud'},
-                                          values={'cloud_queue_length': self._metrics_controller.cloud_stats['queue'],
-                                                  'cloud_buffer_length': self._metrics_controller.cloud_stats['buffer'],
-                                                  'cloud_time_ago_send': self._metrics_controller.cloud_stats['time_ago_send'],
-                                                  'cloud_time_ago_try': self._metrics_controller.cloud_stats['time_ago_try']},
+                                                'section': mtype},
+                                          values={'metric_interval': self.intervals[mtype],
+                                                  'metric_lateness': scheduler_statistics.get(mtype, {}).get('lateness', 0.0)},
                                           timestamp=now)
-                    assert self._plugin_controller
-                    for plugin in self._plugin_controller.get_plugins():
-                        plugin_values = {'queue_length': plugin.get_queue_length()}
-                        if plugin.name in plugin_system_metrics:
-                            plugin_values.update(plugin_system_metrics[plugin.name])
-                        self._enqueue_metrics(metric_type=metric_type,
-                                              tags={'name': 'gateway',
-                                                    'section': plugin.name},
-                                              values=plugin_values,
-                                              timestamp=now)
-                    for key in set(self._metrics_controller.inbound_rates.keys()) | set(self._metrics_controller.outbound_rates.keys()):
-                        self._enqueue_metrics(metric_type=metric_type,
-                                              tags={'name': 'gateway',
-                                                    'section': key},
-                                              values={'metrics_in': self._metrics_controller.inbound_rates.get(key, 0),
-                                                      'metrics_out': self._metrics_controller.outbound_rates.get(key, 0)},
-                                              timestamp=now)
-                    for mtype in self.intervals:
-                        self._enqueue_metrics(metric_type=metric_type,
-                                              tags={'name': 'gateway',
-                                                    'section': mtype},
-                                              values={'metric_interval': self.intervals[mtype]},
-                                              timestamp=now)
-                except Exception as ex:
-                    logger.error('Could not collect metric metrics: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+            except Exception as ex:
+                logger.error('Could not collect metric metrics: {0}'.format(ex))
 
     def _run_outputs(self, metric_type):
         # type: (str) -> None
-        while not self._stopped:
-            start = time.time()
-            try:
-                result = self._output_controller.get_output_statuses()
-                for output_state_dto in result:
-                    if output_state_dto.id not in self._environment_outputs:
-                        continue
-                    output_dto, output_status = self._environment_outputs[output_state_dto.id]
-                    output_status.update({'status': output_state_dto.status,
-                                          'dimmer': output_state_dto.dimmer})
-            except CommunicationFailure as ex:
-                logger.error('Error getting output status: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error getting output status: {0}'.format(ex))
-            self._process_outputs(list(self._environment_outputs.keys()), metric_type)
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        try:
+            result = self._output_controller.get_output_statuses()
+            for output_state_dto in result:
+                if output_state_dto.id not in self._environment_outputs:
+                    continue
+                output_dto, output_status = self._environment_outputs[output_state_dto.id]
+                output_status.update({'status': output_state_dto.status,
+                                      'dimmer': output_state_dto.dimmer})
+        except CommunicationFailure as ex:
+            logger.error('Error getting output status: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error getting output status: {0}'.format(ex))
+        self._process_outputs(list(self._environment_outputs.keys()), metric_type)
 
     def _run_shutters(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            try:
-                self._process_shutters(metric_type)
-            except CommunicationFailure as ex:
-                logger.error('Error getting shutter status: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error getting shutter status: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        try:
+            self._process_shutters(metric_type)
+        except CommunicationFailure as ex:
+            logger.error('Error getting shutter status: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error getting shutter status: {0}'.format(ex))
 
     def _process_shutters(self, metric_type):
         # type: (str) -> None
@@ -539,23 +661,18 @@ class MetricsCollector(object):
             values['state'] = shutter_status_dto.state
             values['position'] = shutter_status_dto.position
             values['desired_position'] = shutter_status_dto.desired_position
-            self._enqueue_metrics(metric_type=metric_type,
-                                  values=values,
-                                  tags=tags,
-                                  timestamp=now)
+            self._enqueue_changed_metrics(metric_type=metric_type,
+                                          values=values,
+                                          tags=tags,
+                                          timestamp=now)
 
     def _run_sensors(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            try:
-                self._process_sensors(metric_type)
-            except CommunicationFailure as ex:
-                logger.error('Error getting sensor status: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error getting sensor status: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        try:
+            self._process_sensors(metric_type)
+        except CommunicationFailure as ex:
+            logger.error('Error getting sensor status: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error getting sensor status: {0}'.format(ex))
 
     def _process_sensors(self, metric_type):
         # type: (str) -> None
@@ -573,128 +690,108 @@ class MetricsCollector(object):
                 values[sensor_dto.physical_quantity] = status.value
             if len(values) == 0:
                 continue
-            self._enqueue_metrics(metric_type=metric_type,
-                                  values=values,
-                                  tags=tags,
-                                  timestamp=now)
+            self._enqueue_changed_metrics(metric_type=metric_type,
+                                          values=values,
+                                          tags=tags,
+                                          timestamp=now)
 
     def _run_thermostats(self, metric_type):
         # type: (str) -> None
-        while not self._stopped:
-            start = time.time()
-            try:
-                now = time.time()
-                # TODO: handle metrics for groups, what's the uscase here other than
-                # tracking current_temperature + output levels?
-                for status in self._thermostat_controller.get_thermostat_group_status():
-                    group_on = False
-                    for thermostat in status.statusses:
-                        values = {'setpoint': int(thermostat.setpoint),
-                                  'output0': convert_float(thermostat.output_0_level),
-                                  'output1': convert_float(thermostat.output_1_level),
-                                  'steering_power': convert_float(thermostat.steering_power),
-                                  'state': thermostat.state,
-                                  'automatic': thermostat.automatic,
-                                  'current_setpoint': convert_float(thermostat.setpoint_temperature)}
-                        if thermostat.outside_temperature is not None:
-                            values['outside'] = float(thermostat.outside_temperature)
-                        if thermostat.actual_temperature is not None:
-                            values['temperature'] = float(thermostat.actual_temperature)
-                        self._enqueue_metrics(metric_type=metric_type,
-                                              values=values,
-                                              tags={'id': '{0}.{1}'.format('C' if status.cooling is True else 'H',
-                                                                           thermostat.id)},
-                                              timestamp=now)
-                        group_on = group_on or thermostat.state == 'on'
-
+        try:
+            now = time.time()
+            # TODO: handle metrics for groups, what's the uscase here other than
+            # tracking current_temperature + output levels?
+            for status in self._thermostat_controller.get_thermostat_group_status():
+                group_on = False
+                for thermostat in status.statusses:
+                    values = {'setpoint': int(thermostat.setpoint),
+                              'output0': convert_float(thermostat.output_0_level),
+                              'output1': convert_float(thermostat.output_1_level),
+                              'steering_power': convert_float(thermostat.steering_power),
+                              'state': thermostat.state,
+                              'automatic': thermostat.automatic,
+                              'current_setpoint': convert_float(thermostat.setpoint_temperature)}
+                    if thermostat.outside_temperature is not None:
+                        values['outside'] = float(thermostat.outside_temperature)
+                    if thermostat.actual_temperature is not None:
+                        values['temperature'] = float(thermostat.actual_temperature)
                     self._enqueue_metrics(metric_type=metric_type,
-                                          values={'on': group_on,
-                                                  'cooling': status.cooling},
-                                          tags={'id': 'G.{0}'.format(status.number)},
+                                          values=values,
+                                          tags={'id': '{0}.{1}'.format('C' if status.cooling is True else 'H',
+                                                                       thermostat.id)},
                                           timestamp=now)
-            except CommunicationFailure as ex:
-                logger.error('Error getting thermostat status: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error getting thermostat status: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+                    group_on = group_on or thermostat.state == 'on'
+
+                self._enqueue_metrics(metric_type=metric_type,
+                                      values={'on': group_on,
+                                              'cooling': status.cooling},
+                                      tags={'id': 'G.{0}'.format(status.number)},
+                                      timestamp=now)
+        except CommunicationFailure as ex:
+            logger.error('Error getting thermostat status: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error getting thermostat status: {0}'.format(ex))
 
     def _run_errors(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            try:
-                now = time.time()
-                errors = self._module_controller.master_error_list()
-                for error in errors:
-                    om_module = error[0]
-                    count = error[1]
-                    types = {'i': 'Input',
-                             'I': 'Input',
-                             't': 'Temperature',
-                             'T': 'Temperature',
-                             'o': 'Output',
-                             'O': 'Output',
-                             'd': 'Dimmer',
-                             'D': 'Dimmer',
-                             'R': 'Shutter',
-                             'C': 'CAN',
-                             'L': 'OLED'}
-                    module_type = types.get(om_module[0], 'Unknown {0}'.format(om_module[0]))
-                    self._enqueue_metrics(metric_type=metric_type,
-                                          values={'value': int(count)},
-                                          tags={'type': module_type,
-                                                'id': om_module,
-                                                'name': '{0} {1}'.format(module_type, om_module)},
-                                          timestamp=now)
-            except CommunicationFailure as ex:
-                logger.error('Error getting module errors: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error getting module errors: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        try:
+            now = time.time()
+            errors = self._module_controller.master_error_list()
+            for error in errors:
+                om_module = error[0]
+                count = error[1]
+                types = {'i': 'Input',
+                         'I': 'Input',
+                         't': 'Temperature',
+                         'T': 'Temperature',
+                         'o': 'Output',
+                         'O': 'Output',
+                         'd': 'Dimmer',
+                         'D': 'Dimmer',
+                         'R': 'Shutter',
+                         'C': 'CAN',
+                         'L': 'OLED'}
+                module_type = types.get(om_module[0], 'Unknown {0}'.format(om_module[0]))
+                self._enqueue_metrics(metric_type=metric_type,
+                                      values={'value': int(count)},
+                                      tags={'type': module_type,
+                                            'id': om_module,
+                                            'name': '{0} {1}'.format(module_type, om_module)},
+                                      timestamp=now)
+        except CommunicationFailure as ex:
+            logger.error('Error getting module errors: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error getting module errors: {0}'.format(ex))
 
     def _run_pulsecounters(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            now = time.time()
-            counters_data = {}
-            try:
-                for counter_id, counter_dto in self._environment_pulse_counters.items():
-                    counters_data[counter_id] = {'name': counter_dto.name,
-                                                 'input': counter_dto.input_id,
-                                                 'in_use': counter_dto.in_use}
-                values = self._pulse_counter_controller.get_values()
-                for counter_id in counters_data:
-                    if counter_id in values:
-                        counters_data[counter_id]['count'] = values[counter_id]
-                for counter_id in counters_data:
-                    counter = counters_data[counter_id]
-                    if not counter['in_use'] or counter['count'] is None:
-                        continue
-                    self._enqueue_metrics(metric_type=metric_type,
-                                          values={'value': int(counter['count'])},
-                                          tags={'name': counter['name'],
-                                                'input': counter['input'],
-                                                'id': 'P{0}'.format(counter_id)},
-                                          timestamp=now)
-            except CommunicationFailure as ex:
-                logger.error('Error getting pulse counter status: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error getting pulse counter status: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        now = time.time()
+        counters_data = {}
+        try:
+            for counter_id, counter_dto in self._environment_pulse_counters.items():
+                counters_data[counter_id] = {'name': counter_dto.name,
+                                             'input': counter_dto.input_id,
+                                             'in_use': counter_dto.in_use}
+            values = self._pulse_counter_controller.get_values()
+            for counter_id in counters_data:
+                if counter_id in values:
+                    counters_data[counter_id]['count'] = values[counter_id]
+            for counter_id in counters_data:
+                counter = counters_data[counter_id]
+                if not counter['in_use'] or counter['count'] is None:
+                    continue
+                self._enqueue_metrics(metric_type=metric_type,
+                                      values={'value': int(counter['count'])},
+                                      tags={'name': counter['name'],
+                                            'input': counter['input'],
+                                            'id': 'P{0}'.format(counter_id)},
+                                      timestamp=now)
+        except CommunicationFailure as ex:
+            logger.error('Error getting pulse counter status: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error getting pulse counter status: {0}'.format(ex))
 
     def _run_energy_openmotics(self, metric_type):
         # type: (str) -> None
-        while not self._stopped:
-            start = time.time()
-            self._process_energy_metrics(metric_type)
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        self._process_energy_metrics(metric_type)
 
     def _process_energy_metrics(self, metric_type):
         # type: (str) -> None
@@ -801,147 +898,137 @@ class MetricsCollector(object):
                 logger.exception('Error processing OpenMotics power device {0}: {1}'.format(device_id, ex))
 
     def _run_energy_openmotics_analytics(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            try:
-                now = time.time()
-                result = self._energy_module_controller.load_modules()
-                for energy_module in result:
-                    device_id = '{0}.{{0}}'.format(energy_module.formatted_address)
-                    if energy_module.version != EnergyEnums.Version.ENERGY_MODULE:
+        try:
+            now = time.time()
+            result = self._energy_module_controller.load_modules()
+            for energy_module in result:
+                device_id = '{0}.{{0}}'.format(energy_module.formatted_address)
+                if energy_module.version != EnergyEnums.Version.ENERGY_MODULE:
+                    continue
+                result = self._energy_module_controller.get_energy_time(energy_module.id)
+                abort = False
+                for i in range(12):
+                    if abort is True:
+                        break
+                    name = getattr(energy_module, 'input{0}'.format(i))
+                    if name == '':
                         continue
-                    result = self._energy_module_controller.get_energy_time(energy_module.id)
-                    abort = False
-                    for i in range(12):
-                        if abort is True:
-                            break
-                        name = getattr(energy_module, 'input{0}'.format(i))
-                        if name == '':
-                            continue
-                        timestamp = now
-                        length = min(len(result[str(i)]['current']), len(result[str(i)]['voltage']))
-                        for j in range(length):
-                            self._enqueue_metrics(metric_type=metric_type,
-                                                  values={'current': result[str(i)]['current'][j],
-                                                          'voltage': result[str(i)]['voltage'][j]},
-                                                  tags={'id': device_id.format(i),
-                                                        'name': name,
-                                                        'type': 'time'},
-                                                  timestamp=timestamp)
-                            timestamp += 0.250  # Stretch actual data by 1000 for visualtisation purposes
-                    result = self._energy_module_controller.get_energy_frequency(energy_module.id)
-                    abort = False
-                    for i in range(12):
-                        if abort is True:
-                            break
-                        name = getattr(energy_module, 'input{0}'.format(i))
-                        if name == '':
-                            continue
-                        timestamp = now
-                        length = min(len(result[str(i)]['current'][0]), len(result[str(i)]['voltage'][0]))
-                        for j in range(length):
-                            self._enqueue_metrics(metric_type=metric_type,
-                                                  values={'current_harmonics': result[str(i)]['current'][0][j],
-                                                          'current_phase': result[str(i)]['current'][1][j],
-                                                          'voltage_harmonics': result[str(i)]['voltage'][0][j],
-                                                          'voltage_phase': result[str(i)]['voltage'][1][j]},
-                                                  tags={'id': device_id.format(i),
-                                                        'name': name,
-                                                        'type': 'frequency'},
-                                                  timestamp=timestamp)
-                            timestamp += 0.250  # Stretch actual data by 1000 for visualtisation purposes
-            except CommunicationFailure as ex:
-                logger.error('Error getting power analytics: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error getting power analytics: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
-
-    def _load_environment_configurations(self, name, interval):  # type: (str, int) -> None
-        while not self._stopped:
-            start = time.time()
-            # Inputs
-            try:
-                inputs = self._input_controller.load_inputs()
-                ids = []
-                for input_dto in inputs:
-                    input_id = input_dto.id
-                    ids.append(input_id)
-                    self._environment_inputs[input_id] = input_dto
-                for input_id in self._environment_inputs.keys():
-                    if input_id not in ids:
-                        del self._environment_inputs[input_id]
-            except CommunicationFailure as ex:
-                logger.error('Error while loading input configurations: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error while loading input configurations: {0}'.format(ex))
-            # Outputs
-            try:
-                outputs = self._output_controller.load_outputs()
-                ids = []
-                for output_dto in outputs:
-                    if output_dto.module_type not in ['o', 'O', 'd', 'D']:
+                    timestamp = now
+                    length = min(len(result[str(i)]['current']), len(result[str(i)]['voltage']))
+                    for j in range(length):
+                        self._enqueue_metrics(metric_type=metric_type,
+                                              values={'current': result[str(i)]['current'][j],
+                                                      'voltage': result[str(i)]['voltage'][j]},
+                                              tags={'id': device_id.format(i),
+                                                    'name': name,
+                                                    'type': 'time'},
+                                              timestamp=timestamp)
+                        timestamp += 0.250  # Stretch actual data by 1000 for visualtisation purposes
+                result = self._energy_module_controller.get_energy_frequency(energy_module.id)
+                abort = False
+                for i in range(12):
+                    if abort is True:
+                        break
+                    name = getattr(energy_module, 'input{0}'.format(i))
+                    if name == '':
                         continue
-                    output_id = output_dto.id
-                    ids.append(output_id)
-                    # TODO: Don't cache the status here, but ask it to the OutputController when relevant
-                    self._environment_outputs[output_id] = (output_dto, {})
-                for output_id in self._environment_outputs.keys():
-                    if output_id not in ids:
-                        del self._environment_outputs[output_id]
-            except CommunicationFailure as ex:
-                logger.error('Error while loading output configurations: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error while loading output configurations: {0}'.format(ex))
-            # Shutters
-            try:
-                shutters = self._shutter_controller.load_shutters()
-                ids = []
-                for shutter_dto in shutters:
-                    shutter_id = shutter_dto.id
-                    ids.append(shutter_id)
-                    self._environment_shutters[shutter_id] = shutter_dto
-                for shutter_id in self._environment_shutters.keys():
-                    if shutter_id not in ids:
-                        del self._environment_shutters[shutter_id]
-            except CommunicationFailure as ex:
-                logger.error('Error while loading shutter configurations: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error while loading shutter configurations: {0}'.format(ex))
-            # Sensors
-            try:
-                sensors = self._sensor_controller.load_sensors()
-                ids = []
-                for sensor_dto in sensors:
-                    sensor_id = sensor_dto.id
-                    ids.append(sensor_id)
-                    self._environment_sensors[sensor_id] = sensor_dto
-                for sensor_id in self._environment_sensors.keys():
-                    if sensor_id not in ids:
-                        del self._environment_sensors[sensor_id]
-            except CommunicationFailure as ex:
-                logger.error('Error while loading sensor configurations: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error while loading sensor configurations: {0}'.format(ex))
-            # Pulse counters
-            try:
-                pulse_counters = self._pulse_counter_controller.load_pulse_counters()
-                ids = []
-                for pulse_counter_dto in pulse_counters:
-                    pulse_counter_id = pulse_counter_dto.id
-                    ids.append(pulse_counter_id)
-                    self._environment_pulse_counters[pulse_counter_id] = pulse_counter_dto
-                for pulse_counter_id in self._environment_pulse_counters.keys():
-                    if pulse_counter_id not in ids:
-                        del self._environment_pulse_counters[pulse_counter_id]
-            except CommunicationFailure as ex:
-                logger.error('Error while loading pulse counter configurations: {}'.format(ex))
-            except Exception as ex:
-                logger.exception('Error while loading pulse counter configurations: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, name, interval)
+                    timestamp = now
+                    length = min(len(result[str(i)]['current'][0]), len(result[str(i)]['voltage'][0]))
+                    for j in range(length):
+                        self._enqueue_metrics(metric_type=metric_type,
+                                              values={'current_harmonics': result[str(i)]['current'][0][j],
+                                                      'current_phase': result[str(i)]['current'][1][j],
+                                                      'voltage_harmonics': result[str(i)]['voltage'][0][j],
+                                                      'voltage_phase': result[str(i)]['voltage'][1][j]},
+                                              tags={'id': device_id.format(i),
+                                                    'name': name,
+                                                    'type': 'frequency'},
+                                              timestamp=timestamp)
+                        timestamp += 0.250  # Stretch actual data by 1000 for visualtisation purposes
+        except CommunicationFailure as ex:
+            logger.error('Error getting power analytics: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error getting power analytics: {0}'.format(ex))
+
+    def _load_environment_configurations(self):  # type: () -> None
+        # Inputs
+        try:
+            inputs = self._input_controller.load_inputs()
+            ids = []
+            for input_dto in inputs:
+                input_id = input_dto.id
+                ids.append(input_id)
+                self._environment_inputs[input_id] = input_dto
+            for input_id in self._environment_inputs.keys():
+                if input_id not in ids:
+                    del self._environment_inputs[input_id]
+        except CommunicationFailure as ex:
+            logger.error('Error while loading input configurations: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error while loading input configurations: {0}'.format(ex))
+        # Outputs
+        try:
+            outputs = self._output_controller.load_outputs()
+            ids = []
+            for output_dto in outputs:
+                if output_dto.module_type not in ['o', 'O', 'd', 'D']:
+                    continue
+                output_id = output_dto.id
+                ids.append(output_id)
+                # TODO: Don't cache the status here, but ask it to the OutputController when relevant
+                self._environment_outputs[output_id] = (output_dto, {})
+            for output_id in self._environment_outputs.keys():
+                if output_id not in ids:
+                    del self._environment_outputs[output_id]
+        except CommunicationFailure as ex:
+            logger.error('Error while loading output configurations: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error while loading output configurations: {0}'.format(ex))
+        # Shutters
+        try:
+            shutters = self._shutter_controller.load_shutters()
+            ids = []
+            for shutter_dto in shutters:
+                shutter_id = shutter_dto.id
+                ids.append(shutter_id)
+                self._environment_shutters[shutter_id] = shutter_dto
+            for shutter_id in self._environment_shutters.keys():
+                if shutter_id not in ids:
+                    del self._environment_shutters[shutter_id]
+        except CommunicationFailure as ex:
+            logger.error('Error while loading shutter configurations: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error while loading shutter configurations: {0}'.format(ex))
+        # Sensors
+        try:
+            sensors = self._sensor_controller.load_sensors()
+            ids = []
+            for sensor_dto in sensors:
+                sensor_id = sensor_dto.id
+                ids.append(sensor_id)
+                self._environment_sensors[sensor_id] = sensor_dto
+            for sensor_id in self._environment_sensors.keys():
+                if sensor_id not in ids:
+                    del self._environment_sensors[sensor_id]
+        except CommunicationFailure as ex:
+            logger.error('Error while loading sensor configurations: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error while loading sensor configurations: {0}'.format(ex))
+        # Pulse counters
+        try:
+            pulse_counters = self._pulse_counter_controller.load_pulse_counters()
+            ids = []
+            for pulse_counter_dto in pulse_counters:
+                pulse_counter_id = pulse_counter_dto.id
+                ids.append(pulse_counter_id)
+                self._environment_pulse_counters[pulse_counter_id] = pulse_counter_dto
+            for pulse_counter_id in self._environment_pulse_counters.keys():
+                if pulse_counter_id not in ids:
+                    del self._environment_pulse_counters[pulse_counter_id]
+        except CommunicationFailure as ex:
+            logger.error('Error while loading pulse counter configurations: {}'.format(ex))
+        except Exception as ex:
+            logger.exception('Error while loading pulse counter configurations: {0}'.format(ex))
 
     def get_definitions(self):
         """
@@ -1117,10 +1204,82 @@ class MetricsCollector(object):
                           'description': 'Metrics queue length',
                           'type': 'gauge',
                           'unit': ''},
+                         {'name': 'command_latency',
+                          'description': 'Average response time of plugin commands',
+                          'type': 'gauge',
+                          'unit': 'seconds'},
+                         {'name': 'command_latency_1ms',
+                          'description': 'Number of plugin commands answered within 1ms',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'command_latency_10ms',
+                          'description': 'Number of plugin commands answered between 1ms and 10ms',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'command_latency_100ms',
+                          'description': 'Number of plugin commands answered between 10ms and 100ms',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'command_latency_1s',
+                          'description': 'Number of plugin commands answered between 100ms and 1s',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'command_latency_slow',
+                          'description': 'Number of plugin commands answered in 1s or more',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'db_queries',
+                          'description': 'Number of database queries since the previous collection',
+                          'type': 'gauge',
+                          'unit': ''},
+                         {'name': 'db_query_time',
+                          'description': 'Total duration of the database queries since the previous collection',
+                          'type': 'gauge',
+                          'unit': 'seconds'},
+                         {'name': 'db_slow_queries',
+                          'description': 'Number of slow (mostly waiting on a lock) database queries since the previous collection',
+                          'type': 'gauge',
+                          'unit': ''},
+                         {'name': 'db_locked',
+                          'description': 'Number of database queries that failed on a locked database since the previous collection',
+                          'type': 'gauge',
+                          'unit': ''},
+                         {'name': 'db_connections',
+                          'description': 'Database connections in use',
+                          'type': 'gauge',
+                          'unit': ''},
+                         {'name': 'memory_bytes_written',
+                          'description': 'Number of master memory bytes written',
+                          'type': 'counter',
+                          'unit': 'bytes'},
+                         {'name': 'memory_bytes_skipped',
+                          'description': 'Number of master memory bytes not written as they were unchanged',
+                          'type': 'counter',
+                          'unit': 'bytes'},
+                         {'name': 'memory_write_commands',
+                          'description': 'Number of master memory write commands',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'memory_commits',
+                          'description': 'Number of master memory commits',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'memory_activations',
+                          'description': 'Number of master memory activations',
+                          'type': 'counter',
+                          'unit': ''},
+                         {'name': 'memory_activations_avoided',
+                          'description': 'Number of master memory commits that did not need a separate activation',
+                          'type': 'counter',
+                          'unit': ''},
                          {'name': 'metric_interval',
                           'description': 'Interval on which OM metrics are collected',
                           'type': 'gauge',
                           'unit': 'seconds'},
+                         {'name': 'metric_lateness',
+                          'description': 'Delay of the last OM metrics collection compared to its schedule',
+                          'type': 'gauge',
+                          'unit': 'seconds'},
                          {'name': 'cloud_queue_length',
                           'description': 'Length of the memory queue of metrics to be send to the Cloud',
                           'type': 'gauge',
@@ -1129,6 +1288,10 @@ class MetricsCollector(object):
                           'description': 'Length of the on-disk buffer of metrics to be send to the Cloud',
                           'type': 'gauge',
                           'unit': ''},
+                         {'name': 'cloud_spool_length',
+                          'description': 'Length of the on-disk spool of metrics that did not fit the memory queue',
+                          'type': 'gauge',
+                          'unit': ''},
                          {'name': 'cloud_time_ago_send',
                           'description': 'Time passed since the last time metrics were send to the Cloud',
                           'type': 'gauge',
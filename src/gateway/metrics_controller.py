@@ -27,12 +27,13 @@ import six
 
 from bus.om_bus_events import OMBusEvents
 from gateway.daemon_thread import DaemonThread, DaemonThreadWait
+from gateway.metrics_history import MetricsHistory
 from gateway.models import Config
 from ioc import INJECTED, Inject, Injectable, Singleton
 from platform_utils import System
 
 if False:  # MYPY
-    from typing import Any, Dict, Optional, List
+    from typing import Any, Dict, Optional, List, Tuple
     from cloud.cloud_api_client import CloudAPIClient
     from gateway.config_controller import ConfigurationController
     from gateway.metrics_caching import MetricsCacheController
@@ -46,13 +47,38 @@ class MetricsDistributeFailed(Exception):
     pass
 
 
+class MetricRoute(object):
+    """
+    Precompiled routing information for all metrics of a given source and type
+    """
+
+    def __init__(self, definition, persist_counters, buffer_counters):
+        # type: (Optional[Dict[str,Any]], Dict[str,Any], Dict[str,Any]) -> None
+        self.definition = definition
+        self.persist_counters = persist_counters
+        self.buffer_counters = buffer_counters
+        self.tags = [] if definition is None else sorted(definition['tags'])  # type: List[str]
+        self._identifier_template = '|'.join(['{0}={{{1}}}'.format(tag.replace('{', '{{').replace('}', '}}'), index)
+                                              for index, tag in enumerate(self.tags)])
+
+    def get_identifier(self, tags):  # type: (Dict[str,Any]) -> str
+        return self._identifier_template.format(*[tags[tag] for tag in self.tags])
+
+
 @Injectable.named('metrics_controller')
 @Singleton
 class MetricsController(object):
     """
     The Metrics Controller collects all metrics and pushses them to all subscribers
+
+    Metrics for the Cloud are kept in a bounded memory queue. When the Cloud can't be reached and the queue is full,
+    the oldest metrics are moved to an on-disk spool which is replayed (oldest first) once uploading succeeds again.
     """
 
+    CLOUD_QUEUE_LENGTH = 5000
+    CLOUD_SPOOL_BATCH_SIZE = 100
+    CLOUD_REPLAY_BATCH_SIZE = 1000
+
     @Inject
     def __init__(self, cloud_api_client=INJECTED, plugin_controller=INJECTED, metrics_collector=INJECTED, metrics_cache_controller=INJECTED):
         # type: (CloudAPIClient, PluginController, MetricsCollector, MetricsCacheController) -> None
@@ -64,7 +90,10 @@ class MetricsController(object):
         self._buffer_counters = {}  # type: Dict
         self.definitions = {}  # type: Dict
         self._definition_filters = {'source': {}, 'metric_type': {}}  # type: Dict
+        self._routes = {}  # type: Dict[Tuple[str,str],MetricRoute]
+        self._cloud_config = None  # type: Optional[Dict[str,Any]]
         self._metrics_cache = {}  # type: Dict
+        self._history = MetricsHistory()
         self._collector_plugins = None  # type: Optional[DaemonThread]
         self._collector_openmotics = None  # type: Optional[DaemonThread]
         self._internal_stats = None
@@ -76,9 +105,11 @@ class MetricsController(object):
         self.outbound_rates = {'total': 0}
         self._openmotics_receivers = []  # type: List
         self._cloud_cache = {}  # type: Dict
-        self._cloud_queue = []  # type: List
+        self._cloud_queue = deque()  # type: deque
         self._cloud_buffer = []  # type: List
         self._cloud_buffer_length = 0
+        self._cloud_spool_pending = []  # type: List
+        self._cloud_spool_length = self._metrics_cache_controller.get_spool_length()
         self._load_cloud_buffer()
         self._cloud_last_send = time.time()
         self._cloud_last_try = time.time()
@@ -86,6 +117,7 @@ class MetricsController(object):
         self._throttled_down = False
         self.cloud_stats = {'queue': 0,
                             'buffer': self._cloud_buffer_length,
+                            'spool': self._cloud_spool_length,
                             'time_ago_send': 0,
                             'time_ago_try': 0}
 
@@ -97,7 +129,9 @@ class MetricsController(object):
             self._buffer_counters.setdefault('OpenMotics', {})[definition['type']] = settings['buffer']
 
     def start(self):
+        self._metrics_cache_controller.start()
         self._refresh_cloud_interval()
+        self._history.max_series = Config.get_entry('metrics_history_max_series', MetricsHistory.MAX_SERIES)
         self._collector_plugins = DaemonThread(name='metricplugincoll',
                                                target=self._collect_plugins,
                                                interval=1)
@@ -125,6 +159,7 @@ class MetricsController(object):
             self._distributor_plugins.stop()
         if self._distributor_openmotics is not None:
             self._distributor_openmotics.stop()
+        self._metrics_cache_controller.stop()
 
     def set_cloud_interval(self, metric_type, interval, save=True):
         logger.info('Setting cloud interval {0}_{1}'.format(metric_type, interval))
@@ -227,6 +262,42 @@ class MetricsController(object):
                 self._buffer_counters.pop(source, None)
         self._definition_filters['source'] = {}
         self._definition_filters['metric_type'] = {}
+        self._routes = {}
+
+    def _get_route(self, source, metric_type):  # type: (str, str) -> MetricRoute
+        route = self._routes.get((source, metric_type))
+        if route is None:
+            route = MetricRoute(definition=self.definitions.get(source, {}).get(metric_type),
+                                persist_counters=self._persist_counters.get(source, {}).get(metric_type, {}),
+                                buffer_counters=self._buffer_counters.get(source, {}).get(metric_type, {}))
+            self._routes[(source, metric_type)] = route
+        return route
+
+    def _get_cloud_config(self):  # type: () -> Dict[str,Any]
+        """
+        Returns a snapshot of the cloud metrics configuration. It is refreshed when the configuration changes
+        (also by other processes) or when the underlying Config cache expires.
+        """
+        now = time.time()
+        cloud_config = self._cloud_config
+        if cloud_config is None or cloud_config['generation'] != Config.GENERATION or cloud_config['expire_at'] < now:
+            cloud_config = {'generation': Config.GENERATION,
+                            'expire_at': now + Config.CACHE_EXPIRY_DURATION,
+                            'enabled': Config.get_entry('cloud_enabled', False),
+                            'metric_types': Config.get_entry('cloud_metrics_types', []),
+                            'metric_sources': Config.get_entry('cloud_metrics_sources', []),
+                            'batch_size': Config.get_entry('cloud_metrics_batch_size', 0),
+                            'min_interval': Config.get_entry('cloud_metrics_min_interval', None),
+                            'entries': {}}
+            self._cloud_config = cloud_config
+        return cloud_config
+
+    @staticmethod
+    def _get_cloud_entry(cloud_config, key, fallback):  # type: (Dict[str,Any], str, Any) -> Any
+        entries = cloud_config['entries']
+        if key not in entries:
+            entries[key] = Config.get_entry(key, fallback)
+        return entries[key]
 
     def _load_cloud_buffer(self):
         oldest_queue_timestamp = min([time.time()] + [metric[0]['timestamp'] for metric in self._cloud_queue])
@@ -264,24 +335,23 @@ class MetricsController(object):
         if definition is None:
             return False
 
-        if Config.get_entry('cloud_enabled', False) is False:
+        cloud_config = self._get_cloud_config()
+        if cloud_config['enabled'] is False:
             return False
 
         if metric_source == 'OpenMotics':
             config_key = 'cloud_metrics_enabled|{0}'.format(metric_type)
-            if Config.get_entry(config_key, True) is False:
+            if MetricsController._get_cloud_entry(cloud_config, config_key, True) is False:
                 return False
 
             # filter openmotics metrics that are not listed in cloud_metrics_types
-            metric_types = Config.get_entry('cloud_metrics_types', [])
-            if metric_type not in metric_types:
+            if metric_type not in cloud_config['metric_types']:
                 return False
 
         else:
             # filter 3rd party (plugin) metrics that are not listed in cloud_metrics_sources
-            metric_sources = Config.get_entry('cloud_metrics_sources', [])
             # make sure to get the lowercase metric_source
-            if metric_source.lower() not in metric_sources:
+            if metric_source.lower() not in cloud_config['metric_sources']:
                 return False
 
         return True
@@ -310,21 +380,23 @@ class MetricsController(object):
         if not self._needs_upload_to_cloud(metric):
             return
 
+        cloud_config = self._get_cloud_config()
         if metric_source == 'OpenMotics':
             # round off timestamps for openmotics metrics
-            modulo_interval = Config.get_entry('cloud_metrics_interval|{0}'.format(metric_type), 900)
+            config_key = 'cloud_metrics_interval|{0}'.format(metric_type)
+            modulo_interval = MetricsController._get_cloud_entry(cloud_config, config_key, 900)
             timestamp = int(metric['timestamp'] - metric['timestamp'] % modulo_interval)
         else:
             timestamp = int(metric['timestamp'])
 
-        cloud_batch_size = Config.get_entry('cloud_metrics_batch_size', 0)
-        cloud_min_interval = Config.get_entry('cloud_metrics_min_interval', None)  # type: Optional[int]
+        cloud_batch_size = cloud_config['batch_size']
+        cloud_min_interval = cloud_config['min_interval']  # type: Optional[int]
         if cloud_min_interval is not None:
             self._cloud_retry_interval = cloud_min_interval
 
-        counters_to_buffer = self._buffer_counters.get(metric_source, {}).get(metric_type, {})
-        definition = self.definitions.get(metric_source, {}).get(metric_type)
-        identifier = '|'.join(['{0}={1}'.format(tag, metric['tags'][tag]) for tag in sorted(definition['tags'])])
+        route = self._get_route(metric_source, metric_type)
+        counters_to_buffer = route.buffer_counters
+        identifier = route.get_identifier(metric['tags'])
 
         # Check if the metric needs to be send
         entry = self._cloud_cache.setdefault(metric_source, {}).setdefault(metric_type, {}).setdefault(identifier, {})
@@ -339,14 +411,18 @@ class MetricsController(object):
         # Add metrics to the send queue if they need to be send
         if include_this_metric is True:
             entry['timestamp'] = timestamp
+            if len(self._cloud_queue) >= MetricsController.CLOUD_QUEUE_LENGTH:
+                self._cloud_spool_pending.append(self._cloud_queue.popleft())
+                if len(self._cloud_spool_pending) >= MetricsController.CLOUD_SPOOL_BATCH_SIZE:
+                    self._flush_cloud_spool()
             self._cloud_queue.append([metric])
-            self._cloud_queue = self._cloud_queue[-5000:]  # 5k metrics buffer
 
         # Check timings/rates
         now = time.time()
         time_ago_send = int(now - self._cloud_last_send)
         time_ago_try = int(now - self._cloud_last_try)
-        outstanding_data_length = len(self._cloud_buffer) + len(self._cloud_queue)
+        spool_length = self._cloud_spool_length + len(self._cloud_spool_pending)
+        outstanding_data_length = len(self._cloud_buffer) + spool_length + len(self._cloud_queue)
 
         send = False
         if outstanding_data_length > 0:  # There must be outstanding data
@@ -361,18 +437,24 @@ class MetricsController(object):
 
         self.cloud_stats['queue'] = len(self._cloud_queue)
         self.cloud_stats['buffer'] = self._cloud_buffer_length
+        self.cloud_stats['spool'] = spool_length
         self.cloud_stats['time_ago_send'] = time_ago_send
         self.cloud_stats['time_ago_try'] = time_ago_try
 
         if send is True:
             self._cloud_last_try = now
             try:
-                # Try to send the metrics
-                self._cloud_api_client.send_metrics(self._cloud_buffer + self._cloud_queue)
+                # Try to send the metrics, spooled metrics are replayed in batches
+                self._flush_cloud_spool()
+                last_spool_id, spooled_metrics = self._metrics_cache_controller.load_spool(limit=MetricsController.CLOUD_REPLAY_BATCH_SIZE)
+                self._cloud_api_client.send_metrics(self._cloud_buffer + spooled_metrics + list(self._cloud_queue))
                 # If successful; clear buffers
                 if self._metrics_cache_controller.clear_buffer(metric['timestamp']) > 0:
                     self._load_cloud_buffer()
-                self._cloud_queue = []
+                if last_spool_id is not None:
+                    self._metrics_cache_controller.clear_spool(last_spool_id)
+                    self._cloud_spool_length = self._metrics_cache_controller.get_spool_length()
+                self._cloud_queue.clear()
                 self._cloud_last_send = now
                 self._cloud_retry_interval = cloud_min_interval
                 if self._throttled_down:
@@ -411,6 +493,16 @@ class MetricsController(object):
             if self._metrics_cache_controller.clear_buffer(time.time() - 365 * 24 * 60 * 60) > 0:
                 self._load_cloud_buffer()
 
+    def _flush_cloud_spool(self):  # type: () -> None
+        if not self._cloud_spool_pending:
+            return
+        try:
+            self._metrics_cache_controller.spool_metrics(self._cloud_spool_pending)
+        except Exception:
+            logger.exception('Could not spool %s metrics, dropping them', len(self._cloud_spool_pending))
+        self._cloud_spool_pending = []
+        self._cloud_spool_length = self._metrics_cache_controller.get_spool_length()
+
     def _put(self, metric):
         rate_key = '{0}.{1}'.format(metric['source'].lower(), metric['type'].lower())
         if rate_key not in self.inbound_rates:
@@ -418,16 +510,39 @@ class MetricsController(object):
         self.inbound_rates[rate_key] += 1
         self.inbound_rates['total'] += 1
         self._transform_counters(metric)  # Convert counters to "ever increasing counters"
+        self._record_history(metric)
         # No need to make a deep copy; openmotics doesn't alter the object, and for the plugins the metric gets (de)serialized
         self.metrics_queue_plugins.appendleft(metric)
         self.metrics_queue_openmotics.appendleft(metric)
 
+    def _record_history(self, metric):
+        try:
+            route = self._get_route(metric['source'], metric['type'])
+            if route.definition is not None:
+                identifier = route.get_identifier(metric['tags'])
+            else:
+                identifier = '|'.join(['{0}={1}'.format(tag, value) for tag, value in sorted(metric['tags'].items())])
+            self._history.add(metric, identifier)
+        except Exception as ex:
+            logger.error('Could not store metric history: {0}'.format(ex))
+
+    def get_metric_history(self, metric_type, source='OpenMotics', resolution='raw', tags=None, start=None, end=None):
+        # type: (str, str, str, Optional[Dict[str,Any]], Optional[float], Optional[float]) -> List[Dict[str,Any]]
+        """
+        Returns the local history of a metric type, per set of tags. The resolution is either 'raw', '1m' or '15m'
+        (averaged). Only numeric values are kept, system metrics are not.
+        > [{"tags": {"device": "OpenMotics energy ID1", "id": "E7.3"},
+        >   "values": {"power": [[1497677091, 1234], ...]}}]
+        """
+        return self._history.query(source=source, metric_type=metric_type, resolution=resolution,
+                                   tags=tags, start=start, end=end)
+
     def _transform_counters(self, metric):
         # TODO: The 'persist' policy should be a part of the PulseCounterController
 
         source = metric['source']
         mtype = metric['type']
-        for counter, match_setting in six.iteritems(self._persist_counters.get(source, {}).get(mtype, {})):
+        for counter, match_setting in six.iteritems(self._get_route(source, mtype).persist_counters):
             if counter not in metric['values']:
                 continue
             if match_setting is not True:
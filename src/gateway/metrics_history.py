@@ -0,0 +1,173 @@
+# Copyright (C) 2021 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+In-memory metrics history
+"""
+
+from __future__ import absolute_import
+
+import logging
+from array import array
+from threading import Lock
+
+import six
+
+if False:  # MYPY
+    from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MetricRing(object):
+    """
+    Fixed size ring of (timestamp, value) samples, backed by two arrays
+    """
+
+    def __init__(self, capacity):  # type: (int) -> None
+        self._capacity = capacity
+        self._timestamps = array('d', [0.0]) * capacity
+        self._values = array('d', [0.0]) * capacity
+        self._index = 0
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, timestamp, value):  # type: (float, float) -> None
+        self._timestamps[self._index] = timestamp
+        self._values[self._index] = value
+        self._index = (self._index + 1) % self._capacity
+        self._length = min(self._length + 1, self._capacity)
+
+    def get_samples(self, start=None, end=None):  # type: (Optional[float], Optional[float]) -> List[List[float]]
+        """ Returns the samples (oldest first) within the given time range """
+        samples = []
+        first = (self._index - self._length) % self._capacity
+        for offset in range(self._length):
+            index = (first + offset) % self._capacity
+            timestamp = self._timestamps[index]
+            if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                samples.append([timestamp, self._values[index]])
+        return samples
+
+
+class MetricSeries(object):
+    """
+    History of a single metric value, stored raw and downsampled (averaged) into coarser resolutions
+    """
+
+    def __init__(self, resolutions):  # type: (List[Tuple[str, int, int]]) -> None
+        self.last_timestamp = 0.0
+        self._rings = {}  # type: Dict[str, MetricRing]
+        self._buckets = []  # type: List[List[Any]]  # [resolution, bucket size, bucket start, sum, count]
+        for resolution, bucket_size, capacity in resolutions:
+            self._rings[resolution] = MetricRing(capacity)
+            if bucket_size > 0:
+                self._buckets.append([resolution, bucket_size, None, 0.0, 0])
+
+    def add(self, timestamp, value):  # type: (float, float) -> None
+        self.last_timestamp = max(self.last_timestamp, timestamp)
+        self._rings['raw'].append(timestamp, value)
+        for bucket in self._buckets:
+            start = timestamp - timestamp % bucket[1]
+            if bucket[2] is None:
+                bucket[2] = start
+            elif start > bucket[2]:
+                # The previous bucket is complete, store its average
+                self._rings[bucket[0]].append(bucket[2], bucket[3] / bucket[4])
+                bucket[2], bucket[3], bucket[4] = start, 0.0, 0
+            elif start < bucket[2]:
+                continue  # Out of order sample for an already stored bucket
+            bucket[3] += value
+            bucket[4] += 1
+
+    def get_samples(self, resolution, start=None, end=None):
+        # type: (str, Optional[float], Optional[float]) -> List[List[float]]
+        return self._rings[resolution].get_samples(start, end)
+
+
+class MetricsHistory(object):
+    """
+    Keeps a local, fixed memory history of numeric metric values per (source, type, tags) and value name
+    """
+
+    RESOLUTIONS = [('raw', 0, 120),  # E.g. 10 minutes at a 5 second interval
+                   ('1m', 60, 360),  # 6 hours
+                   ('15m', 900, 672)]  # 1 week
+    MAX_SERIES = 200  # Each series takes about 18kB (1152 samples of 16 bytes)
+    EXCLUDED_TYPES = ['system']  # The gateway's own statistics would take most of the series
+    IDLE_TIMEOUT = 3600  # Series without new samples are removed, so their slot can be reused
+    CLEANUP_INTERVAL = 300
+
+    def __init__(self, max_series=MAX_SERIES):  # type: (int) -> None
+        self.max_series = max_series
+        self._series = {}  # type: Dict[Tuple[str, str, str], Dict[str, Any]]
+        self._series_count = 0
+        self._last_cleanup = 0.0
+        self._lock = Lock()
+
+    def add(self, metric, identifier):  # type: (Dict[str, Any], str) -> None
+        if metric['type'] in MetricsHistory.EXCLUDED_TYPES:
+            return
+        key = (metric['source'], metric['type'], identifier)
+        timestamp = float(metric['timestamp'])
+        with self._lock:
+            if timestamp - self._last_cleanup > MetricsHistory.CLEANUP_INTERVAL:
+                self._remove_idle_series(timestamp - MetricsHistory.IDLE_TIMEOUT)
+                self._last_cleanup = timestamp
+            entry = self._series.get(key)
+            for name, value in six.iteritems(metric['values']):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                value_series = None if entry is None else entry['values'].get(name)
+                if value_series is None:
+                    if self._series_count >= self.max_series:
+                        continue
+                    if entry is None:
+                        # Only metrics with numeric values are kept
+                        entry = {'tags': metric['tags'], 'values': {}}
+                        self._series[key] = entry
+                    value_series = MetricSeries(MetricsHistory.RESOLUTIONS)
+                    entry['values'][name] = value_series
+                    self._series_count += 1
+                    if self._series_count == self.max_series:
+                        logger.warning('Metrics history is full, new metric series are not kept')
+                value_series.add(timestamp, float(value))
+
+    def _remove_idle_series(self, threshold):  # type: (float) -> None
+        for key, entry in list(self._series.items()):
+            series = entry['values']
+            for name, value_series in list(series.items()):
+                if value_series.last_timestamp < threshold:
+                    del series[name]
+                    self._series_count -= 1
+            if not series:
+                del self._series[key]
+
+    def query(self, source, metric_type, resolution='raw', tags=None, start=None, end=None):
+        # type: (str, str, str, Optional[Dict[str, Any]], Optional[float], Optional[float]) -> List[Dict[str, Any]]
+        if resolution not in [entry[0] for entry in MetricsHistory.RESOLUTIONS]:
+            raise ValueError('Unknown resolution {0}'.format(resolution))
+        results = []
+        with self._lock:
+            for (_source, _metric_type, _), entry in six.iteritems(self._series):
+                if _source != source or _metric_type != metric_type:
+                    continue
+                if tags is not None and any(entry['tags'].get(tag) != value for tag, value in six.iteritems(tags)):
+                    continue
+                results.append({'tags': entry['tags'],
+                                'values': {name: series.get_samples(resolution, start, end)
+                                           for name, series in six.iteritems(entry['values'])}})
+        return results
@@ -18,6 +18,7 @@ from __future__ import absolute_import
 import json
 import logging
 import time
+from threading import Lock
 
 from sqlalchemy import Boolean, Column, Float, ForeignKey, Integer, String, \
     Text, UniqueConstraint, and_, create_engine
@@ -25,6 +26,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import RelationshipProperty, relationship, \
     scoped_session, sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.schema import MetaData
 # from sqlalchemy_utils import ChoiceType
 from sqlite3 import Connection as SQLite3Connection
@@ -33,39 +35,108 @@ from sqlalchemy import event
 import constants
 
 
-# explicitly activate foreign key constraints
-def _set_fk_pragma(dbapi_connection, connection_record):
-    if isinstance(dbapi_connection, SQLite3Connection):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON;")
-        cursor.close()
-
-
 _ = and_, NoResultFound  # For easier import
 
 if False:  # MYPY
-    from typing import Any, Dict, List, Optional, TypeVar
+    from typing import Any, Callable, Dict, List, Optional, TypeVar
+    from sqlalchemy.engine import Engine
     from sqlalchemy.orm import RelationshipProperty
     T = TypeVar('T')
 
 logger = logging.getLogger(__name__)
 
+
+class EngineSettings(object):
+    """
+    SQLite engine configuration, the pragmas are applied to every new connection
+    """
+    BUSY_TIMEOUT = 10.0  # Seconds SQLite keeps retrying when the database is locked by another connection
+    POOL_SIZE = 5
+    POOL_MAX_OVERFLOW = 10
+    SLOW_QUERY_DURATION = 0.1
+    PRAGMAS = [('foreign_keys', 'ON'),
+               ('journal_mode', 'WAL'),  # Readers and the writer don't block each other
+               ('synchronous', 'NORMAL'),  # Safe with WAL, only the last commits can be lost on power loss
+               ('cache_size', -2048),  # In KiB
+               ('mmap_size', 16 * 1024 * 1024)]
+
+    @staticmethod
+    def create_engine(url):  # type: (str) -> Engine
+        _engine = create_engine(url,
+                                connect_args={'check_same_thread': False,
+                                              'timeout': EngineSettings.BUSY_TIMEOUT},
+                                poolclass=QueuePool,
+                                pool_size=EngineSettings.POOL_SIZE,
+                                max_overflow=EngineSettings.POOL_MAX_OVERFLOW)
+        # bind the listeners explicitly to this engine, making sure not to use a global listener with a decorator
+        # as then the alembic migration will apply them too, where the foreign key pragma results in data loss
+        event.listen(_engine, 'connect', EngineSettings._set_pragmas)
+        event.listen(_engine, 'before_cursor_execute', EngineSettings._before_execute)
+        event.listen(_engine, 'after_cursor_execute', EngineSettings._after_execute)
+        event.listen(_engine, 'handle_error', EngineSettings._handle_error)
+        return _engine
+
+    @staticmethod
+    def _set_pragmas(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, SQLite3Connection):
+            cursor = dbapi_connection.cursor()
+            for pragma, value in EngineSettings.PRAGMAS:
+                try:
+                    cursor.execute('PRAGMA {0}={1};'.format(pragma, value))
+                    cursor.fetchall()
+                except Exception as ex:
+                    logger.warning('Could not set pragma {0}: {1}'.format(pragma, ex))
+            cursor.close()
+
+    @staticmethod
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.time())
+
+    @staticmethod
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.time() - conn.info['query_start'].pop()
+        with Database.STATISTICS_LOCK:
+            statistics = Database.STATISTICS
+            statistics['queries'] += 1
+            statistics['query_time'] += duration
+            if duration > EngineSettings.SLOW_QUERY_DURATION:
+                # Mostly statements waiting for a lock held by another connection
+                statistics['slow_queries'] += 1
+
+    @staticmethod
+    def _handle_error(exception_context):
+        if exception_context.connection is not None:
+            query_start = exception_context.connection.info.get('query_start')
+            if query_start:
+                query_start.pop()
+        if 'database is locked' in str(exception_context.original_exception):
+            with Database.STATISTICS_LOCK:
+                Database.STATISTICS['locked'] += 1
+
+
 SQLALCHEMY_DATABASE_URL = "sqlite:///{}".format(constants.get_gateway_database_file())
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-# bind the foreign key pragma listener explicitly to this engine, making sure not to use a global listener with a
-# decorator as then the alembic migration will apply it too, resulting in data loss after migration
-event.listen(engine, 'connect', _set_fk_pragma)
+engine = EngineSettings.create_engine(SQLALCHEMY_DATABASE_URL)
 session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Session = scoped_session(session_factory)
 
 
 class Database:
+    STATISTICS = {'queries': 0, 'query_time': 0.0, 'slow_queries': 0, 'locked': 0}  # type: Dict[str, Any]
+    STATISTICS_LOCK = Lock()
+
     @staticmethod
     def get_session():
         return Session()
 
+    @staticmethod
+    def get_statistics():  # type: () -> Dict[str, Any]
+        """ Returns the query statistics, the pool status of the engine and resets the statistics """
+        with Database.STATISTICS_LOCK:
+            statistics = dict(Database.STATISTICS)
+            Database.STATISTICS.update({'queries': 0, 'query_time': 0.0, 'slow_queries': 0, 'locked': 0})
+        statistics['connections'] = engine.pool.checkedout()
+        return statistics
+
 
 # https://alembic.sqlalchemy.org/en/latest/naming.html
 convention = {
@@ -283,26 +354,31 @@ class Config(Base):
     setting = Column(String(255), unique=True, nullable=False)
     data = Column(String(255), nullable=False)
 
-    CACHE_EXPIRY_DURATION = 60
+    CACHE_EXPIRY_DURATION = 900  # Safety net, changes are normally applied to the cache right away
     CACHE = {}  # type: Dict[str,Any]
+    GENERATION = 0  # Incremented on every change, so derived caches know when to refresh
+    CHANGE_HANDLERS = []  # type: List[Callable[[List[str]],None]]
+    _NOT_SET = object()  # Cached marker for settings that don't exist in the DB
+    _cache_lock = Lock()
 
     @staticmethod
     def get_entry(key, fallback):
         # type: (str, T) -> T
         """ Retrieves a setting from the DB, returns the argument 'fallback' when non existing """
         key = key.lower()
-        if key in Config.CACHE:
-            data, expire_at = Config.CACHE[key]
-            if expire_at > time.time():
-                return data
-        with Database.get_session() as db:
-            raw_data = db.query(Config.data).where(Config.setting == key).one_or_none()
-        if raw_data is not None:
-            data = json.loads(raw_data[0])
+        cached = Config.CACHE.get(key)
+        if cached is not None and cached[1] > time.time():
+            data = cached[0]
         else:
-            data = fallback
-        Config.CACHE[key] = (data, time.time() + Config.CACHE_EXPIRY_DURATION)
-        return data
+            generation = Config.GENERATION
+            with Database.get_session() as db:
+                raw_data = db.query(Config.data).where(Config.setting == key).one_or_none()
+            data = json.loads(raw_data[0]) if raw_data is not None else Config._NOT_SET
+            with Config._cache_lock:
+                # Don't cache the value when the setting changed while it was being loaded
+                if generation == Config.GENERATION:
+                    Config.CACHE[key] = (data, time.time() + Config.CACHE_EXPIRY_DURATION)
+        return fallback if data is Config._NOT_SET else data
 
     @staticmethod
     def set_entry(key, value):
@@ -320,18 +396,56 @@ class Config(Base):
                 config_orm = Config(setting=key, data=data)
             db.add(config_orm)
             db.commit()
-        Config.CACHE[key] = (value, time.time() + Config.CACHE_EXPIRY_DURATION)
+        # Cache the parsed data instead of the given value, so callers can't alter the cached value
+        Config._update_cache(key, json.loads(data))
+        Config._notify_change([key])
 
     @staticmethod
     def remove_entry(key):
         # type: (str) -> int
         """ Removes a setting from the DB """
+        key = key.lower()
         with Database.get_session() as db:
-            rows_deleted = db.query(Config).where(Config.setting == key.lower()).delete()
+            rows_deleted = db.query(Config).where(Config.setting == key).delete()
             db.commit()
-        Config.CACHE.pop(key, None)
+        Config._update_cache(key, Config._NOT_SET)
+        Config._notify_change([key])
         return rows_deleted
 
+    @staticmethod
+    def invalidate(keys=None):
+        # type: (Optional[List[str]]) -> None
+        """ Drops the given (or all) settings from the cache, e.g. when they were changed by another process """
+        with Config._cache_lock:
+            Config.GENERATION += 1
+            if keys is None:
+                Config.CACHE.clear()
+            else:
+                for key in keys:
+                    Config.CACHE.pop(key.lower(), None)
+
+    @staticmethod
+    def add_change_handler(handler):
+        # type: (Callable[[List[str]],None]) -> None
+        """ Registers a handler that is called with the changed settings after every local change """
+        Config.CHANGE_HANDLERS.append(handler)
+
+    @staticmethod
+    def _update_cache(key, data):
+        # type: (str, Any) -> None
+        with Config._cache_lock:
+            Config.GENERATION += 1
+            Config.CACHE[key] = (data, time.time() + Config.CACHE_EXPIRY_DURATION)
+
+    @staticmethod
+    def _notify_change(keys):
+        # type: (List[str]) -> None
+        for handler in Config.CHANGE_HANDLERS:
+            try:
+                handler(keys)
+            except Exception:
+                logger.exception('Error executing config change handler')
+
 
 class Plugin(Base):
     __tablename__ = 'plugin'
@@ -205,6 +205,9 @@ class ModuleController(BaseController):
     def get_master_debug_buffer(self):
         return self._master_controller.get_debug_buffer()
 
+    def get_master_memory_statistics(self):  # type: () -> Dict[str, int]
+        return self._master_controller.get_memory_statistics()
+
     def reset_master(self, power_on=True):
         # type: (bool) -> None
         self._master_controller.cold_reset(power_on=power_on)
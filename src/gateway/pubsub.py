@@ -14,8 +14,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import absolute_import
 
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict, deque
 import logging
+import time
+from threading import Lock
 
 from six.moves.queue import Queue, Empty
 
@@ -27,7 +29,7 @@ from gateway.hal.master_event import MasterEvent
 from ioc import Injectable, Singleton
 
 if False:  # MYPY
-    from typing import Callable, Dict, List, Literal, Tuple, Union
+    from typing import Any, Callable, Deque, Dict, List, Literal, Optional, Tuple, Union
     GATEWAY_TOPIC = Literal['config', 'scheduler', 'state']
     MASTER_TOPIC = Literal['eeprom', 'module', 'power', 'output', 'input', 'shutter', 'sensor', 'thermostat']
 
@@ -39,6 +41,7 @@ class EventStructure(object):
         # type: (Union[MASTER_TOPIC, GATEWAY_TOPIC], Union[MasterEvent, GatewayEvent]) -> None
         self.topic = topic
         self.event = event
+        self.timestamp = time.time()
 
     def __repr__(self):
         return "<EventStructure: Topic: {}, Event: {}>".format(self.topic, self.event)
@@ -47,6 +50,148 @@ class EventStructure(object):
         return self.__repr__()
 
 
+class Subscriber(object):
+    """
+    A subscribing object (the owner of one or more callbacks) with its own delivery queue. A subscriber is only
+    handled by one worker at a time, so it receives its events in order and its callbacks never run concurrently.
+    The amount of queued state events is bounded: when full, a new state event replaces the queued event with the
+    same type and id (if any), otherwise a queued state event that is superseded by a newer queued event for the
+    same object is dropped. The last queued state of an object is never dropped, if nothing can be merged or dropped
+    the event is queued anyway (which is still bounded by the amount of objects). Input events are never merged or
+    dropped since every edge matters.
+    """
+
+    LATENCY_BUCKETS = [(0.001, '<1ms'), (0.01, '<10ms'), (0.1, '<100ms'), (1.0, '<1s')]
+    EDGE_EVENT_TYPES = [MasterEvent.Types.INPUT_CHANGE, GatewayEvent.Types.INPUT_CHANGE]
+    BACKLOG_WARNING_INTERVAL = 60
+
+    def __init__(self, name, max_state_events):  # type: (str, int) -> None
+        self.name = name
+        self._max_state_events = max_state_events
+        self._queue = deque()  # type: Deque[List[Any]]  # [callback, event, timestamp, is_state, merge key, queued]
+        self._state_events = 0
+        self._dropped_entries = 0  # Dropped entries are left in the queue and skipped when delivering
+        self._latest = {}  # type: Dict[Tuple[Any, Any], List[Any]]  # Latest queued entry per (callback, merge key)
+        self._superseded = deque()  # type: Deque[List[Any]]
+        self._superseded_scan = False
+        self._lock = Lock()
+        self._scheduled = False
+        self.latency_histogram = Counter()  # type: Counter
+        self.dropped = 0
+        self.merged = 0
+        self.overflowed = 0
+        self._last_backlog_warning = 0.0
+
+    def __len__(self):
+        return len(self._queue) - self._dropped_entries
+
+    def enqueue(self, callback, event_structure, is_state):
+        # type: (Callable[[Any], None], EventStructure, bool) -> bool
+        """ Queues an event, returns whether the subscriber needs to be scheduled """
+        with self._lock:
+            key = None
+            if is_state and event_structure.event.type in Subscriber.EDGE_EVENT_TYPES:
+                # Edges are queued unbounded
+                is_state = False
+                if self._state_events >= self._max_state_events:
+                    self._warn_backlog()
+            elif is_state:
+                key = Subscriber._get_merge_key(event_structure.event)
+                latest = self._latest.get((callback, key)) if key is not None else None
+                if self._state_events >= self._max_state_events:
+                    if latest is not None:
+                        latest[1] = event_structure.event  # Last write wins, the original timestamp is kept
+                        self.merged += 1
+                        return False
+                    if not self._drop_superseded():
+                        self.overflowed += 1
+                        self._warn_backlog()
+                elif latest is not None:
+                    self._superseded_scan = True
+            entry = [callback, event_structure.event, event_structure.timestamp, is_state, key, True]
+            self._queue.append(entry)
+            if is_state:
+                self._state_events += 1
+                if key is not None:
+                    self._latest[(callback, key)] = entry
+            if self._scheduled:
+                return False
+            self._scheduled = True
+            return True
+
+    def _drop_superseded(self):  # type: () -> bool
+        """ Drops the oldest queued state event for which a newer event of the same object is queued """
+        if not self._superseded and self._superseded_scan:
+            # Only rescanned once new superseded events were queued, so the scan is amortized over those events
+            self._superseded = deque(entry for entry in self._queue
+                                     if entry[5] and entry[4] is not None and self._latest.get((entry[0], entry[4])) is not entry)
+            self._superseded_scan = False
+        while self._superseded:
+            entry = self._superseded.popleft()
+            if entry[5]:
+                entry[5] = False
+                self._state_events -= 1
+                self._dropped_entries += 1
+                self.dropped += 1
+                return True
+        return False
+
+    def _warn_backlog(self):  # type: () -> None
+        now = time.time()
+        if now - self._last_backlog_warning > Subscriber.BACKLOG_WARNING_INTERVAL:
+            logger.warning('Subscriber %s is lagging behind, %s events queued', self.name, len(self))
+            self._last_backlog_warning = now
+
+    def deliver(self, max_events):  # type: (int) -> bool
+        """ Delivers queued events, returns whether the subscriber needs to be rescheduled """
+        for _ in range(max_events):
+            with self._lock:
+                if not self._queue:
+                    break
+                entry = self._queue.popleft()
+                callback, event, timestamp, is_state, key, queued = entry
+                if not queued:
+                    self._dropped_entries -= 1
+                    continue
+                entry[5] = False
+                if is_state:
+                    self._state_events -= 1
+                    if key is not None and self._latest.get((callback, key)) is entry:
+                        del self._latest[(callback, key)]
+            try:
+                callback(event)
+            except Exception:
+                logger.exception('Failed to call handle %s for event %s', callback, event)
+            self._register_latency(time.time() - timestamp)
+        with self._lock:
+            if self._queue:
+                return True
+            self._scheduled = False
+            return False
+
+    def _register_latency(self, latency):  # type: (float) -> None
+        for limit, bucket in Subscriber.LATENCY_BUCKETS:
+            if latency < limit:
+                self.latency_histogram.update({bucket: 1})
+                return
+        self.latency_histogram.update({'>=1s': 1})
+
+    @staticmethod
+    def _get_merge_key(event):  # type: (Union[MasterEvent, GatewayEvent]) -> Optional[Tuple[Any, ...]]
+        data = event.data
+        if not isinstance(data, dict):
+            return None
+        if 'id' in data:
+            return event.type, data['id']
+        if 'state' in data and hasattr(data['state'], 'id'):
+            # Master state events carry a (partial) status DTO, only merge events updating the same fields
+            state = data['state']
+            return event.type, state.id, tuple(sorted(state.loaded_fields))
+        if 'sensor' in data and 'type' in data:
+            return event.type, data['sensor'], data['type']
+        return None
+
+
 @Injectable.named('pubsub')
 @Singleton
 class PubSub(object):
@@ -57,8 +202,19 @@ class PubSub(object):
      - Topic: The specific topic that is provided for the event in a particular namespace.
      - Type: the type of event that is defined in the event itself.
     The above list can is ordered in hierarchical order.
+
+    Published events are dispatched to a queue per subscribing object, which are handled by a pool of workers. This
+    way a slow subscriber only delays its own events.
+
+    Optionally, state events can be coalesced: within the configured window only the latest event per type and id is
+    published (e.g. during a dimmer ramp), delayed at most by the window. Input events are never coalesced since
+    every edge matters.
     """
 
+    WORKERS = 4
+    MAX_QUEUED_STATE_EVENTS = 1000
+    DELIVERY_BATCH_SIZE = 25
+
     class MasterTopics(BaseEnum):
         EEPROM = 'eeprom'  # type: MASTER_TOPIC
         OUTPUT = 'output'  # type: MASTER_TOPIC
@@ -72,17 +228,32 @@ class PubSub(object):
         SCHEDULER = 'scheduler'  # type: GATEWAY_TOPIC
         STATE = 'state'  # type: GATEWAY_TOPIC
 
+    STATE_TOPICS = [MasterTopics.OUTPUT, MasterTopics.INPUT, MasterTopics.SHUTTER, MasterTopics.SENSOR,
+                    MasterTopics.THERMOSTAT, GatewayTopics.STATE]
+    COALESCED_STATE_TYPES = [GatewayEvent.Types.OUTPUT_CHANGE, GatewayEvent.Types.SENSOR_CHANGE,
+                             GatewayEvent.Types.SHUTTER_CHANGE, GatewayEvent.Types.THERMOSTAT_CHANGE,
+                             GatewayEvent.Types.THERMOSTAT_GROUP_CHANGE, GatewayEvent.Types.VENTILATION_CHANGE]
+
     def __init__(self):
         # type: () -> None
-        self._gateway_topics = defaultdict(list)  # type: Dict[GATEWAY_TOPIC,List[Callable[[GatewayEvent],None]]]
-        self._master_topics = defaultdict(list)  # type: Dict[MASTER_TOPIC,List[Callable[[MasterEvent],None]]]
+        self._gateway_topics = defaultdict(list)  # type: Dict[GATEWAY_TOPIC,List[Tuple[Subscriber, Callable[[GatewayEvent],None]]]]
+        self._master_topics = defaultdict(list)  # type: Dict[MASTER_TOPIC,List[Tuple[Subscriber, Callable[[MasterEvent],None]]]]
+        self._subscribers = {}  # type: Dict[int, Subscriber]
+        self._subscribe_lock = Lock()
         self._event_queue = Queue()  # type: Queue  # Queue[EventStructure]
+        self._ready_queue = Queue()  # type: Queue  # Queue[Subscriber]
+        self._state_coalesce_window = 0.0
+        self._coalesced_events = OrderedDict()  # type: OrderedDict  # OrderedDict[Tuple[str, Any], Tuple[float, EventStructure]]
         self._pub_thread = DaemonThread(name='pubsub', target=self._publisher_loop, interval=0.1, delay=0.2)
+        self._worker_threads = [DaemonThread(name='pubsubworker{0}'.format(i), target=self._worker_loop, interval=0, delay=0.2)
+                                for i in range(PubSub.WORKERS)]
         self._is_running = False
 
     def start(self):
         # type: () -> None
         self._is_running = True
+        for worker_thread in self._worker_threads:
+            worker_thread.start()
         self._pub_thread.start()
 
     def stop(self):
@@ -90,72 +261,156 @@ class PubSub(object):
         self._is_running = False
         self._event_queue.put(None)
         self._pub_thread.stop()
+        for worker_thread in self._worker_threads:
+            worker_thread.stop()
+
+    def set_state_coalescing(self, window):  # type: (float) -> None
+        """ Coalesces state events within the given window (in seconds), a window of 0 disables coalescing """
+        self._state_coalesce_window = max(0.0, window)
 
     def _publisher_loop(self):
         """ This function will continuously loop over the function to publish all the events in the queue"""
         while self._is_running:
             self._publish_all_events()
 
+    def _worker_loop(self):
+        try:
+            subscriber = self._ready_queue.get(timeout=0.25)
+        except Empty:
+            return
+        if subscriber.deliver(max_events=PubSub.DELIVERY_BATCH_SIZE):
+            self._ready_queue.put(subscriber)  # Requeue, giving other subscribers a chance first
+
     def _publish_all_events(self, blocking=True):
         while True:
             try:
-                event_structure = self._event_queue.get(block=blocking, timeout=0.25)
+                event_structure = self._event_queue.get(block=blocking, timeout=self._get_queue_timeout())
                 if event_structure is None:
                     return
-                self._publish_event(event_structure)
+                if not self._coalesce_event(event_structure):
+                    self._publish_event(event_structure)
+                self._publish_coalesced_events(force=False)
+                if not self._is_running:
+                    self._deliver_all_events()
             except Empty:
+                # Without the publisher thread (e.g. when triggered manually), pending events are published right away
+                self._publish_coalesced_events(force=not self._is_running)
+                if not self._is_running:
+                    self._deliver_all_events()
                 break
 
+    def _get_queue_timeout(self):  # type: () -> float
+        if not self._coalesced_events:
+            return 0.25
+        deadline, _ = next(iter(self._coalesced_events.values()))
+        return min(0.25, max(0.0, deadline - time.time()))
+
+    def _coalesce_event(self, event_structure):  # type: (EventStructure) -> bool
+        """ Holds back a state event for coalescing, returns whether the event was held back """
+        window = self._state_coalesce_window
+        if window <= 0 or event_structure.topic != PubSub.GatewayTopics.STATE:
+            return False
+        if event_structure.event.type not in PubSub.COALESCED_STATE_TYPES:
+            return False
+        key = Subscriber._get_merge_key(event_structure.event)
+        if key is None:
+            return False
+        pending = self._coalesced_events.get(key)
+        if pending is not None:
+            pending[1].event = event_structure.event  # Last write wins, the original timestamp is kept
+        else:
+            self._coalesced_events[key] = (time.time() + window, event_structure)
+        return True
+
+    def _publish_coalesced_events(self, force):  # type: (bool) -> None
+        now = time.time()
+        while self._coalesced_events:
+            key, (deadline, event_structure) = next(iter(self._coalesced_events.items()))
+            if not force and deadline > now:
+                return
+            del self._coalesced_events[key]
+            self._publish_event(event_structure)
+
+    def _deliver_all_events(self):  # type: () -> None
+        """ Without workers, events are delivered synchronously (e.g. when triggered manually) """
+        while True:
+            try:
+                subscriber = self._ready_queue.get(block=False)
+            except Empty:
+                return
+            while subscriber.deliver(max_events=PubSub.DELIVERY_BATCH_SIZE):
+                pass
+
     def _publish_event(self, event_structure):
         # type: (EventStructure) -> None
         if isinstance(event_structure.event, MasterEvent):
             master_topic = event_structure.topic  # type: MASTER_TOPIC  # type: ignore
-            self._publish_master_event(master_topic, event_structure.event)
+            self._publish_master_event(master_topic, event_structure)
         elif isinstance(event_structure.event, GatewayEvent):
             gateway_topic = event_structure.topic  # type: GATEWAY_TOPIC  # type: ignore
-            self._publish_gateway_event(gateway_topic, event_structure.event)
+            self._publish_gateway_event(gateway_topic, event_structure)
+
+    def _dispatch(self, subscriptions, event_structure):
+        # type: (List[Tuple[Subscriber, Callable[[Any],None]]], EventStructure) -> None
+        is_state = event_structure.topic in PubSub.STATE_TOPICS
+        for subscriber, callback in subscriptions:
+            if subscriber.enqueue(callback, event_structure, is_state):
+                self._ready_queue.put(subscriber)
+
+    def _get_subscriber(self, callback):  # type: (Callable[[Any],None]) -> Subscriber
+        owner = getattr(callback, '__self__', None)
+        if owner is None:
+            owner = callback
+        with self._subscribe_lock:
+            subscriber = self._subscribers.get(id(owner))
+            if subscriber is None:
+                name = owner.__class__.__name__ if owner is not callback else getattr(callback, '__name__', str(callback))
+                subscriber = Subscriber(name=name, max_state_events=PubSub.MAX_QUEUED_STATE_EVENTS)
+                self._subscribers[id(owner)] = subscriber
+            return subscriber
+
+    def get_statistics(self):  # type: () -> Dict[str, Dict[str, Any]]
+        """ Returns the delivery statistics (queue length, dropped/merged/overflowed events and latency histogram) per subscriber """
+        with self._subscribe_lock:
+            subscribers = list(self._subscribers.values())
+        return {subscriber.name: {'queued': len(subscriber),
+                                  'dropped': subscriber.dropped,
+                                  'merged': subscriber.merged,
+                                  'overflowed': subscriber.overflowed,
+                                  'latency': dict(subscriber.latency_histogram)}
+                for subscriber in subscribers}
 
     def subscribe_master_events(self, topic, callback):
         # type: (MASTER_TOPIC, Callable[[MasterEvent],None]) -> None
-        self._master_topics[topic].append(callback)
+        self._master_topics[topic].append((self._get_subscriber(callback), callback))
 
     def publish_master_event(self, topic, master_event):
         # type: (MASTER_TOPIC, MasterEvent) -> None
         self._event_queue.put(EventStructure(topic, master_event))
-        # self._master_events.put((topic, master_event))
 
-    def _publish_master_event(self, topic, master_event):
-        # type: (MASTER_TOPIC, MasterEvent) -> None
-        callbacks = self._master_topics[topic]
-        if callbacks:
-            logger.debug('Received master event %s on topic "%s"', master_event.type, topic)
+    def _publish_master_event(self, topic, event_structure):
+        # type: (MASTER_TOPIC, EventStructure) -> None
+        subscriptions = self._master_topics[topic]
+        if subscriptions:
+            logger.debug('Received master event %s on topic "%s"', event_structure.event.type, topic)
         else:
-            logger.warning('Received master event %s on topic "%s" without subscribers', master_event.type, topic)
-        for callback in callbacks:
-            try:
-                callback(master_event)
-            except Exception:
-                logger.exception('Failed to call handle %s for topic %s', callback, topic)
+            logger.warning('Received master event %s on topic "%s" without subscribers', event_structure.event.type, topic)
+        self._dispatch(subscriptions, event_structure)
 
     def subscribe_gateway_events(self, topic, callback):
         # type: (GATEWAY_TOPIC, Callable[[GatewayEvent],None]) -> None
-        self._gateway_topics[topic].append(callback)
+        self._gateway_topics[topic].append((self._get_subscriber(callback), callback))
 
     def publish_gateway_event(self, topic, gateway_event):
         # type: (GATEWAY_TOPIC, GatewayEvent) -> None
         self._event_queue.put(EventStructure(topic, gateway_event))
 
-    def _publish_gateway_event(self, topic, gateway_event):
-        # type: (GATEWAY_TOPIC, GatewayEvent) -> None
-        logger.debug('Publishing gateway event {} {}'.format(topic, gateway_event))
-        callbacks = self._gateway_topics[topic]
-        if callbacks:
-            logger.debug('Received gateway event %s on topic "%s"', gateway_event.type, topic)
+    def _publish_gateway_event(self, topic, event_structure):
+        # type: (GATEWAY_TOPIC, EventStructure) -> None
+        logger.debug('Publishing gateway event {} {}'.format(topic, event_structure.event))
+        subscriptions = self._gateway_topics[topic]
+        if subscriptions:
+            logger.debug('Received gateway event %s on topic "%s"', event_structure.event.type, topic)
         else:
-            logger.warning('Received gateway event %s on topic "%s" without subscribers', gateway_event.type, topic)
-        for callback in callbacks:
-            try:
-                logger.debug('Executing callback {} with {}'.format(callback.__name__, gateway_event))
-                callback(gateway_event)
-            except Exception:
-                logger.exception('Failed to call handle %s for topic %s', callback, topic)
+            logger.warning('Received gateway event %s on topic "%s" without subscribers', event_structure.event.type, topic)
+        self._dispatch(subscriptions, event_structure)
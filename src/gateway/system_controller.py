@@ -42,6 +42,7 @@ if False:  # MYPY
     from gateway.module_controller import ModuleController
     from bus.om_bus_client import MessageClient
     from gateway.hal.master_controller import MasterController
+    from gateway.metrics_caching import MetricsCacheController
 
 logger = logging.getLogger(__name__)
 
@@ -51,10 +52,12 @@ logger = logging.getLogger(__name__)
 class SystemController(object):
 
     @Inject
-    def __init__(self, master_controller=INJECTED, module_controller=INJECTED, message_client=INJECTED):
+    def __init__(self, master_controller=INJECTED, module_controller=INJECTED, message_client=INJECTED,
+                 metrics_cache_controller=INJECTED):
         self._module_controller = module_controller  # type: ModuleController
         self._master_controller = master_controller  # type: MasterController
         self._message_client = message_client  # type: MessageClient
+        self._metrics_cache_controller = metrics_cache_controller  # type: MetricsCacheController
         self._sync_time_thread = None  # type: Optional[DaemonThread]
 
     def start(self):
@@ -150,21 +153,6 @@ class SystemController(object):
         """
         _ = self  # Not static for consistency
 
-        def backup_sqlite_db(input_db_path, backup_db_path):
-            """ Backup an sqlite db provided the path to the db to backup and the backup db. """
-            # Connect to database
-            connection = sqlite3.connect(input_db_path)
-            cursor = connection.cursor()
-
-            # Lock database before making a backup
-            cursor.execute('begin immediate')
-
-            # Make new backup file
-            shutil.copyfile(input_db_path, backup_db_path)
-
-            # Unlock database
-            connection.rollback()
-
         tmp_dir = tempfile.mkdtemp()
         tmp_sqlite_dir = '{0}/sqlite'.format(tmp_dir)
         os.mkdir(tmp_sqlite_dir)
@@ -173,6 +161,8 @@ class SystemController(object):
             with open('{0}/master.eep'.format(tmp_sqlite_dir), 'wb') as eeprom_file:
                 eeprom_file.write(self._module_controller.get_master_backup())
 
+            # The counter state is kept in memory for a while, make sure it's in metrics.db
+            self._metrics_cache_controller.flush()
             for filename, source in {'config.db': constants.get_config_database_file(),
                                      'power.db': constants.get_power_database_file(),
                                      'eeprom_extensions.db': constants.get_eeprom_extension_database_file(),
@@ -180,7 +170,7 @@ class SystemController(object):
                                      'gateway.db': constants.get_gateway_database_file()}.items():
                 if os.path.exists(source):
                     target = '{0}/{1}'.format(tmp_sqlite_dir, filename)
-                    backup_sqlite_db(source, target)
+                    SystemController._backup_sqlite_db(source, target)
 
             # Backup plugins
             tmp_plugin_dir = '{0}/{1}'.format(tmp_dir, 'plugins')
@@ -223,6 +213,49 @@ class SystemController(object):
         finally:
             shutil.rmtree(tmp_dir)
 
+    @staticmethod
+    def _backup_sqlite_db(input_db_path, backup_db_path):  # type: (str, str) -> None
+        """ Backup an sqlite db provided the path to the db to backup and the backup db. """
+        connection = sqlite3.connect(input_db_path)
+        try:
+            if hasattr(connection, 'backup'):
+                # Consistent copy, including the data that is still in the write-ahead log
+                backup_connection = sqlite3.connect(backup_db_path)
+                try:
+                    connection.backup(backup_connection)
+                finally:
+                    backup_connection.close()
+            else:
+                cursor = connection.cursor()
+                # Move the write-ahead log (if any) into the database file, then lock it while copying
+                cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                cursor.execute('begin immediate')
+                shutil.copyfile(input_db_path, backup_db_path)
+                connection.rollback()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _restore_sqlite_db(source, target):  # type: (str, str) -> None
+        """
+        Restores an sqlite db. The db is still in use, so the restore is done through sqlite itself instead of
+        replacing the file (and its write-ahead log) underneath the open connections.
+        """
+        target_connection = sqlite3.connect(target)
+        try:
+            if hasattr(target_connection, 'backup'):
+                source_connection = sqlite3.connect(source)
+                try:
+                    source_connection.backup(target_connection)
+                finally:
+                    source_connection.close()
+            else:
+                # Make sure the write-ahead log is empty, so it can't be applied to the restored db
+                target_connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                shutil.copyfile(source, target)
+        finally:
+            target_connection.close()
+
     def restore_full_backup(self, data):
         """
         Restore a full backup containing the master eeprom and the sqlite databases.
@@ -262,7 +295,7 @@ class SystemController(object):
                                      'gateway.db': constants.get_gateway_database_file()}.items():
                 source = '{0}/{1}'.format(src_dir, filename)
                 if os.path.exists(source):
-                    shutil.copyfile(source, target)
+                    SystemController._restore_sqlite_db(source, target)
 
             # Restore the plugins if there are any
             backup_plugin_dir = '{0}/plugins'.format(tmp_dir)
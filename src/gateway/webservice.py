@@ -61,8 +61,9 @@ from gateway.models import Config, Database, Feature, Module, Schedule, User
 from gateway.thermostat.thermostat_controller import ThermostatController
 from gateway.uart_controller import UARTController
 from gateway.update_controller import UpdateController
-from gateway.websockets import EventsSocket, MaintenanceSocket, \
-    MetricsSocket, OMPlugin, OMSocketTool, WebSocketEncoding
+from gateway.websockets import EncodedData, EventsSocket, MaintenanceSocket, \
+    MetricsSocket, OMPlugin, OMSocketTool, WebSocketBroadcaster, \
+    WebSocketEncoding
 from ioc import INJECTED, Inject, Injectable, Singleton
 from logs import Logs
 from platform_utils import Hardware, Platform, System
@@ -384,6 +385,8 @@ def types(**kwargs):
 class WebInterface(object):
     """ This class defines the web interface served by cherrypy. """
 
+    TOKEN_CHECK_INTERVAL = 60  # Websocket tokens are validated once per interval instead of on every message
+
     @Inject
     def __init__(self, user_controller=INJECTED, maintenance_controller=INJECTED,
                  message_client=INJECTED, scheduling_controller=INJECTED,
@@ -420,6 +423,7 @@ class WebInterface(object):
         self._plugin_controller = None  # type: Optional[PluginController]
         self._metrics_collector = None  # type: Optional[MetricsCollector]
         self._metrics_controller = None  # type: Optional[MetricsController]
+        self._broadcaster = WebSocketBroadcaster()
 
         self._ws_metrics_registered = False
         self._energy_dirty = False
@@ -446,21 +450,51 @@ class WebInterface(object):
                 if receiver_info is None:
                     continue
                 try:
-                    if cherrypy.request.remote.ip != '127.0.0.1' and not self._user_controller.check_token(receiver_info['token']):
+                    if cherrypy.request.remote.ip != '127.0.0.1' and not self._check_receiver_token(receiver_info):
                         raise cherrypy.HTTPError(401, 'invalid_token')
                     sources = self._metrics_controller.get_filter('source', receiver_info['source'])
                     metric_types = self._metrics_controller.get_filter('metric_type', receiver_info['metric_type'])
                     if metric['source'] in sources and metric['type'] in metric_types:
-                        receiver_info['socket'].send_encoded(metric)
-                        # receiver_info['socket'].send(msgpack.dumps(metric), binary=True)
+                        self._broadcaster.send(client_id, receiver_info, metric,
+                                               drop_oldest=True, on_error=self._remove_metrics_receiver)
                 except cherrypy.HTTPError as ex:  # As might be caught from the `check_token` function
                     receiver_info['socket'].close(ex.code, ex.message)
                 except Exception as ex:
-                    logger.error('Failed to distribute metrics to WebSocket: %s', ex)
-                    cherrypy.engine.publish('remove-metrics-receiver', client_id)
+                    self._remove_metrics_receiver(client_id, ex)
         except Exception as ex:
             logger.error('Failed to distribute metrics to WebSockets: %s', ex)
 
+    def _remove_metrics_receiver(self, client_id, exception):
+        # type: (str, Optional[Exception]) -> None
+        logger.error('Failed to distribute metrics to WebSocket: %s', exception)
+        cherrypy.engine.publish('remove-metrics-receiver', client_id)
+
+    def _remove_events_receiver(self, client_id, exception):
+        # type: (str, Optional[Exception]) -> None
+        if exception is None:
+            logger.warning('Events WebSocket %s could not keep up and was disconnected', client_id)
+        else:
+            logger.error('Failed to distribute events to WebSocket: %s', exception)
+        cherrypy.engine.publish('remove-events-receiver', client_id)
+
+    def start_broadcaster(self):
+        # type: () -> None
+        self._broadcaster.start()
+
+    def stop_broadcaster(self):
+        # type: () -> None
+        self._broadcaster.stop()
+
+    def _check_receiver_token(self, receiver_info):
+        # type: (Dict[str, Any]) -> bool
+        now = time.time()
+        if receiver_info.get('token_checked', 0) > now - WebInterface.TOKEN_CHECK_INTERVAL:
+            return True
+        if not self._user_controller.check_token(receiver_info['token']):
+            return False
+        receiver_info['token_checked'] = now
+        return True
+
     def send_event_websocket(self, event):
         # type: (BaseEvent) -> None
         try:
@@ -468,6 +502,11 @@ class WebInterface(object):
             if not answers:
                 return
             receivers = answers.pop()  # type: Dict[str, Dict[str, Any]]  # unpop since cherrypy bus returns reply of publish in a list
+            # The event is serialized once, and encoded at most once per serialization method
+            encoded_event = EncodedData(event.serialize())
+            # The toggle check added for development purposes.
+            # Do NOT enable unless you know what you're doing and understand the risks.
+            check_authentication = not Config.get_entry('disable_api_authentication_very_insecure', False) and cherrypy.request.remote.ip != '127.0.0.1'
             for client_id in receivers.keys():
                 receiver_info = receivers.get(client_id)
                 if receiver_info is None:
@@ -480,16 +519,14 @@ class WebInterface(object):
                     if 'namespace' in receiver_info and \
                             (event.namespace != receiver_info['namespace']):
                         continue
-                    # The toggle check added for development purposes.
-                    # Do NOT enable unless you know what you're doing and understand the risks.
-                    if not Config.get_entry('disable_api_authentication_very_insecure', False) and cherrypy.request.remote.ip != '127.0.0.1' and not self._user_controller.check_token(receiver_info['token']):
+                    if check_authentication and not self._check_receiver_token(receiver_info):
                         raise cherrypy.HTTPError(401, 'invalid_token')
-                    receiver_info['socket'].send_encoded(event.serialize())
+                    self._broadcaster.send(client_id, receiver_info, encoded_event,
+                                           drop_oldest=False, on_error=self._remove_events_receiver)
                 except cherrypy.HTTPError as ex:  # As might be caught from the `check_token` function
                     receiver_info['socket'].close(ex.code, ex.message)
                 except Exception as ex:
-                    logger.error('Failed to distribute events to WebSocket: %s', ex)
-                    cherrypy.engine.publish('remove-events-receiver', client_id)
+                    self._remove_events_receiver(client_id, ex)
         except Exception as ex:
             logger.error('Failed to distribute events to WebSockets: %s', ex)
 
@@ -2585,6 +2622,24 @@ class WebInterface(object):
                         definitions[_source][_metric_type] = definition
         return {'definitions': definitions}
 
+    @openmotics_api(auth=True, check=types(tags='json', start=float, end=float))
+    def get_metric_history(self, metric_type, source='OpenMotics', resolution='raw', tags=None, start=None, end=None):
+        history = self._metrics_controller.get_metric_history(metric_type=metric_type, source=source, resolution=resolution,
+                                                              tags=tags, start=start, end=end)
+        return {'history': history}
+
+    @openmotics_api(auth=True, plugin_exposed=False)
+    def get_websocket_statistics(self):
+        """
+        Returns the send statistics (queue length, dropped data and lag in seconds) of the connected websockets.
+        """
+        statistics = {}
+        for name in ['metrics', 'events']:
+            answers = cherrypy.engine.publish('get-{0}-receivers'.format(name))
+            receivers = answers.pop() if answers else {}
+            statistics[name] = WebSocketBroadcaster.get_statistics(receivers)
+        return {'statistics': statistics}
+
     @openmotics_api(auth=True, plugin_exposed=False)
     def get_can_bus_termination(self):  # type: () -> Dict[str, Any]
         return {'enabled': self._module_controller.load_can_bus_termination()}
@@ -2778,6 +2833,7 @@ class WebService(object):
             cherrypy.engine.autoreload_on = False
 
             cherrypy.engine.start()
+            self._webinterface.start_broadcaster()
             self._https_server.httpserver.error_log = WebService._http_server_logger
             self._http_server.httpserver.error_log = WebService._http_server_logger
             logger.info('Starting webserver... Done')
@@ -2790,6 +2846,7 @@ class WebService(object):
         """ Stop the web service. """
         logger.info('Stopping webserver...')
         cherrypy.engine.exit()  # Shutdown the cherrypy server: no new requests
+        self._webinterface.stop_broadcaster()
         logger.info('Stopping webserver... Done')
 
     def update_tree(self, mounts):
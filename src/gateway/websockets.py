@@ -20,16 +20,22 @@ from __future__ import absolute_import
 import msgpack
 import cherrypy
 import logging
+import time
 import ujson as json
+from collections import deque
+from threading import Lock
 from ws4py import WS_VERSION
 from ws4py.server.cherrypyserver import WebSocketPlugin, WebSocketTool
 from ws4py.websocket import WebSocket
 
+from six.moves.queue import Empty, Queue
+
+from gateway.daemon_thread import BaseThread
 from gateway.enums import BaseEnum
 from gateway.events import GatewayEvent
 
 if False:  # MyPy
-    from typing import Dict, List
+    from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +45,174 @@ class WebSocketEncoding(BaseEnum):
     MSGPACK = 'msgpack'
 
 
+class EncodedData(object):
+    """
+    Data that is encoded only once per serialization method, so it can be sent to multiple websockets
+    """
+
+    def __init__(self, data):  # type: (Dict[str, Any]) -> None
+        self.data = data
+        self._encoded = {}  # type: Dict[str, bytes]
+
+    def encode(self, serialization):  # type: (str) -> bytes
+        encoded = self._encoded.get(serialization)
+        if encoded is None:
+            encoded = OMSocket.encode_data(self.data, serialization)
+            self._encoded[serialization] = encoded
+        return encoded
+
+
+class WebSocketClient(object):
+    """
+    Send queue of a single websocket. A client is only handled by one worker at a time, so its data is sent in order.
+    When the queue is full, either the oldest data is dropped, or the client is marked as overflowed (and should be
+    disconnected so it can reconnect and resynchronize).
+    """
+
+    def __init__(self, client_id, socket, max_length, drop_oldest, on_error):
+        # type: (str, OMSocket, int, bool, Callable[[str, Optional[Exception]], None]) -> None
+        self.client_id = client_id
+        self.socket = socket
+        self.on_error = on_error
+        self._max_length = max_length
+        self._drop_oldest = drop_oldest
+        self._queue = deque()  # type: Deque[Tuple[Any, float]]
+        self._lock = Lock()
+        self._scheduled = False
+        self.overflowed = False
+        self.dropped = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def enqueue(self, data):  # type: (Any) -> bool
+        """ Queues data, returns whether the client needs to be scheduled """
+        with self._lock:
+            if self.overflowed:
+                return False
+            if len(self._queue) >= self._max_length:
+                if not self._drop_oldest:
+                    self.overflowed = True
+                    self._queue.clear()
+                    return False
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((data, time.time()))
+            if self._scheduled:
+                return False
+            self._scheduled = True
+            return True
+
+    def send(self, max_items):  # type: (int) -> bool
+        """ Sends queued data, returns whether the client needs to be rescheduled """
+        for _ in range(max_items):
+            with self._lock:
+                if not self._queue:
+                    break
+                data, timestamp = self._queue.popleft()
+            self.socket.send_encoded(data)
+            self.lag = time.time() - timestamp
+            self.max_lag = max(self.max_lag, self.lag)
+        with self._lock:
+            if self._queue:
+                return True
+            self._scheduled = False
+            return False
+
+    def get_statistics(self):  # type: () -> Dict[str, Any]
+        return {'queue_length': len(self._queue),
+                'dropped': self.dropped,
+                'lag': self.lag,
+                'max_lag': self.max_lag}
+
+
+class WebSocketBroadcaster(object):
+    """
+    Sends data to websockets from a small pool of workers, so a slow client doesn't block the other clients
+    nor the thread that publishes the data. When not running, data is sent synchronously.
+    """
+
+    WORKERS = 2
+    QUEUE_LENGTH = 500
+    BATCH_SIZE = 50
+
+    def __init__(self):  # type: () -> None
+        self._ready_queue = Queue()  # type: Queue  # Queue[Optional[WebSocketClient]]
+        self._workers = []  # type: List[BaseThread]
+        self._running = False
+
+    def start(self):  # type: () -> None
+        self._running = True
+        for i in range(WebSocketBroadcaster.WORKERS):
+            worker = BaseThread(name='wsbroadcast{0}'.format(i), target=self._send_loop)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):  # type: () -> None
+        self._running = False
+        for _ in self._workers:
+            self._ready_queue.put(None)
+        self._workers = []
+
+    def send(self, client_id, receiver_info, data, drop_oldest, on_error):
+        # type: (str, Dict[str, Any], Any, bool, Callable[[str, Optional[Exception]], None]) -> None
+        """
+        Queues data for the receiver's socket. The send queue is kept in the receiver info, so it is cleaned up
+        together with the receiver. The error callback is called when sending fails, or with None when the client
+        can't keep up (and its data isn't allowed to be dropped).
+        """
+        if not self._running:
+            try:
+                receiver_info['socket'].send_encoded(data)
+            except Exception as ex:
+                on_error(client_id, ex)
+            return
+        client = receiver_info.get('client')  # type: Optional[WebSocketClient]
+        if client is None:
+            client = WebSocketClient(client_id=client_id,
+                                     socket=receiver_info['socket'],
+                                     max_length=WebSocketBroadcaster.QUEUE_LENGTH,
+                                     drop_oldest=drop_oldest,
+                                     on_error=on_error)
+            receiver_info['client'] = client
+        if client.enqueue(data):
+            self._ready_queue.put(client)
+        elif client.overflowed:
+            # Disconnect the client, so it can reconnect and resynchronize
+            try:
+                client.socket.close(1008, 'Send queue overflow')
+            except Exception:
+                pass
+            on_error(client_id, None)
+
+    def _send_loop(self):  # type: () -> None
+        while self._running:
+            try:
+                client = self._ready_queue.get(timeout=1)
+            except Empty:
+                continue
+            if client is None:
+                continue
+            try:
+                if client.send(WebSocketBroadcaster.BATCH_SIZE):
+                    self._ready_queue.put(client)  # Round robin, to give other clients a chance
+            except Exception as ex:
+                client.on_error(client.client_id, ex)
+
+    @staticmethod
+    def get_statistics(receivers):  # type: (Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]
+        """ Returns the send statistics (queue length, dropped data and lag in seconds) per client """
+        statistics = {}
+        for client_id, receiver_info in list(receivers.items()):
+            client = receiver_info.get('client')
+            if client is not None:
+                statistics[client_id] = client.get_statistics()
+        return statistics
+
+
 class OMPlugin(WebSocketPlugin):
     def __init__(self, bus):
         WebSocketPlugin.__init__(self, bus)
@@ -151,9 +325,14 @@ class OMSocket(WebSocket):
         """ This function will encode the data according to the serialization setting"""
         if not hasattr(self, 'metadata'):
             raise RuntimeError('Cannot encode data when metadata is not initialized')
+        if isinstance(data, EncodedData):
+            return data.encode(self.metadata['serialization'])
+        return OMSocket.encode_data(data, self.metadata['serialization'])
+
+    @staticmethod
+    def encode_data(data, serialization):
         if not isinstance(data, dict):
             raise RuntimeError('Cannot serialize websocket data that are non dict values')
-        serialization = self.metadata['serialization']
         if serialization == WebSocketEncoding.JSON:
             return json.dumps(data).encode('utf-8')
         elif serialization == WebSocketEncoding.MSGPACK:
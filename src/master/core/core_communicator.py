@@ -24,18 +24,17 @@ import select
 import struct
 import time
 from threading import Lock, Event, Timer
-from collections import Counter
+from collections import Counter, deque
 from six.moves.queue import Empty, Queue
 from gateway.daemon_thread import BaseThread
 from gateway.exceptions import MasterUnavailable
 from ioc import INJECTED, Inject
 from master.core.core_command import CoreCommandSpec
 from master.core.fields import WordField
-from master.core.toolbox import Toolbox
 from serial_utils import CommunicationTimedOutException, Printable
 
 if False:  # MYPY
-    from typing import Dict, Any, Optional, TypeVar, Union, Callable, Set, List
+    from typing import Dict, Any, Optional, TypeVar, Union, Callable, Set, List, Tuple, Deque
     from serial import Serial
     T_co = TypeVar('T_co', bound=None, covariant=True)
 
@@ -80,6 +79,11 @@ class CoreCommunicator(object):
                 CommunicationBlocker.VERSION_SCAN,
                 CommunicationBlocker.FACTORY_RESET]
 
+    # Maximum amount of pipelined commands in flight
+    PIPELINE_WINDOW = 8
+    # Maximum amount of messages kept (per direction) in the debug buffer
+    DEBUG_BUFFER_SIZE = 1000
+
     @Inject
     def __init__(self, controller_serial=INJECTED):
         # type: (Serial) -> None
@@ -107,8 +111,8 @@ class CoreCommunicator(object):
                                      'calls_timedout': [],
                                      'bytes_written': 0,
                                      'bytes_read': 0}  # type: Dict[str,Any]
-        self._debug_buffer = {'read': {},
-                              'write': {}}  # type: Dict[str, Dict[float, bytearray]]
+        self._debug_buffer = {'read': deque(maxlen=CoreCommunicator.DEBUG_BUFFER_SIZE),
+                              'write': deque(maxlen=CoreCommunicator.DEBUG_BUFFER_SIZE)}  # type: Dict[str, Deque[Tuple[float, bytearray]]]
         self._debug_buffer_duration = 300
 
         self._blockages = {}  # type: Dict[str, Dict[str, Any]]
@@ -154,12 +158,13 @@ class CoreCommunicator(object):
 
     def get_debug_buffer(self):
         # type: () -> Dict[str,Dict[float,str]]
+        threshold = time.time() - self._debug_buffer_duration
+
         def process(buffer):
             formatted_buffer = {}
-            for key in list(buffer.keys()):
-                value = buffer.get(key)
-                if value is not None:
-                    formatted_buffer[key] = str(Printable(value))
+            for timestamp, value in list(buffer):
+                if timestamp >= threshold:
+                    formatted_buffer[timestamp] = str(Printable(value))
             return formatted_buffer
 
         return {'read': process(self._debug_buffer['read']),
@@ -239,11 +244,7 @@ class CoreCommunicator(object):
         with self._serial_write_lock:
             logger.debug('Writing to Core serial:   %s', Printable(data))
 
-            threshold = time.time() - self._debug_buffer_duration
-            self._debug_buffer['write'][time.time()] = data
-            for t in list(self._debug_buffer['write'].keys()):
-                if t < threshold:
-                    del self._debug_buffer['write'][t]
+            self._debug_buffer['write'].append((time.time(), data))
 
             self._serial.write(data)
             self._serial_bytes_written += len(data)
@@ -301,6 +302,49 @@ class CoreCommunicator(object):
         :param timeout: maximum allowed time before a CommunicationTimedOutException is raised
         :param bypass_blockers: Indicate which blockers can be bypassed
         """
+        future = self.send_command(command, fields, bypass_blockers=bypass_blockers)
+        return future.result(timeout)
+
+    def do_commands(self, commands, timeout=2, bypass_blockers=None, window=None):
+        # type: (List[Tuple[CoreCommandSpec, Dict[str, Any]]], Union[T_co, int], Optional[List], Optional[int]) -> List[Union[T_co, Dict[str, Any]]]
+        """
+        Send a batch of commands over the serial port, pipelining them. Up to `window` requests (each with its own CID)
+        are written back-to-back, and their replies are routed to the correct caller by the read thread.
+        If the Core does not respond to any of the commands within the timeout period, a CommunicationTimedOutException
+        is raised and the remaining in-flight commands are cancelled.
+
+        :param commands: list of (command specification, input field values) tuples
+        :param timeout: maximum allowed time (per command) before a CommunicationTimedOutException is raised
+        :param bypass_blockers: Indicate which blockers can be bypassed
+        :param window: maximum amount of commands in flight, defaults to PIPELINE_WINDOW
+        :returns: list of responses, in the same order as the given commands
+        """
+        window = max(1, window or CoreCommunicator.PIPELINE_WINDOW)
+        results = []  # type: List[Union[T_co, Dict[str, Any]]]
+        in_flight = deque()  # type: Deque[CommandFuture]
+        try:
+            for command, fields in commands:
+                if len(in_flight) >= window:
+                    results.append(in_flight.popleft().result(timeout))
+                in_flight.append(self.send_command(command, fields, bypass_blockers=bypass_blockers))
+            while in_flight:
+                results.append(in_flight.popleft().result(timeout))
+        except Exception:
+            for future in in_flight:
+                future.cancel()
+            raise
+        return results
+
+    def send_command(self, command, fields, bypass_blockers=None):
+        # type: (CoreCommandSpec, Dict[str, Any], Optional[List]) -> CommandFuture
+        """
+        Send a command over the serial port without waiting for the answer. The returned future can be used
+        to wait for (and retrieve) the Core's answer.
+
+        :param command: specification of the command to execute
+        :param fields: A dictionary with the command input field values
+        :param bypass_blockers: Indicate which blockers can be bypassed
+        """
         self.wait_for_blockers(bypass_blockers=bypass_blockers)
 
         cid = self._get_cid()
@@ -314,25 +358,24 @@ class CoreCommunicator(object):
                 self._consumers.setdefault(consumer.get_hash(), []).append(consumer)
             self._send_command(cid, command, fields)
         except Exception:
+            if consumer is not None:
+                consumers = self._consumers.get(consumer.get_hash(), [])
+                if consumer in consumers:
+                    consumers.remove(consumer)
             self.discard_cid(cid)
             raise
+        return CommandFuture(self, command, consumer)
 
-        try:
-            result = None  # type: Any
-            if consumer is not None and isinstance(consumer, Consumer) and timeout is not None:
-                result = consumer.get(timeout)
-            self._last_success = time.time()
-            self._communication_stats['calls_succeeded'].append(time.time())
-            self._communication_stats['calls_succeeded'] = self._communication_stats['calls_succeeded'][-50:]
-            self._command_success_histogram.update({str(command.instruction): 1})
-            return result
-        except CommunicationTimedOutException:
-            if consumer is not None:
-                self.unregister_consumer(consumer)
-            self._communication_stats['calls_timedout'].append(time.time())
-            self._communication_stats['calls_timedout'] = self._communication_stats['calls_timedout'][-50:]
-            self._command_timeout_histogram.update({str(command.instruction): 1})
-            raise
+    def _report_success(self, command):  # type: (CoreCommandSpec) -> None
+        self._last_success = time.time()
+        self._communication_stats['calls_succeeded'].append(time.time())
+        self._communication_stats['calls_succeeded'] = self._communication_stats['calls_succeeded'][-50:]
+        self._command_success_histogram.update({str(command.instruction): 1})
+
+    def _report_timeout(self, command):  # type: (CoreCommandSpec) -> None
+        self._communication_stats['calls_timedout'].append(time.time())
+        self._communication_stats['calls_timedout'] = self._communication_stats['calls_timedout'][-50:]
+        self._command_timeout_histogram.update({str(command.instruction): 1})
 
     def _send_command(self, cid, command, fields):  # type: (int, CoreCommandSpec, Dict[str, Any]) -> None
         """
@@ -380,10 +423,9 @@ class CoreCommunicator(object):
         Response format: 'RTR' + {CID, 1 byte} + {command, 2 bytes} + {length, 2 bytes} + {payload, `length` bytes} + 'C' + {checksum, 1 byte} + '\r\n'
 
         """
-        data = bytearray()
-        message_length = None
-        header_fields = None
-        header_length = len(CoreCommunicator.START_OF_REPLY) + 1 + 2 + 2  # RTR + CID (1 byte) + command (2 bytes) + length (2 bytes)
+        buffer = ReplyBuffer()
+        start_length = len(CoreCommunicator.START_OF_REPLY)
+        header_length = start_length + 1 + 2 + 2  # RTR + CID (1 byte) + command (2 bytes) + length (2 bytes)
         footer_length = 1 + 1 + len(CoreCommunicator.END_OF_REPLY)  # 'C' + checksum (1 byte) + \r\n
         need_more_data = False
 
@@ -399,92 +441,128 @@ class CoreCommunicator(object):
                 # Read what's now on the serial port
                 num_bytes = self._serial.inWaiting()
                 if num_bytes > 0:
-                    data += self._serial.read(num_bytes)
+                    buffer.append(self._serial.read(num_bytes))
                     # Update counters
                     self._serial_bytes_read += num_bytes
                     self._communication_stats['bytes_read'] += num_bytes
 
-                # Wait for the full message, or the header length
-                min_length = message_length or header_length
-                if len(data) < min_length:
-                    need_more_data = True
-                    continue
-
-                if message_length is None:
-                    # Check if the data contains the START_OF_REPLY
-                    if CoreCommunicator.START_OF_REPLY not in data:
-                        need_more_data = True
-                        continue
-
+                # Process all complete messages that are available
+                while True:
                     # Align with START_OF_REPLY
-                    if not data.startswith(CoreCommunicator.START_OF_REPLY):
-                        data = CoreCommunicator.START_OF_REPLY + data.split(CoreCommunicator.START_OF_REPLY, 1)[-1]
-                        if len(data) < header_length:
-                            continue
-
-                    header_fields = CoreCommunicator._parse_header(data)
-                    message_length = header_fields['length'] + header_length + footer_length
-
-                    # If not all data is present, wait for more data
-                    if len(data) < message_length:
+                    offset = buffer.find(CoreCommunicator.START_OF_REPLY)
+                    if offset == -1:
+                        # Keep a possible partial START_OF_REPLY
+                        buffer.consume(max(0, len(buffer) - start_length + 1))
+                        break
+                    buffer.consume(offset)
+
+                    # Wait for the full message, or the header length
+                    if len(buffer) < header_length:
+                        break
+                    message_length = buffer.unpack_word(start_length + 3) + header_length + footer_length
+                    if len(buffer) < message_length:
+                        break
+
+                    # A possible message is received, log where appropriate
+                    message = buffer.copy(message_length)
+                    logger.debug('Reading from Core serial: %s', Printable(message))
+                    self._debug_buffer['read'].append((time.time(), message))
+
+                    # Validate message boundaries
+                    if not message.endswith(CoreCommunicator.END_OF_REPLY):
+                        logger.warning('Unexpected boundaries: %s', Printable(message))
+                        # Strip the START_OF_REPLY, so we'll wait for the next RTR
+                        buffer.consume(start_length)
                         continue
 
-                message = data[:message_length]  # type: bytearray
-                data = data[message_length:]
-
-                # A possible message is received, log where appropriate
-                logger.debug('Reading from Core serial: %s', Printable(message))
-                threshold = time.time() - self._debug_buffer_duration
-                self._debug_buffer['read'][time.time()] = message
-                for t in list(self._debug_buffer['read'].keys()):
-                    if t < threshold:
-                        del self._debug_buffer['read'][t]
-
-                # Validate message boundaries
-                correct_boundaries = message.startswith(CoreCommunicator.START_OF_REPLY) and message.endswith(CoreCommunicator.END_OF_REPLY)
-                if not correct_boundaries:
-                    logger.warning('Unexpected boundaries: %s', Printable(message))
-                    # Reset, so we'll wait for the next RTR
-                    message_length = None
-                    data = message[3:] + data  # Strip the START_OF_REPLY, and restore full data
-                    continue
-
-                # Validate message CRC
-                crc = bytearray([message[-3]])
-                payload = message[8:-4]  # type: bytearray
-                checked_payload = message[3:-4]  # type: bytearray
-                expected_crc = CoreCommunicator._calculate_crc(checked_payload)
-                if crc != expected_crc:
-                    logger.warning('Unexpected CRC (%s vs expected %s): %s', crc, expected_crc, Printable(checked_payload))
-                    # Reset, so we'll wait for the next RTR
-                    message_length = None
-                    data = message[3:] + data  # Strip the START_OF_REPLY, and restore full data
-                    continue
-
-                # A valid message is received, reliver it to the correct consumer
-                consumers = self._consumers.get(header_fields['hash'], [])
-                for consumer in consumers[:]:
-                    logger.debug('Delivering payload to consumer %s.%s: %s', header_fields['command'], header_fields['cid'], Printable(payload))
-                    consumer.consume(payload)
-                    if isinstance(consumer, Consumer):
-                        self.unregister_consumer(consumer)
-
-                self.discard_cid(header_fields['cid'])
-
-                # Message processed, cleaning up
-                message_length = None
+                    # Validate message CRC
+                    cid = message[start_length]
+                    payload = message[header_length:-footer_length]  # type: bytearray
+                    crc = message[-3]
+                    expected_crc = (sum(payload) +
+                                    cid + message[start_length + 1] + message[start_length + 2] +
+                                    message[start_length + 3] + message[start_length + 4]) % 256
+                    if crc != expected_crc:
+                        logger.warning('Unexpected CRC (%s vs expected %s): %s', crc, expected_crc, Printable(message))
+                        # Strip the START_OF_REPLY, so we'll wait for the next RTR
+                        buffer.consume(start_length)
+                        continue
+                    buffer.consume(message_length)
+
+                    # A valid message is received, reliver it to the correct consumer
+                    key = CoreCommunicator._get_consumer_key(cid, message[start_length + 1], message[start_length + 2])
+                    consumers = self._consumers.get(key)
+                    if consumers:
+                        for consumer in consumers[:]:
+                            logger.debug('Delivering payload to consumer %s.%s: %s', consumer.command.response_instruction, cid, Printable(payload))
+                            consumer.consume(payload)
+                            if isinstance(consumer, Consumer):
+                                self.unregister_consumer(consumer)
+
+                    self.discard_cid(cid)
+                need_more_data = True
             except Exception:
                 logger.exception('Unexpected exception at Core read thread')
-                data = bytearray()
-                message_length = None
+                buffer.clear()
 
     @staticmethod
-    def _parse_header(data):  # type: (bytearray) -> Dict[str, Union[int, bytearray]]
-        base = len(CoreCommunicator.START_OF_REPLY)
-        return {'cid': data[base],
-                'command': data[base + 1:base + 3],
-                'hash': Toolbox.hash(data[:base + 3]),
-                'length': struct.unpack('>H', data[base + 3:base + 5])[0]}
+    def _get_consumer_key(cid, instruction_0, instruction_1):  # type: (int, int, int) -> int
+        """ Get the key under which the consumers for a given CID and (response) instruction are registered. """
+        return (cid << 16) | (instruction_0 << 8) | instruction_1
+
+
+class ReplyBuffer(object):
+    """
+    Preallocated receive buffer for the Core read thread. Received data is appended at the end, and messages are
+    parsed in-place and consumed from the front by moving an offset. The data is only moved (compacted) when the
+    buffer runs out of space at the end, so processing a message doesn't copy all remaining data.
+    """
+
+    def __init__(self, size=4096):  # type: (int) -> None
+        self._buffer = bytearray(size)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):  # type: () -> int
+        return self._end - self._start
+
+    def append(self, data):  # type: (Union[bytes, bytearray]) -> None
+        length = len(data)
+        if self._end + length > len(self._buffer):
+            self._compact(length)
+        self._buffer[self._end:self._end + length] = data
+        self._end += length
+
+    def _compact(self, extra_length):  # type: (int) -> None
+        length = self._end - self._start
+        if length + extra_length > len(self._buffer):
+            buffer = bytearray(max(len(self._buffer) * 2, length + extra_length))
+        else:
+            buffer = self._buffer
+        buffer[:length] = memoryview(self._buffer)[self._start:self._end].tobytes()
+        self._buffer = buffer
+        self._start = 0
+        self._end = length
+
+    def find(self, sub):  # type: (bytearray) -> int
+        """ Find the offset of `sub` relative to the start of the available data, or -1 """
+        index = self._buffer.find(sub, self._start, self._end)
+        return index if index == -1 else index - self._start
+
+    def unpack_word(self, offset):  # type: (int) -> int
+        return struct.unpack_from('>H', self._buffer, self._start + offset)[0]
+
+    def copy(self, length):  # type: (int) -> bytearray
+        return self._buffer[self._start:self._start + length]
+
+    def consume(self, length):  # type: (int) -> None
+        self._start = min(self._start + length, self._end)
+        if self._start == self._end:
+            self.clear()
+
+    def clear(self):  # type: () -> None
+        self._start = 0
+        self._end = 0
 
 
 class Consumer(object):
@@ -500,9 +578,9 @@ class Consumer(object):
 
     def get_hash(self):  # type: () -> int
         """ Get an identification hash for this consumer. """
-        return Toolbox.hash(CoreCommunicator.START_OF_REPLY +
-                            bytearray([self.cid]) +
-                            self.command.response_instruction)
+        return CoreCommunicator._get_consumer_key(self.cid,
+                                                  self.command.response_instruction[0],
+                                                  self.command.response_instruction[1])
 
     def consume(self, payload):  # type: (bytearray) -> None
         """ Consume payload. """
@@ -522,6 +600,45 @@ class Consumer(object):
             raise CommunicationTimedOutException('No Core data received in {0}s'.format(timeout))
 
 
+class CommandFuture(object):
+    """
+    Handle to a command that was sent to the Core. The Core's answer is delivered to the
+    underlying consumer by the read thread, and can be retrieved using result().
+    """
+
+    def __init__(self, communicator, command, consumer):  # type: (CoreCommunicator, CoreCommandSpec, Optional[Consumer]) -> None
+        self.command = command
+        self._communicator = communicator
+        self._consumer = consumer
+
+    @property
+    def cid(self):  # type: () -> Optional[int]
+        return self._consumer.cid if self._consumer is not None else None
+
+    def result(self, timeout):  # type: (Union[T_co, int]) -> Union[T_co, Dict[str, Any]]
+        """
+        Wait until the Core replies or the timeout expires.
+
+        :param timeout: timeout in seconds, None to not wait for an answer
+        :returns: dict containing the output fields of the command
+        """
+        try:
+            result = None  # type: Any
+            if self._consumer is not None and timeout is not None:
+                result = self._consumer.get(timeout)
+            self._communicator._report_success(self.command)
+            return result
+        except CommunicationTimedOutException:
+            self.cancel()
+            self._communicator._report_timeout(self.command)
+            raise
+
+    def cancel(self):  # type: () -> None
+        """ Stop waiting for the answer, releasing the CID. """
+        if self._consumer is not None:
+            self._communicator.unregister_consumer(self._consumer)
+
+
 class BackgroundConsumer(object):
     """
     A consumer that runs in the background. The BackgroundConsumer does not provide get()
@@ -555,9 +672,9 @@ class BackgroundConsumer(object):
 
     def get_hash(self):  # type: () -> int
         """ Get an identification hash for this consumer. """
-        return Toolbox.hash(CoreCommunicator.START_OF_REPLY +
-                            bytearray([self.cid]) +
-                            self.command.response_instruction)
+        return CoreCommunicator._get_consumer_key(self.cid,
+                                                  self.command.response_instruction[0],
+                                                  self.command.response_instruction[1])
 
     def consume(self, payload):  # type: (bytearray) -> None
         """ Consume payload. """
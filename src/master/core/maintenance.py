@@ -48,6 +48,7 @@ class MaintenanceCoreCommunicator(MaintenanceCommunicator):
         self._stopped = True
         self._read_data_thread = None  # type: Optional[BaseThread]
         self._active = False
+        self._commands_sent = False
 
     def start(self):
         # type: () -> None
@@ -67,12 +68,16 @@ class MaintenanceCoreCommunicator(MaintenanceCommunicator):
     def activate(self):
         # type: () -> None
         self._active = True  # Core has a separate serial port
+        self._commands_sent = False
 
     def deactivate(self, join=True):
         # type: (bool) -> None
         _ = join
         self._active = False  # Core has a separate serial port
-        self._memory_file.invalidate_cache(reason='maintenance exit')
+        if self._commands_sent:
+            # The memory might have been changed using the CLI
+            self._memory_file.invalidate_cache(reason='maintenance exit')
+        self._commands_sent = False
 
     def set_receiver(self, callback):
         # type: (Callable[[str],Any]) -> None
@@ -118,4 +123,5 @@ class MaintenanceCoreCommunicator(MaintenanceCommunicator):
         if message is None:
             return
         with self._write_lock:
+            self._commands_sent = True
             self._serial.write(bytearray('{0}\r\n'.format(message.strip()).encode()))
@@ -0,0 +1,157 @@
+# Copyright (C) 2021 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Persistent (on-disk) memory page cache
+"""
+from __future__ import absolute_import
+
+import logging
+import mmap
+import os
+import struct
+import zlib
+from threading import Lock
+
+if False:  # MYPY
+    from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentMemoryCache(object):
+    """
+    A memory-mapped on-disk copy of a memory page cache, so a service restart doesn't require all pages to be
+    read from the Core again.
+
+    File layout: a header (magic, format version, dirty flag and stamp), a valid flag per page and the page data.
+    The stamp identifies the Core memory the cache belongs to and must be validated against the Core before the
+    cached pages can be used. The dirty flag is set as long as there are unflushed changes, so a cache file that
+    was not cleanly flushed (e.g. a crash) is discarded.
+    """
+
+    MAGIC = b'OMMC'
+    FORMAT_VERSION = 1
+    HEADER = struct.Struct('>4sBBxxI')  # Magic, format version, dirty flag, (padding), stamp
+
+    def __init__(self, path, pages, page_size):  # type: (str, int, int) -> None
+        self._path = path
+        self._pages = pages
+        self._page_size = page_size
+        self._data_offset = PersistentMemoryCache.HEADER.size + pages
+        self._file_size = self._data_offset + pages * page_size
+        self._lock = Lock()
+        self._file = None  # type: Optional[mmap.mmap]
+        self._dirty = False
+
+    def open(self):  # type: () -> None
+        """ Opens (and if needed, creates or resets) the cache file """
+        with self._lock:
+            if self._file is not None:
+                return
+            valid = False
+            if os.path.exists(self._path) and os.path.getsize(self._path) == self._file_size:
+                with open(self._path, 'rb') as cache_file:
+                    magic, version, dirty, _ = PersistentMemoryCache.HEADER.unpack(cache_file.read(PersistentMemoryCache.HEADER.size))
+                valid = magic == PersistentMemoryCache.MAGIC and version == PersistentMemoryCache.FORMAT_VERSION and not dirty
+                if not valid:
+                    logger.info('MEMORY: Discarding invalid or unclean persistent cache')
+            if not valid:
+                with open(self._path, 'wb') as cache_file:
+                    cache_file.write(PersistentMemoryCache.HEADER.pack(PersistentMemoryCache.MAGIC, PersistentMemoryCache.FORMAT_VERSION, 0, 0))
+                    cache_file.write(bytearray(self._file_size - PersistentMemoryCache.HEADER.size))
+            with open(self._path, 'r+b') as cache_file:
+                self._file = mmap.mmap(cache_file.fileno(), self._file_size)
+            self._dirty = False
+
+    def close(self):  # type: () -> None
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @property
+    def stamp(self):  # type: () -> int
+        if self._file is None:
+            return 0
+        return PersistentMemoryCache.HEADER.unpack_from(self._file, 0)[3]
+
+    @staticmethod
+    def calculate_stamp(*parts):  # type: (bytearray) -> int
+        stamp = 0
+        for part in parts:
+            stamp = zlib.crc32(bytes(part), stamp)
+        return stamp & 0xFFFFFFFF
+
+    def set_stamp(self, stamp):  # type: (int) -> None
+        with self._lock:
+            if self._file is None:
+                return
+            self._mark_dirty()
+            struct.pack_into('>I', self._file, 8, stamp)
+
+    def load(self):  # type: () -> Dict[int, bytearray]
+        """ Returns all valid pages """
+        pages = {}  # type: Dict[int, bytearray]
+        with self._lock:
+            if self._file is None:
+                return pages
+            valid_flags = bytearray(self._file[PersistentMemoryCache.HEADER.size:self._data_offset])
+            for page, valid in enumerate(valid_flags):
+                if valid:
+                    start = self._data_offset + page * self._page_size
+                    pages[page] = bytearray(self._file[start:start + self._page_size])
+        return pages
+
+    def store(self, page, data):  # type: (int, bytearray) -> None
+        with self._lock:
+            if self._file is None or not 0 <= page < self._pages or len(data) != self._page_size:
+                return
+            self._mark_dirty()
+            start = self._data_offset + page * self._page_size
+            self._file[start:start + self._page_size] = bytes(data)
+            index = PersistentMemoryCache.HEADER.size + page
+            self._file[index:index + 1] = b'\x01'
+
+    def invalidate(self, pages=None):  # type: (Optional[List[int]]) -> None
+        """ Invalidates the given pages, or all pages if no pages are given """
+        with self._lock:
+            if self._file is None:
+                return
+            self._mark_dirty()
+            if pages is None:
+                self._file[PersistentMemoryCache.HEADER.size:self._data_offset] = bytes(bytearray(self._pages))
+            else:
+                for page in pages:
+                    if 0 <= page < self._pages:
+                        index = PersistentMemoryCache.HEADER.size + page
+                        self._file[index:index + 1] = b'\x00'
+
+    def flush(self):  # type: () -> None
+        """ Writes all changes to disk and marks the cache clean """
+        with self._lock:
+            if self._file is None or not self._dirty:
+                return
+            self._file.flush()
+            self._file[5:6] = b'\x00'
+            self._file.flush()
+            self._dirty = False
+
+    def _mark_dirty(self):  # type: () -> None
+        if self._file is None or self._dirty:
+            return
+        self._file[5:6] = b'\x01'
+        self._file.flush()
+        self._dirty = True
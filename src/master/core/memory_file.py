@@ -20,6 +20,7 @@ from __future__ import absolute_import
 import logging
 import time
 import threading
+from collections import deque
 from threading import Lock, Event as ThreadingEvent
 
 from gateway.daemon_thread import BaseThread
@@ -29,10 +30,12 @@ from ioc import INJECTED, Inject, Singleton
 from master.core.core_api import CoreAPI
 from master.core.core_communicator import BackgroundConsumer, CoreCommunicator
 from master.core.events import Event
+from master.core.memory_cache import PersistentMemoryCache
 from master.core.memory_types import MemoryAddress
 
 if False:  # MYPY
-    from typing import List, Dict, Callable, Any, Optional, Tuple, Set
+    from typing import List, Dict, Callable, Any, Deque, Optional, Tuple, Set
+    from master.core.core_command import CoreCommandSpec
 
 logger = logging.getLogger(__name__)
 
@@ -49,16 +52,23 @@ class MemoryFile(object):
     READ_TIMEOUT = 5
     ACTIVATE_TIMEOUT = 5
     ACTIVATION_HOLD_TIME = 1
+    ACTIVATION_MAX_HOLD_TIME = 10
+    ACTIVATION_EVENT_TIMEOUT = 300
+    VERIFY_BATCH_SIZE = 16
     FRAM_TIMEOUT = 5
     WRITE_CHUNK_SIZE = 32
+    WRITE_MERGE_GAP = 8
+    READ_CHUNK_SIZE = 32
     SIZES = {MemoryTypes.EEPROM: (512, 256),
              MemoryTypes.FRAM: (128, 256)}
 
     @Inject
-    def __init__(self, master_communicator=INJECTED, pubsub=INJECTED):
-        # type: (CoreCommunicator, PubSub) -> None
+    def __init__(self, master_communicator=INJECTED, pubsub=INJECTED, cache_path=None):
+        # type: (CoreCommunicator, PubSub, Optional[str]) -> None
         """
         Initializes the MemoryFile instance, reprensenting read/write to EEPROM and FRAM
+
+        :param cache_path: Optional path of a file in which the EEPROM cache is persisted between restarts
         """
         if not master_communicator:
             raise RuntimeError('Could not inject argument: core_communicator')
@@ -68,6 +78,13 @@ class MemoryFile(object):
 
         self._eeprom_cache = {}  # type: Dict[int, bytearray]
         self._fram_cache = {}  # type: Dict[int, Tuple[float, bytearray]]
+        self._persistent_cache = None  # type: Optional[PersistentMemoryCache]
+        self._persistent_cache_identity = bytearray()
+        self._unverified_pages = set()  # type: Set[int]
+        if cache_path is not None:
+            self._persistent_cache = PersistentMemoryCache(path=cache_path,
+                                                           pages=MemoryFile.SIZES[MemoryTypes.EEPROM][0],
+                                                           page_size=MemoryFile.SIZES[MemoryTypes.EEPROM][1])
 
         # The write-cache is a per-thread/per-type cache of all changes that need to be written that has the page
         # as key, and a list of tuples as value, where the tuples holds the start byte and contents
@@ -80,7 +97,14 @@ class MemoryFile(object):
         self._activate_lock = Lock()
         self._activator_thread = None  # type: Optional[BaseThread]
         self._activation_event = ThreadingEvent()
+        self._sent_activations = deque()  # type: Deque[float]
         self._needs_activation = ThreadingEvent()
+        self._last_commit = 0.0
+        self._write_statistics = {'bytes_written': 0,
+                                  'bytes_skipped': 0,
+                                  'write_commands': 0,
+                                  'commits': 0,
+                                  'activations': 0}
 
         self._eeprom_change_callback = None  # type: Optional[Callable[[], None]]
 
@@ -98,24 +122,128 @@ class MemoryFile(object):
         self._stop = True
         if self._activator_thread is not None:
             self._activator_thread.join()
+        if self._persistent_cache is not None:
+            self._persistent_cache.close()
 
     def _activator(self):
+        self._restore_persistent_cache()
         while not self._stop:
             try:
                 if self._needs_activation.wait(timeout=0.25):
-                    time.sleep(MemoryFile.ACTIVATION_HOLD_TIME)  # Allow multiple commits in a single activation
+                    self._hold_activation()
                     self._needs_activation.clear()
                     self._activate()
+                elif self._unverified_pages:
+                    self._verify_pages()
             except Exception:
                 logger.exception('Unexpected error while activating')
                 time.sleep(5)
 
+    def _hold_activation(self):  # type: () -> None
+        """
+        Postpones the activation until no commits were done for ACTIVATION_HOLD_TIME (with a maximum
+        of ACTIVATION_MAX_HOLD_TIME), so subsequent commits (e.g. a restore) result in a single activation.
+        """
+        started = time.time()
+        while not self._stop:
+            remaining = min(self._last_commit + MemoryFile.ACTIVATION_HOLD_TIME,
+                            started + MemoryFile.ACTIVATION_MAX_HOLD_TIME) - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.25))
+
+    def get_write_statistics(self):  # type: () -> Dict[str, int]
+        statistics = dict(self._write_statistics)
+        statistics['activations_avoided'] = max(0, statistics['commits'] - statistics['activations'])
+        return statistics
+
     def _handle_event(self, data):  # type: (Dict[str, Any]) -> None
         core_event = Event(data)
         if core_event.type == Event.Types.SYSTEM:
             if core_event.data['type'] == Event.SystemEventTypes.EEPROM_ACTIVATE:
+                if not self._is_own_activation():
+                    # The EEPROM was changed and activated by something else. It's unknown which pages were
+                    # changed, so the complete (persistent) cache is invalidated.
+                    self.invalidate_cache(reason='external activation')
                 self._activation_event.set()
 
+    def _is_own_activation(self):  # type: () -> bool
+        """ Matches an activation event with an activation sent by this instance, as its event can arrive late """
+        threshold = time.time() - MemoryFile.ACTIVATION_EVENT_TIMEOUT
+        while self._sent_activations and self._sent_activations[0] < threshold:
+            self._sent_activations.popleft()  # The event for this activation was lost
+        if self._sent_activations:
+            self._sent_activations.popleft()
+            return True
+        return False
+
+    def _restore_persistent_cache(self):  # type: () -> None
+        """
+        Loads the persistent EEPROM cache, if its stamp still matches the Core. The stamp is based on the
+        Core firmware version and the global configuration page (e.g. the amount of modules). Other pages
+        might have been changed while the gateway was not running, so the restored pages are verified in
+        the background.
+        """
+        if self._persistent_cache is None:
+            return
+        try:
+            self._persistent_cache.open()
+            version = self._core_communicator.do_command(command=CoreAPI.get_firmware_version(),
+                                                         fields={})['version']
+            self._persistent_cache_identity = bytearray(version.encode('ascii'))
+            pages = self._persistent_cache.load()
+            stamp = self._calculate_cache_stamp(self._read_pages([(MemoryTypes.EEPROM, 0)])[MemoryTypes.EEPROM][0])
+            if pages and stamp == self._persistent_cache.stamp:
+                for page, page_data in pages.items():
+                    self._eeprom_cache.setdefault(page, page_data)
+                self._unverified_pages = set(pages.keys())
+                logger.info('MEMORY: Restored {0} pages from persistent cache'.format(len(pages)))
+            else:
+                if pages:
+                    logger.info('MEMORY: Persistent cache outdated, discarding')
+                self._persistent_cache.invalidate()
+                self._persistent_cache.set_stamp(stamp)
+                self._persist_pages(list(self._eeprom_cache.keys()))
+            self._persistent_cache.flush()
+        except Exception:
+            logger.exception('MEMORY: Could not restore persistent cache')
+            self._persistent_cache.close()
+            self._persistent_cache = None
+
+    def _verify_pages(self):  # type: () -> None
+        """ Re-reads a batch of pages that were restored from the persistent cache, updating outdated pages """
+        pages = sorted(self._unverified_pages)[:MemoryFile.VERIFY_BATCH_SIZE]
+        changed_pages = []
+        with self._commit_lock:  # Make sure the pages are not changed by a commit while reading
+            raw_data = self._read_pages([(MemoryTypes.EEPROM, page) for page in pages])[MemoryTypes.EEPROM]
+            for page in pages:
+                self._unverified_pages.discard(page)
+                cached_data = self._eeprom_cache.get(page)
+                if cached_data is not None and cached_data != raw_data[page]:
+                    self._eeprom_cache[page] = raw_data[page]
+                    changed_pages.append(page)
+            if changed_pages:
+                self._persist_pages(changed_pages)
+                if self._persistent_cache is not None:
+                    self._persistent_cache.flush()
+        if changed_pages:
+            logger.info('MEMORY: {0} pages of the persistent cache were outdated'.format(len(changed_pages)))
+            self._notify_eeprom_changed(activation=False)
+
+    def _calculate_cache_stamp(self, global_page):  # type: (bytearray) -> int
+        return PersistentMemoryCache.calculate_stamp(self._persistent_cache_identity, global_page)
+
+    def _persist_pages(self, pages):  # type: (List[int]) -> None
+        persistent_cache = self._persistent_cache
+        if persistent_cache is None:
+            return
+        for page in pages:
+            page_data = self._eeprom_cache.get(page)
+            if page_data is not None:
+                persistent_cache.store(page, page_data)
+                if page == 0:
+                    persistent_cache.set_stamp(self._calculate_cache_stamp(page_data))
+
     def _get_write_cache(self):  # type: () -> Tuple[Dict[str, Dict[int, Dict[int, int]]], Lock]
         thread_id = threading.current_thread().ident or 0
         if thread_id not in self._write_cache:
@@ -150,30 +278,70 @@ class MemoryFile(object):
             data[address] = raw_data[address.memory_type][address.page][address.offset:address.offset + address.length]
         return data
 
+    def prefetch(self, addresses):  # type: (List[MemoryAddress]) -> None
+        """
+        Makes sure all pages used by the given addresses are cached, loading the missing pages in a single bulk read.
+        """
+        read_map = MemoryFile._create_read_map(addresses)
+        self._load_data(read_map, read_through=False)
+
     def _load_data(self, read_map, read_through):
         # type: (Dict[str, Set[int]], bool) -> Dict[str, Dict[int, bytearray]]
-        raw_data = {MemoryTypes.EEPROM: {},
-                    MemoryTypes.FRAM: {}}  # type: Dict[str, Dict[int, bytearray]]
-        for page in read_map.get(MemoryTypes.EEPROM, set()):
-            if page not in self._eeprom_cache or read_through:
-                self._eeprom_cache[page] = self._read_data(MemoryTypes.EEPROM, page)
-            raw_data[MemoryTypes.EEPROM][page] = self._eeprom_cache[page]
         time_limit = time.time() - MemoryFile.FRAM_TIMEOUT
-        for page in read_map.get(MemoryTypes.FRAM, set()):
-            if page not in self._fram_cache or self._fram_cache[page][0] < time_limit or read_through:
-                self._fram_cache[page] = (time.time(), self._read_data(MemoryTypes.FRAM, page))
-            raw_data[MemoryTypes.FRAM][page] = self._fram_cache[page][1]
+        eeprom_pages = read_map.get(MemoryTypes.EEPROM, set())
+        fram_pages = read_map.get(MemoryTypes.FRAM, set())
+        # The cached pages are taken at once, as the cache can be invalidated (by other threads) while reading
+        cached_eeprom = {}  # type: Dict[int, bytearray]
+        cached_fram = {}  # type: Dict[int, bytearray]
+        missing_pages = []  # type: List[Tuple[str, int]]
+        for page in eeprom_pages:
+            page_data = None if read_through else self._eeprom_cache.get(page)
+            if page_data is None:
+                missing_pages.append((MemoryTypes.EEPROM, page))
+            else:
+                cached_eeprom[page] = page_data
+        for page in fram_pages:
+            cached_page = None if read_through else self._fram_cache.get(page)
+            if cached_page is None or cached_page[0] < time_limit:
+                missing_pages.append((MemoryTypes.FRAM, page))
+            else:
+                cached_fram[page] = cached_page[1]
+        raw_data = self._read_pages(missing_pages)
+        for page in eeprom_pages:
+            if page in raw_data[MemoryTypes.EEPROM]:
+                self._eeprom_cache[page] = raw_data[MemoryTypes.EEPROM][page]
+            else:
+                raw_data[MemoryTypes.EEPROM][page] = cached_eeprom[page]
+        if self._persistent_cache is not None and raw_data[MemoryTypes.EEPROM]:
+            self._persist_pages([page for memory_type, page in missing_pages if memory_type == MemoryTypes.EEPROM])
+            self._persistent_cache.flush()
+        for page in fram_pages:
+            if page in raw_data[MemoryTypes.FRAM]:
+                self._fram_cache[page] = (time.time(), raw_data[MemoryTypes.FRAM][page])
+            else:
+                raw_data[MemoryTypes.FRAM][page] = cached_fram[page]
         return raw_data
 
-    def _read_data(self, memory_type, page):
-        page_data = bytearray()
-        for i in range(MemoryFile.SIZES[memory_type][1] // 32):
-            page_data += self._core_communicator.do_command(
-                command=CoreAPI.memory_read(),
-                fields={'type': memory_type, 'page': page, 'start': i * 32, 'length': 32},
-                timeout=MemoryFile.READ_TIMEOUT
-            )['data']
-        return page_data
+    def _read_pages(self, pages):  # type: (List[Tuple[str, int]]) -> Dict[str, Dict[int, bytearray]]
+        """
+        Reads the given (memory type, page) pages. All read commands are pipelined, so the pages are fetched concurrently.
+        """
+        raw_data = {MemoryTypes.EEPROM: {},
+                    MemoryTypes.FRAM: {}}  # type: Dict[str, Dict[int, bytearray]]
+        if not pages:
+            return raw_data
+        commands = []
+        for memory_type, page in pages:
+            for i in range(MemoryFile.SIZES[memory_type][1] // MemoryFile.READ_CHUNK_SIZE):
+                commands.append((CoreAPI.memory_read(), {'type': memory_type, 'page': page,
+                                                         'start': i * MemoryFile.READ_CHUNK_SIZE,
+                                                         'length': MemoryFile.READ_CHUNK_SIZE}))
+        responses = self._core_communicator.do_commands(commands=commands,
+                                                        timeout=MemoryFile.READ_TIMEOUT)
+        for (_, fields), response in zip(commands, responses):
+            page_data = raw_data[fields['type']].setdefault(fields['page'], bytearray())
+            page_data += response['data']
+        return raw_data
 
     def write(self, data_map):  # type: (Dict[MemoryAddress, bytearray]) -> None
         write_cache, lock = self._get_write_cache()
@@ -183,48 +351,61 @@ class MemoryFile(object):
                 for index, data_byte in enumerate(data):
                     page_cache[address.offset + index] = data_byte
 
+    def _get_write_ranges(self, memory_type, page, page_data):
+        # type: (str, int, Dict[int, int]) -> List[Tuple[int, bytearray]]
+        """
+        Converts the bytes written to a page into sorted (start, data) ranges. Bytes that equal the cached
+        EEPROM page are skipped and ranges close to each other are merged, filling the gap from the cache.
+        A range never crosses the 127/128 byte boundary.
+        """
+        cached_data = self._eeprom_cache.get(page) if memory_type == MemoryTypes.EEPROM else None
+        ranges = []  # type: List[Tuple[int, bytearray]]
+        for byte_number in sorted(page_data):
+            data_byte = page_data[byte_number]
+            if cached_data is not None and cached_data[byte_number] == data_byte:
+                self._write_statistics['bytes_skipped'] += 1
+                continue
+            if ranges:
+                start, data = ranges[-1]
+                end = start + len(data)
+                gap = byte_number - end
+                if (start <= 127) == (byte_number <= 127):
+                    if gap == 0:
+                        data.append(data_byte)
+                        continue
+                    if cached_data is not None and gap <= MemoryFile.WRITE_MERGE_GAP:
+                        data += cached_data[end:byte_number]
+                        data.append(data_byte)
+                        continue
+            ranges.append((byte_number, bytearray([data_byte])))
+        return ranges
+
     def _store_data(self, write_cache):  # type: (Dict[str, Dict[int, Dict[int, int]]]) -> bool
-        data_written = False
+        commands = []  # type: List[Tuple[CoreCommandSpec, Dict[str, Any]]]
+        cache_updates = []  # type: List[Tuple[int, int, bytearray]]
         for memory_type, type_data in write_cache.items():
             for page, page_data in type_data.items():
-                byte_numbers = list(page_data.keys())
-                while len(byte_numbers) > 0:
-                    # Get contiguous series of bytes
-                    start = min(byte_numbers)
-                    end = max(byte_numbers)
-                    if start <= 127:
-                        # Prevent writing over the 127/128 byte boundary
-                        end = min(127, end)
-                    data = bytearray()
-                    for byte_number in range(start, end + 1):
-                        if byte_number in page_data:
-                            data.append(page_data[byte_number])
-                            byte_numbers.remove(byte_number)
-                        else:
-                            break
-                    # Compare with cache (is anything changed)
-                    if memory_type == MemoryTypes.EEPROM:
-                        cached_data = None
-                        if page in self._eeprom_cache:
-                            cached_data = self._eeprom_cache[page][start:start + len(data)]
-                        if data == cached_data:
-                            continue
+                for start, data in self._get_write_ranges(memory_type, page, page_data):
                     # Write in chuncks
                     for i in range(0, len(data), MemoryFile.WRITE_CHUNK_SIZE):
                         chunk = data[i:i + MemoryFile.WRITE_CHUNK_SIZE]
                         logger.info('MEMORY.{0}: Write P{1} S{2} D[{3}]'.format(memory_type, page, start + i, ' '.join(str(b) for b in chunk)))
-                        self._core_communicator.do_command(
-                            command=CoreAPI.memory_write(len(chunk)),
-                            fields={'type': memory_type, 'page': page, 'start': start + i, 'data': chunk},
-                            timeout=MemoryFile.WRITE_TIMEOUT
-                        )
-                        data_written = True
-                    # Cache updated values
+                        commands.append((CoreAPI.memory_write(len(chunk)),
+                                         {'type': memory_type, 'page': page, 'start': start + i, 'data': chunk}))
                     if memory_type == MemoryTypes.EEPROM:
-                        if page in self._eeprom_cache:
-                            for index, data_byte in enumerate(data):
-                                self._eeprom_cache[page][start + index] = data_byte
-        return data_written
+                        cache_updates.append((page, start, data))
+        if not commands:
+            return False
+        self._core_communicator.do_commands(commands=commands,
+                                            timeout=MemoryFile.WRITE_TIMEOUT)
+        self._write_statistics['write_commands'] += len(commands)
+        self._write_statistics['bytes_written'] += sum(len(fields['data']) for _, fields in commands)
+        # Cache updated values
+        for page, start, data in cache_updates:
+            if page in self._eeprom_cache:
+                self._eeprom_cache[page][start:start + len(data)] = data
+        self._persist_pages(sorted(set(page for page, _, _ in cache_updates)))
+        return True
 
     def commit(self):  # type: () -> None
         with self._commit_lock:
@@ -233,8 +414,12 @@ class MemoryFile(object):
             with write_lock:
                 data_written = self._store_data(write_cache)
                 self._clear_write_cache()
+            if self._persistent_cache is not None:
+                self._persistent_cache.flush()
             if data_written:
                 logger.info('MEMORY: Activate requested')
+                self._write_statistics['commits'] += 1
+                self._last_commit = time.time()
                 self._needs_activation.set()
             else:
                 logger.info('MEMORY: No activation required')
@@ -243,21 +428,43 @@ class MemoryFile(object):
         with self._activate_lock, self._commit_lock:
             logger.info('MEMORY: Activating')
             self._activation_event.clear()
-            self._core_communicator.do_command(
-                command=CoreAPI.basic_action(),
-                fields={'type': 200, 'action': 1, 'device_nr': 0, 'extra_parameter': 0},
-                timeout=MemoryFile.ACTIVATE_TIMEOUT
-            )
+            self._sent_activations.append(time.time())
+            self._write_statistics['activations'] += 1
+            try:
+                self._core_communicator.do_command(
+                    command=CoreAPI.basic_action(),
+                    fields={'type': 200, 'action': 1, 'device_nr': 0, 'extra_parameter': 0},
+                    timeout=MemoryFile.ACTIVATE_TIMEOUT
+                )
+            except Exception:
+                if self._sent_activations:
+                    self._sent_activations.pop()  # No activation event will follow
+                raise
             self._activation_event.wait(timeout=60.0)
             logger.info('MEMORY: Activated')
             self._notify_eeprom_changed(activation=True)
 
-    def invalidate_cache(self, reason):  # type: (str) -> None
-        for page in range(MemoryFile.SIZES[MemoryTypes.EEPROM][0]):
+    def invalidate_cache(self, reason, addresses=None):  # type: (str, Optional[List[MemoryAddress]]) -> None
+        """
+        Invalidates the pages of the given addresses, or the complete cache if no addresses are given
+        """
+        if addresses is None:
+            eeprom_pages = list(range(MemoryFile.SIZES[MemoryTypes.EEPROM][0]))
+            fram_pages = list(range(MemoryFile.SIZES[MemoryTypes.FRAM][0]))
+        else:
+            eeprom_pages = sorted(set(address.page for address in addresses if address.memory_type == MemoryTypes.EEPROM))
+            fram_pages = sorted(set(address.page for address in addresses if address.memory_type == MemoryTypes.FRAM))
+        for page in eeprom_pages:
             self._eeprom_cache.pop(page, None)
-        for page in range(MemoryFile.SIZES[MemoryTypes.FRAM][0]):
+        for page in fram_pages:
             self._fram_cache.pop(page, None)
-        logger.info('MEMORY: Cache cleared ({0})'.format(reason))
+        if self._persistent_cache is not None:
+            self._persistent_cache.invalidate(None if addresses is None else eeprom_pages)
+            self._persistent_cache.flush()
+        if addresses is None:
+            logger.info('MEMORY: Cache cleared ({0})'.format(reason))
+        else:
+            logger.info('MEMORY: Cache cleared for {0} EEPROM and {1} FRAM pages ({2})'.format(len(eeprom_pages), len(fram_pages), reason))
         self._notify_eeprom_changed(activation=False)
 
     def _notify_eeprom_changed(self, activation):
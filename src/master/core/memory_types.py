@@ -41,17 +41,21 @@ class MemoryModelDefinition(object):
 
     _cache_fields = {}  # type: Dict[str,Any]
     _cache_addresses = {}  # type: Dict[str,Any]
+    _cache_properties = set()  # type: Set[type]
     _cache_lock = Lock()
 
     @Inject
-    def __init__(self, id, memory_file=INJECTED, verbose=False, read_through=False):
-        # type: (Optional[int], MemoryFile, bool, bool) -> None
+    def __init__(self, id, memory_file=INJECTED, verbose=False, read_through=False, _id_limits=None):
+        # type: (Optional[int], MemoryFile, bool, bool, Optional[Tuple[int, int]]) -> None
         self._id = id
         self._id_field = self.__class__._get_id_field()  # TODO: Make sure that an id field is mandatory for id-lookups
         if self._id_field is not None:
             if id is None:
                 raise RuntimeError('An id is mandatory')
-            self._id_field.validate(self.__class__.__name__, id, read_through)
+            self._id_field.validate(self.__class__.__name__, id, read_through, limits=_id_limits)
+        # The class properties only need to be created once per model
+        install_properties = self.__class__ not in MemoryModelDefinition._cache_properties
+        if self._id_field is not None and install_properties:
             setattr(self.__class__, 'id', property(lambda s: s._id))
         self._verbose = verbose
         self._memory_file = memory_file
@@ -74,7 +78,8 @@ class MemoryModelDefinition(object):
                                                                                                                            read_through=read_through),
                                                                                       default=field_type._checksum._default))
             setattr(self, '_{0}'.format(field_name), memory_field_container)
-            self._add_property(field_name)
+            if install_properties:
+                self._add_property(field_name)
             self._fields.append(field_name)
         for field_name, relation in self.__class__._get_relational_fields().items():
             relation_container = MemoryRelationContainer(instance_type=relation._instance_type,
@@ -85,7 +90,8 @@ class MemoryModelDefinition(object):
                                                                             memory_address=relation._field.get_address(self._id),
                                                                             read_through=read_through))
             setattr(self, '_{0}'.format(field_name), relation_container)
-            self._add_relation(field_name)
+            if install_properties:
+                self._add_relation(field_name)
             self._relations.append(field_name)
         for field_name, composition in self.__class__._get_composite_fields().items():
             setattr(self, '_{0}'.format(field_name), CompositionContainer(composite_definition=composition,
@@ -95,8 +101,11 @@ class MemoryModelDefinition(object):
                                                                                                                memory_field=composition._field,
                                                                                                                memory_address=composition._field.get_address(self._id),
                                                                                                                read_through=read_through)))
-            self._add_composition(field_name)
+            if install_properties:
+                self._add_composition(field_name)
             self._compositions.append(field_name)
+        if install_properties:
+            MemoryModelDefinition._cache_properties.add(self.__class__)
 
     def __str__(self):
         return str(json.dumps(self.serialize(), indent=4))
@@ -246,6 +255,56 @@ class MemoryModelDefinition(object):
             class_cache[id] = cache
         return cache
 
+    @classmethod
+    def get_addresses(cls, ids):  # type: (List[Optional[int]]) -> List[MemoryAddress]
+        """ Returns all memory addresses used by the given instances """
+        addresses = []  # type: List[MemoryAddress]
+        fields = [field for _, field in cls._get_relational_fields().items() if field._field is not None]
+        fields += [field for _, field in cls._get_composite_fields().items()]
+        for id in ids:
+            addresses += cls._get_address_cache(id).values()
+            addresses += [field._field.get_address(id) for field in fields]
+        return addresses
+
+    @classmethod
+    @Inject
+    def load_batch(cls, ids, read_through=False, memory_file=INJECTED):
+        # type: (List[Optional[int]], bool, MemoryFile) -> List[MemoryModelDefinition]
+        """
+        Loads the given instances at once. All their fields are read in a single (bulk) read, where
+        every memory page is only read once, instead of every field reading its own data when used.
+        """
+        id_field = cls._get_id_field()
+        id_limits = None if id_field is None else id_field.get_limits(read_through)
+        instances = [cls(id, read_through=read_through, _id_limits=id_limits) for id in ids]
+        containers = []  # type: List[MemoryFieldContainer]
+        for instance in instances:
+            containers += instance._get_field_containers()
+        data = memory_file.read(list(set(container._memory_address for container in containers)), read_through)
+        for container in containers:
+            container._data = data[container._memory_address]
+        return instances
+
+    def _get_field_containers(self):  # type: () -> List[MemoryFieldContainer]
+        """ Returns the field containers of all (relational and composite) fields """
+        containers = [getattr(self, '_{0}'.format(field_name)) for field_name in self._fields]
+        for field_name in self._relations:
+            field_container = getattr(self, '_{0}'.format(field_name))._field_container
+            if field_container is not None:
+                containers.append(field_container)
+        for field_name in self._compositions:
+            containers.append(getattr(self, '_{0}'.format(field_name))._field_container)
+        return containers
+
+    @classmethod
+    @Inject
+    def prefetch(cls, ids, memory_file=INJECTED):  # type: (List[Optional[int]], MemoryFile) -> None
+        """
+        Loads all memory pages used by the given instances in a single bulk read, so
+        loading these instances afterwards doesn't require any additional reads.
+        """
+        memory_file.prefetch(cls.get_addresses(ids))
+
 
 class MemoryCommitter(object):
     """ Holds a static method to commit memory """
@@ -672,20 +731,23 @@ class IdField(object):
         elif not callable(limits):
             raise ValueError('Limits should be generated at runtime if a field is given')
 
-    @Inject
-    def validate(self, class_name, id, read_through):  # type: (str, Optional[int], bool) -> None
+    def get_limits(self, read_through):  # type: (bool) -> Tuple[int, int]
         if self._field is None:
             if not isinstance(self._limits, tuple):
                 raise RuntimeError('Expected a fixed limit')
-            limits = self._limits
-        else:
-            if not callable(self._limits):
-                raise RuntimeError('Expected a limit generator')
-            container = MemoryFieldContainer(name='id',
-                                             memory_field=self._field,
-                                             memory_address=self._field.get_address(None),
-                                             read_through=read_through)
-            limits = self._limits(container.decode())
+            return self._limits
+        if not callable(self._limits):
+            raise RuntimeError('Expected a limit generator')
+        container = MemoryFieldContainer(name='id',
+                                         memory_field=self._field,
+                                         memory_address=self._field.get_address(None),
+                                         read_through=read_through)
+        return self._limits(container.decode())
+
+    def validate(self, class_name, id, read_through, limits=None):
+        # type: (str, Optional[int], bool, Optional[Tuple[int, int]]) -> None
+        if limits is None:
+            limits = self.get_limits(read_through)
         if id is None or not (limits[0] <= id <= limits[1]):
             if limits[0] > limits[1]:
                 limit_info = 'No records available.'
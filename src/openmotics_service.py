@@ -29,13 +29,14 @@ from sqlalchemy import select
 
 import gateway
 from bus.om_bus_client import MessageClient
+from bus.om_bus_events import OMBusEvents
 from bus.om_bus_service import MessageService
 from gateway.initialize import initialize
 from gateway.migrations.defaults import DefaultsMigrator
 from gateway.migrations.thermostats import ThermostatsMigrator
 from gateway.migrations.names import NamesMigrator
 from gateway.migrations.in_use import InUseMigrator
-from gateway.models import Database, Feature
+from gateway.models import Config, Database, Feature
 from gateway.pubsub import PubSub
 from ioc import INJECTED, Inject
 from logs import Logs
@@ -79,6 +80,11 @@ logger = logging.getLogger('openmotics')
 
 
 class OpenmoticsService(object):
+    @staticmethod
+    def _handle_config_event(event, payload):
+        if event == OMBusEvents.CONFIG_CHANGE:
+            Config.invalidate(payload.get('keys'))
+
     @staticmethod
     @Inject
     def fix_dependencies(
@@ -95,6 +101,7 @@ class OpenmoticsService(object):
                 frontpanel_controller=INJECTED,  # type: FrontpanelController
                 authentication_controller=INJECTED,  # type: AuthenticationController
                 user_controller=INJECTED,  # type: UserController
+                state_coalesce_window=INJECTED,  # type: float
             ):
 
         # TODO: Fix circular dependencies
@@ -103,12 +110,18 @@ class OpenmoticsService(object):
         pubsub.subscribe_gateway_events(PubSub.GatewayTopics.CONFIG, event_sender.enqueue_event)
 
         # Forward state change events to consumers.
+        pubsub.set_state_coalescing(window=state_coalesce_window)
         pubsub.subscribe_gateway_events(PubSub.GatewayTopics.STATE, event_sender.enqueue_event)
         pubsub.subscribe_gateway_events(PubSub.GatewayTopics.STATE, metrics_collector.process_gateway_event)
         pubsub.subscribe_gateway_events(PubSub.GatewayTopics.STATE, plugin_controller.process_gateway_event)
         pubsub.subscribe_gateway_events(PubSub.GatewayTopics.STATE, web_interface.send_event_websocket)
 
         message_client.add_event_handler(metrics_controller.event_receiver)
+
+        # Keep the config cache in sync with the other services.
+        Config.add_change_handler(lambda keys: message_client.send_event(OMBusEvents.CONFIG_CHANGE, {'keys': keys}))
+        message_client.add_event_handler(OpenmoticsService._handle_config_event)
+
         web_interface.set_plugin_controller(plugin_controller)
         web_interface.set_metrics_collector(metrics_collector)
         web_interface.set_metrics_controller(metrics_controller)
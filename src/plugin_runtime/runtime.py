@@ -22,7 +22,7 @@ from plugin_runtime.interfaces import has_interface
 from plugin_runtime.utils import get_plugin_class, check_plugin, get_special_methods
 from plugin_runtime.web import WebInterfaceDispatcher
 from six.moves.configparser import ConfigParser, NoSectionError, NoOptionError
-from toolbox import PluginIPCReader, PluginIPCWriter, Toolbox
+from toolbox import PluginIPCReader, PluginIPCWriter, Queue, Toolbox
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +42,8 @@ class PluginRuntime(object):
                                     'receive_events': [1],
                                     'background_task': [1],
                                     'on_remove': [1]}
+    CONCURRENT_ACTIONS = ['request', 'collect_metrics', 'get_metric_definitions']
+    WORKERS = 4
 
     def __init__(self, path):
         # type: (str) -> None
@@ -71,6 +73,7 @@ class PluginRuntime(object):
         self._writer = PluginIPCWriter(os.fdopen(sys.stdout.fileno(), 'wb', 0))
         self._reader = PluginIPCReader(os.fdopen(sys.stdin.fileno(), 'rb', 0),
                                        self._writer.log_exception)
+        self._worker_queue = Queue()  # type: Queue
 
         self._webinterface = None  # type: Optional[WebInterfaceDispatcher]
 
@@ -176,70 +179,87 @@ class PluginRuntime(object):
     def process_stdin(self):
         # type: () -> None
         self._reader.start()
+        for i in range(PluginRuntime.WORKERS):
+            worker = BaseThread(name='pluginworker{0}'.format(i), target=self._process_worker_commands)
+            worker.daemon = True
+            worker.start()
         while not self._stopped:
             command = self._reader.get(block=True)
             if command is None:
                 continue
+            if command['action'] in PluginRuntime.CONCURRENT_ACTIONS:
+                # Don't let e.g. a slow plugin request block the (ordered) processing of events
+                self._worker_queue.put(command)
+            else:
+                self._writer.write(self._process_command(command))
 
-            action = command['action']
-            action_version = command['action_version']
-            response = {'cid': command['cid'], 'action': action}
-            try:
-                ret = None
-                if action == 'start':
-                    ret = self._handle_start()
-                elif action == 'stop':
-                    ret = self._handle_stop()
-                elif action == 'input_status':
-                    # v1 = state, v2 = event
-                    if action_version == 1:
-                        ret = self._handle_input_status(command['status'], data_type='status')
-                    else:
-                        ret = self._handle_input_status(command['event'], data_type='event')
-                elif action == 'output_status':
-                    # v1 = state, v2 = event
-                    if action_version == 1:
-                        ret = self._handle_output_status(command['status'], data_type='status')
-                    else:
-                        ret = self._handle_output_status(command['event'], data_type='event')
-                elif action == 'ventilation_status':
-                    ret = self._handle_ventilation_status(command['event'])
-                elif action == 'thermostat_status':
-                    ret = self._handle_thermostat_status(command['event'])
-                elif action == 'thermostat_group_status':
-                    ret = self._handle_thermostat_group_status(command['event'])
-                elif action == 'shutter_status':
-                    # v1 = state as list, v2 = state as dict, v3 = event
-                    if action_version == 1:
-                        ret = self._handle_shutter_status(command['status'], data_type='status')
-                    elif action_version == 2:
-                        ret = self._handle_shutter_status(command['status'], data_type='status_dict')
-                    else:
-                        ret = self._handle_shutter_status(command['event'], data_type='event')
-                elif action == 'sensor_status':
-                    ret = self._handle_sensor_status(command['event'])
-                elif action == 'receive_events':
-                    ret = self._handle_receive_events(command['code'])
-                elif action == 'get_metric_definitions':
-                    ret = self._handle_get_metric_definitions()
-                elif action == 'collect_metrics':
-                    ret = self._handle_collect_metrics(command['name'])
-                elif action == 'distribute_metrics':
-                    ret = self._handle_distribute_metrics(command['name'], command['metrics'])
-                elif action == 'request':
-                    ret = self._handle_request(command['method'], command['args'], command['kwargs'])
-                elif action == 'remove_callback':
-                    ret = self._handle_remove_callback()
-                elif action == 'ping':
-                    pass  # noop
+    def _process_worker_commands(self):
+        # type: () -> None
+        while not self._stopped:
+            command = self._worker_queue.get(block=True)
+            self._writer.write(self._process_command(command))
+
+    def _process_command(self, command):
+        # type: (Dict[str,Any]) -> Dict[str,Any]
+        action = command['action']
+        action_version = command['action_version']
+        response = {'cid': command['cid'], 'action': action}
+        try:
+            ret = None
+            if action == 'start':
+                ret = self._handle_start()
+            elif action == 'stop':
+                ret = self._handle_stop()
+            elif action == 'input_status':
+                # v1 = state, v2 = event
+                if action_version == 1:
+                    ret = self._handle_input_status(command['status'], data_type='status')
                 else:
-                    raise RuntimeError('Unknown action: {0}'.format(action))
+                    ret = self._handle_input_status(command['event'], data_type='event')
+            elif action == 'output_status':
+                # v1 = state, v2 = event
+                if action_version == 1:
+                    ret = self._handle_output_status(command['status'], data_type='status')
+                else:
+                    ret = self._handle_output_status(command['event'], data_type='event')
+            elif action == 'ventilation_status':
+                ret = self._handle_ventilation_status(command['event'])
+            elif action == 'thermostat_status':
+                ret = self._handle_thermostat_status(command['event'])
+            elif action == 'thermostat_group_status':
+                ret = self._handle_thermostat_group_status(command['event'])
+            elif action == 'shutter_status':
+                # v1 = state as list, v2 = state as dict, v3 = event
+                if action_version == 1:
+                    ret = self._handle_shutter_status(command['status'], data_type='status')
+                elif action_version == 2:
+                    ret = self._handle_shutter_status(command['status'], data_type='status_dict')
+                else:
+                    ret = self._handle_shutter_status(command['event'], data_type='event')
+            elif action == 'sensor_status':
+                ret = self._handle_sensor_status(command['event'])
+            elif action == 'receive_events':
+                ret = self._handle_receive_events(command['code'])
+            elif action == 'get_metric_definitions':
+                ret = self._handle_get_metric_definitions()
+            elif action == 'collect_metrics':
+                ret = self._handle_collect_metrics(command['name'])
+            elif action == 'distribute_metrics':
+                ret = self._handle_distribute_metrics(command['name'], command['metrics'])
+            elif action == 'request':
+                ret = self._handle_request(command['method'], command['args'], command['kwargs'])
+            elif action == 'remove_callback':
+                ret = self._handle_remove_callback()
+            elif action == 'ping':
+                pass  # noop
+            else:
+                raise RuntimeError('Unknown action: {0}'.format(action))
 
-                if ret is not None:
-                    response.update(ret)
-            except Exception as exception:
-                response['_exception'] = str(exception)
-            self._writer.write(response)
+            if ret is not None:
+                response.update(ret)
+        except Exception as exception:
+            response['_exception'] = str(exception)
+        return response
 
     def _handle_start(self):
         # type: () -> Dict[str,Any]
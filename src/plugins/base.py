@@ -30,9 +30,11 @@ from gateway.events import GatewayEvent
 from gateway.models import Config, Database, Plugin
 from ioc import INJECTED, Inject, Injectable, Singleton
 from plugins.runner import PluginRunner, RunnerWatchdog
+from toolbox import PackedValue
 
 if False:  # MYPY
-    from typing import Dict, List, Optional
+    from typing import Any, Dict, List, Optional, Tuple
+    from gateway.metrics_controller import MetricsController
     from gateway.output_controller import OutputController
     from gateway.shutter_controller import ShutterController
     from gateway.webservice import WebInterface
@@ -69,8 +71,9 @@ class PluginController(object):
         self._dependencies_timer = None  # type: Optional[Timer]
         self._dependencies_lock = Lock()
 
-        self._metrics_controller = None
+        self._metrics_controller = None  # type: Optional[MetricsController]
         self._metrics_collector = None
+        self._metric_routes = {}  # type: Dict[Tuple[str, str], List[Tuple[str, str]]]
         self._web_service = None
 
     def start(self):
@@ -118,6 +121,7 @@ class PluginController(object):
             return
         if state == PluginRunner.State.RUNNING:
             PluginController._update_orm(runner.name, runner.version)
+        self._metric_routes = {}
         with self._dependencies_lock:
             if self._dependencies_timer is not None:
                 self._dependencies_timer.cancel()
@@ -214,6 +218,7 @@ class PluginController(object):
             self._metrics_collector.set_plugin_intervals(self._get_metric_receivers())
         if self._metrics_controller is not None:
             self._metrics_controller.set_plugin_definitions(self._get_metric_definitions())
+        self._metric_routes = {}
 
     @staticmethod
     def _update_orm(name, version):
@@ -398,6 +403,8 @@ class PluginController(object):
                 yield runner
 
     def process_gateway_event(self, event):
+        # The event is serialized (and packed) only once, and shared by all runners
+        event_json = PackedValue(event.serialize())
         if event.type == GatewayEvent.Types.INPUT_CHANGE:
             # Should be called when the input status changes, notifies all plugins.
             input_id = event.data['id']
@@ -405,13 +412,13 @@ class PluginController(object):
             for runner in self._iter_running_runners():
                 if input_status:  # Backwards compatibility: only send rising edges of the input for v1
                     runner.process_input_status(data=(input_id, None), action_version=1)
-                runner.process_input_status(data=event, action_version=2)
+                runner.process_input_status(data=event_json, action_version=2)
         if event.type == GatewayEvent.Types.OUTPUT_CHANGE:
             # TODO: deprecate old versions that use state and move to events
-            states = [(state.id, state.dimmer) for state in self._output_controller.get_output_statuses() if state.status]
+            states = PackedValue([(state.id, state.dimmer) for state in self._output_controller.get_output_statuses() if state.status])
             for runner in self._iter_running_runners():
                 runner.process_output_status(data=states, action_version=1)  # send states as action version 1
-                runner.process_output_status(data=event, action_version=2)   # send event as action version 2
+                runner.process_output_status(data=event_json, action_version=2)   # send event as action version 2
         if event.type == GatewayEvent.Types.SHUTTER_CHANGE:
             # TODO: deprecate old versions that use state and move to events
             states = self._shuttercontroller.get_states()
@@ -420,19 +427,19 @@ class PluginController(object):
             for runner in self._iter_running_runners():
                 runner.process_shutter_status(data=status, action_version=1)  # send states as action version 1
                 runner.process_shutter_status(data=(status, details), action_version=2)  # send event as action version 2
-                runner.process_shutter_status(data=event, action_version=3)  # send event as action version 3
+                runner.process_shutter_status(data=event_json, action_version=3)  # send event as action version 3
         if event.type == GatewayEvent.Types.VENTILATION_CHANGE:
             for runner in self._iter_running_runners():
-                runner.process_ventilation_status(data=event)
+                runner.process_ventilation_status(data=event_json)
         if event.type == GatewayEvent.Types.THERMOSTAT_CHANGE:
             for runner in self._iter_running_runners():
-                runner.process_thermostat_status(data=event)
+                runner.process_thermostat_status(data=event_json)
         if event.type == GatewayEvent.Types.THERMOSTAT_GROUP_CHANGE:
             for runner in self._iter_running_runners():
-                runner.process_thermostat_group_status(data=event)
+                runner.process_thermostat_group_status(data=event_json)
         if event.type == GatewayEvent.Types.SENSOR_CHANGE:
             for runner in self._iter_running_runners():
-                runner.process_sensor_status(data=event)
+                runner.process_sensor_status(data=event_json)
 
     def process_event(self, code):
         """ Should be called when an event is triggered, notifies all plugins. """
@@ -457,30 +464,48 @@ class PluginController(object):
     def distribute_metrics(self, metrics):
         """ Enqueues all metrics in a separate queue per plugin """
         rates = {'total': 0}
-        rate_keys = []
-        # Preprocess rate keys
+        runners = dict((runner.name, runner) for runner in self._iter_running_runners())
+        receiver_metrics = {}  # type: Dict[Tuple[str, str], List[Dict[str, Any]]]
         for metric in metrics:
             rate_key = '{0}.{1}'.format(metric['source'].lower(), metric['type'].lower())
             if rate_key not in rates:
                 rates[rate_key] = 0
-            rate_keys.append(rate_key)
+            for route in self._get_metric_route(metric['source'], metric['type']):
+                if route[0] in runners:
+                    receiver_metrics.setdefault(route, []).append(metric)
+                    rates[rate_key] += 1
+                    rates['total'] += 1
         # Distribute
-        for runner in self._iter_running_runners():
+        for runner in runners.values():
             for receiver in runner.get_metric_receivers():
-                receiver_metrics = []
                 try:
-                    sources = self._metrics_controller.get_filter('source', receiver['source'])
-                    metric_types = self._metrics_controller.get_filter('metric_type', receiver['metric_type'])
-                    for index, metric in enumerate(metrics):
-                        if metric['source'] in sources and metric['type'] in metric_types:
-                            receiver_metrics.append(metric)
-                            rates[rate_keys[index]] += 1
-                            rates['total'] += 1
-                    runner.distribute_metrics(receiver['name'], receiver_metrics)
+                    runner.distribute_metrics(receiver['name'], receiver_metrics.get((runner.name, receiver['name']), []))
                 except Exception as ex:
                     self.log(runner.name, 'Exception while distributing metrics', ex, traceback.format_exc())
         return rates
 
+    def _get_metric_route(self, source, metric_type):
+        # type: (str, str) -> List[Tuple[str, str]]
+        """ Returns the (plugin, receiver) pairs that are interested in metrics of the given source and type """
+        if self._metrics_controller is None:
+            return []
+        key = (source, metric_type)
+        route = self._metric_routes.get(key)
+        if route is None:
+            route = []
+            for runner in list(self._runners.values()):
+                for receiver in runner.get_metric_receivers():
+                    try:
+                        sources = self._metrics_controller.get_filter('source', receiver['source'])
+                        metric_types = self._metrics_controller.get_filter('metric_type', receiver['metric_type'])
+                    except Exception as ex:
+                        self.log(runner.name, 'Exception while distributing metrics', ex, traceback.format_exc())
+                        continue
+                    if source in sources and metric_type in metric_types:
+                        route.append((runner.name, receiver['name']))
+            self._metric_routes[key] = route
+        return route
+
     def _get_cherrypy_mounts(self):
         mounts = []
         cors_enabled = Config.get_entry('cors_enabled', False)
@@ -5,19 +5,21 @@ import subprocess
 import sys
 import time
 import traceback
-from threading import Lock, Thread
+from collections import Counter
+from threading import Event, Lock, Thread
 
 import cherrypy
 import six
 import ujson as json
 from six.moves.queue import Empty, Full, Queue
 from gateway.daemon_thread import BaseThread
-from toolbox import PluginIPCReader, PluginIPCWriter
+from toolbox import PackedValue, PluginIPCReader, PluginIPCWriter
 from plugin_runtime.base import PluginWebRequest, PluginWebResponse
 from gateway.webservice import WebInterface, log_access
 
 if False:  # MYPY
-    from typing import Any, Dict, Callable, List, Optional, AnyStr
+    from typing import Any, Dict, Callable, List, Optional, AnyStr, Union
+    from gateway.events import BaseEvent
 
 logger_ = logging.getLogger(__name__)
 
@@ -100,11 +102,33 @@ class Service(object):
             return contents.encode()
 
 
+class CommandFuture(object):
+    """ The pending response of a command sent to the plugin, keyed by its cid """
+
+    def __init__(self, cid):  # type: (int) -> None
+        self.cid = cid
+        self.sent = time.time()
+        self.response = None  # type: Optional[Dict[str,Any]]
+        self._event = Event()
+
+    def set_response(self, response):  # type: (Dict[str,Any]) -> None
+        self.response = response
+        self._event.set()
+
+    def wait(self, timeout):  # type: (float) -> Dict[str,Any]
+        if not self._event.wait(timeout) or self.response is None:
+            raise Empty()
+        return self.response
+
+
 class PluginRunner(object):
     class State(object):
         RUNNING = 'RUNNING'
         STOPPED = 'STOPPED'
 
+    ASYNC_BATCH_SIZE = 50
+    LATENCY_BUCKETS = [(0.001, '<1ms'), (0.01, '<10ms'), (0.1, '<100ms'), (1.0, '<1s')]
+
     def __init__(self, name, runtime_path, plugin_path, logger, command_timeout=5.0, state_callback=None):
         self.runtime_path = runtime_path
         self.plugin_path = plugin_path
@@ -116,7 +140,11 @@ class PluginRunner(object):
         self._running = False
         self._process_running = False
         self._command_lock = Lock()
-        self._response_queue = Queue()  # type: Queue[Dict[str,Any]]
+        self._pending_commands = {}  # type: Dict[int, CommandFuture]
+        self._latency_lock = Lock()
+        self._latency_histogram = Counter()  # type: Counter
+        self._latency_total = 0.0
+        self._latency_count = 0
         self._writer = None  # type: Optional[PluginIPCWriter]
         self._reader = None  # type: Optional[PluginIPCReader]
         self._state_callback = state_callback  # type: Optional[Callable[[str, str], None]]
@@ -241,12 +269,20 @@ class PluginRunner(object):
                 self._state_callback(self.name, PluginRunner.State.STOPPED)
             self.logger('[Runner] Stopped')
 
+    @staticmethod
+    def _serialize_event(data):
+        # type: (Union[PackedValue, BaseEvent]) -> Union[PackedValue, Dict[str,Any]]
+        """ Events are normally serialized (and packed) once by the PluginController and shared by all runners """
+        if isinstance(data, PackedValue):
+            return data
+        return data.serialize()
+
     def process_input_status(self, data, action_version=1):
         if action_version in [1, 2]:
             if action_version == 1:
                 payload = {'status': data}
             else:
-                event_json = data.serialize()
+                event_json = PluginRunner._serialize_event(data)
                 payload = {'event': event_json}
             self._do_async(action='input_status', payload=payload, should_filter=True, action_version=action_version)
         else:
@@ -257,7 +293,7 @@ class PluginRunner(object):
             if action_version == 1:
                 payload = {'status': data}
             else:
-                event_json = data.serialize()
+                event_json = PluginRunner._serialize_event(data)
                 payload = {'event': event_json}
             self._do_async(action='output_status', payload=payload, should_filter=True, action_version=action_version)
         else:
@@ -271,7 +307,7 @@ class PluginRunner(object):
                 status, detail = data
                 payload = {'status': {'status': status, 'detail': detail}}
             else:
-                event_json = data.serialize()
+                event_json = PluginRunner._serialize_event(data)
                 payload = {'event': event_json}
             self._do_async(action='shutter_status', payload=payload, should_filter=True, action_version=action_version)
         else:
@@ -279,7 +315,7 @@ class PluginRunner(object):
 
     def process_ventilation_status(self, data, action_version=1):
         if action_version in [1]:
-            event_json = data.serialize()
+            event_json = PluginRunner._serialize_event(data)
             payload = {'event': event_json}
             self._do_async(action='ventilation_status', payload=payload, should_filter=True, action_version=action_version)
         else:
@@ -287,7 +323,7 @@ class PluginRunner(object):
 
     def process_thermostat_status(self, data, action_version=1):
         if action_version in [1]:
-            event_json = data.serialize()
+            event_json = PluginRunner._serialize_event(data)
             payload = {'event': event_json}
             self._do_async(action='thermostat_status', payload=payload, should_filter=True, action_version=action_version)
         else:
@@ -295,7 +331,7 @@ class PluginRunner(object):
 
     def process_thermostat_group_status(self, data, action_version=1):
         if action_version in [1]:
-            event_json = data.serialize()
+            event_json = PluginRunner._serialize_event(data)
             payload = {'event': event_json}
             self._do_async(action='thermostat_group_status', payload=payload, should_filter=True, action_version=action_version)
         else:
@@ -303,7 +339,7 @@ class PluginRunner(object):
 
     def process_sensor_status(self, data, action_version=1):
         if action_version in [1]:
-            event_json = data.serialize()
+            event_json = PluginRunner._serialize_event(data)
             payload = {'event': event_json}
             self._do_async(action='sensor_status', payload=payload, should_filter=True, action_version=action_version)
         else:
@@ -370,10 +406,37 @@ class PluginRunner(object):
 
         if response['cid'] == 0:
             self._handle_async_response(response)
-        elif response['cid'] == self._cid:
-            self._response_queue.put(response)
         else:
-            self.logger('[Runner] Received message with unknown cid: {0}'.format(response))
+            future = self._pending_commands.pop(response['cid'], None)
+            if future is None:
+                self.logger('[Runner] Received message with unknown cid: {0}'.format(response))
+                return
+            self._register_latency(time.time() - future.sent)
+            future.set_response(response)
+
+    def _register_latency(self, latency):  # type: (float) -> None
+        bucket = '>=1s'
+        for limit, label in PluginRunner.LATENCY_BUCKETS:
+            if latency < limit:
+                bucket = label
+                break
+        with self._latency_lock:
+            self._latency_total += latency
+            self._latency_count += 1
+            self._latency_histogram.update({bucket: 1})
+
+    def get_latency_statistics(self):
+        # type: () -> Dict[str,Any]
+        """
+        Returns the command response latency histogram (cumulative) and the average latency (in seconds)
+        since the last call
+        """
+        with self._latency_lock:
+            average = self._latency_total / self._latency_count if self._latency_count else 0.0
+            self._latency_total = 0.0
+            self._latency_count = 0
+            return {'histogram': dict(self._latency_histogram),
+                    'average': average}
 
     def _handle_async_response(self, response):
         # type: (Dict[str,Any]) -> None
@@ -405,7 +468,16 @@ class PluginRunner(object):
                 command = self._async_command_queue.get(block=True, timeout=10)
                 if command is None:
                     continue  # Used to exit this thread
-                self._do_command(command['action'], payload=command['payload'], action_version=command['action_version'])
+                # Send all commands that are already queued as a single batch
+                commands = [command]
+                while len(commands) < PluginRunner.ASYNC_BATCH_SIZE:
+                    try:
+                        command = self._async_command_queue.get(block=False)
+                    except Empty:
+                        break
+                    if command is not None:
+                        commands.append(command)
+                self._do_batch(commands)
             except Empty:
                 self._do_async('ping', {})
             except Exception as exception:
@@ -422,31 +494,79 @@ class PluginRunner(object):
         if not self._process_running:
             raise Exception('Plugin was stopped')
 
+        # The lock only covers sending the command, the response is awaited concurrently with other commands
         with self._command_lock:
             try:
                 command = self._create_command(action, payload, action_version)
+                future = self._register_command(command)
                 assert self._writer, 'Plugin stdin not defined'
                 self._writer.write(command)
             except Exception:
                 self._commands_failed += 1
                 raise
 
+        try:
+            response = future.wait(timeout)
+            exception = response.get('_exception')
+            if exception is not None:
+                raise RuntimeError(exception)
+            return response
+        except Empty:
+            metadata = ''
+            if action == 'request':
+                metadata = ' {0}'.format(payload['method'])
+            if self._running:
+                self.logger('[Runner] No response within {0}s ({1}{2})'.format(timeout, action, metadata))
+            self._commands_failed += 1
+            raise Exception('Plugin did not respond')
+        finally:
+            self._pending_commands.pop(command['cid'], None)
+
+    def _do_batch(self, commands):
+        # type: (List[Dict[str,Any]]) -> None
+        """
+        Sends multiple async commands in a single frame and waits for all responses. Failures are logged
+        since there is no caller to raise them to.
+        """
+        self._commands_executed += len(commands)
+        if not self._process_running:
+            raise Exception('Plugin was stopped')
+
+        with self._command_lock:
             try:
-                response = self._response_queue.get(block=True, timeout=timeout)
-                while response['cid'] != self._cid:
-                    response = self._response_queue.get(block=False)
+                batch = [self._create_command(command['action'], command['payload'], command['action_version'])
+                         for command in commands]
+                futures = [self._register_command(command) for command in batch]
+                assert self._writer, 'Plugin stdin not defined'
+                self._writer.write_batch(batch)
+            except Exception:
+                self._commands_failed += len(commands)
+                raise
+
+        pending = len(futures)
+        try:
+            for future in futures:
+                # The runtime handles the commands one by one, so the timeout applies to each response
+                response = future.wait(self.command_timeout)
+                pending -= 1
                 exception = response.get('_exception')
                 if exception is not None:
-                    raise RuntimeError(exception)
-                return response
-            except Empty:
-                metadata = ''
-                if action == 'request':
-                    metadata = ' {0}'.format(payload['method'])
-                if self._running:
-                    self.logger('[Runner] No response within {0}s ({1}{2})'.format(timeout, action, metadata))
-                self._commands_failed += 1
-                raise Exception('Plugin did not respond')
+                    self._commands_failed += 1
+                    self.logger('[Runner] Failed to perform async command: {0}'.format(exception))
+        except Empty:
+            if self._running:
+                self.logger('[Runner] No response within {0}s ({1} async commands)'.format(self.command_timeout, pending))
+            self._commands_failed += pending
+            raise Exception('Plugin did not respond')
+        finally:
+            for future in futures:
+                self._pending_commands.pop(future.cid, None)
+
+    def _register_command(self, command):
+        # type: (Dict[str,Any]) -> CommandFuture
+        future = CommandFuture(command['cid'])
+        self._pending_commands[future.cid] = future
+        return future
 
     def _create_command(self, action, payload=None, action_version=1):
         # type: (str, Dict[str,Any], int) -> Dict[str,Any]
@@ -20,10 +20,11 @@ from __future__ import absolute_import
 
 import inspect
 import logging
+import os
 import time
 import traceback
 from collections import deque
-from threading import Thread
+from threading import Condition, Lock, Thread
 
 import msgpack
 import six
@@ -45,49 +46,62 @@ class Empty(Exception):
 
 
 class Queue(object):
+    """
+    Unbounded FIFO queue. A blocking get waits on a condition variable until a value is put.
+    """
+
     def __init__(self, size=None):
         self._queue = deque()  # type: deque
         self._size = size  # Not used
+        self._condition = Condition()
 
     def put(self, value, block=False):
         _ = block
-        self._queue.appendleft(value)
+        with self._condition:
+            self._queue.appendleft(value)
+            self._condition.notify()
 
     def get(self, block=True, timeout=None):
-        if not block:
+        with self._condition:
+            if block:
+                end = None if timeout is None else time.time() + timeout
+                while not self._queue:
+                    if end is None:
+                        self._condition.wait()
+                    else:
+                        remaining = end - time.time()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
             try:
                 return self._queue.pop()
             except IndexError:
                 raise Empty()
-        start = time.time()
-        while timeout is None or time.time() - start < timeout:
-            try:
-                return self._queue.pop()
-            except IndexError:
-                sleep = 0.025
-                if timeout is None or timeout > 1:
-                    sleep = 0.1
-                time.sleep(sleep)
-        raise Empty()
 
     def qsize(self):
         return len(self._queue)
 
     def clear(self):
-        return self._queue.clear()
+        with self._condition:
+            return self._queue.clear()
 
 
 class PluginIPCReader(object):
     """
     This class handles IPC communications.
 
-    It uses a stream of msgpack encoded dict values.
+    It uses a stream of msgpack encoded values, each value is either a single dict
+    or a batch (list) of dicts. The stream is read in large chunks (whatever is
+    available) which are fed to the unpacker.
     """
 
+    READ_SIZE = 65536
+
     def __init__(self, stream, logger, command_receiver=None, name=None):
         # type: (IO[bytes], Callable[[str,Exception],None], Callable[[Dict[str,Any]],None],Optional[str]) -> None
         self._command_queue = Queue()
-        self._unpacker = msgpack.Unpacker(stream, read_size=1, raw=False)  # type: msgpack.Unpacker[Dict[str,Any]]
+        self._stream = stream
+        self._unpacker = msgpack.Unpacker(raw=False)  # type: msgpack.Unpacker[Any]
         self._read_thread = None  # type: Optional[Thread]
         self._logger = logger
         self._running = False
@@ -107,32 +121,75 @@ class PluginIPCReader(object):
         if self._read_thread is not None:
             self._read_thread.join()
 
+    def _read_chunk(self):
+        # type: () -> bytes
+        try:
+            fileno = self._stream.fileno()
+        except Exception:
+            return self._stream.read(PluginIPCReader.READ_SIZE)
+        # Returns as soon as some data is available, instead of waiting for the full read size
+        return os.read(fileno, PluginIPCReader.READ_SIZE)
+
     def _read(self):
         # type: () -> None
         while self._running:
             try:
-                command = next(self._unpacker)
-                if not isinstance(command, dict):
-                    raise ValueError('invalid value %s' % command)
-                if self._command_receiver is not None:
-                    self._command_receiver(command)
-                else:
-                    self._command_queue.put(command)
-            except StopIteration as ex:
+                data = self._read_chunk()
+                if not data:
+                    raise EOFError('End of stream')
+                self._unpacker.feed(data)
+                for value in self._unpacker:
+                    commands = value if isinstance(value, list) else [value]
+                    for command in commands:
+                        self._handle_command(command)
+            except EOFError as ex:
                 self._logger('PluginIPCReader %s stopped' % self._name, ex)
                 self._running = False
             except Exception as ex:
                 self._logger('Unexpected read exception', ex)
 
+    def _handle_command(self, command):
+        # type: (Any) -> None
+        # A bad command should not drop the other (complete) values that were already read
+        try:
+            if not isinstance(command, dict):
+                raise ValueError('invalid value %s' % command)
+            if self._command_receiver is not None:
+                self._command_receiver(command)
+            else:
+                self._command_queue.put(command)
+        except Exception as ex:
+            self._logger('Unexpected read exception', ex)
+
     def get(self, block=True, timeout=None):
         return self._command_queue.get(block, timeout)
 
 
+class PackedValue(object):
+    """
+    A value that is msgpack encoded only once (when first needed), so it can be shared
+    by the commands of multiple plugins. It can be used as a top level value of a command.
+    """
+
+    def __init__(self, value):
+        # type: (Any) -> None
+        self.value = value
+        self._packed = None  # type: Optional[bytes]
+
+    @property
+    def packed(self):
+        # type: () -> bytes
+        if self._packed is None:
+            self._packed = msgpack.Packer().pack(self.value)
+        return self._packed
+
+
 class PluginIPCWriter(object):
     def __init__(self, stream):
         # type: (IO[bytes]) -> None
         self._packer = msgpack.Packer()  # type: msgpack.Packer[Dict[str,Any]]
         self._stream = stream
+        self._lock = Lock()  # Responses can be written from multiple threads
 
     def log(self, msg):
         # type: (str) -> None
@@ -153,11 +210,39 @@ class PluginIPCWriter(object):
     def write(self, response):
         # type: (Dict[str,Any]) -> None
         try:
-            self._stream.write(self._packer.pack(response))
-            self._stream.flush()
+            with self._lock:
+                self._stream.write(self._pack(response))
+                self._stream.flush()
         except IOError:
             pass  # Ignore exceptions if the stream is not available (nothing that can be done anyway)
 
+    def write_batch(self, responses):
+        # type: (List[Dict[str,Any]]) -> None
+        """ Writes multiple values as a single frame, with a single flush. """
+        if len(responses) == 1:
+            self.write(responses[0])
+            return
+        try:
+            with self._lock:
+                data = self._packer.pack_array_header(len(responses))
+                for response in responses:
+                    data += self._pack(response)
+                self._stream.write(data)
+                self._stream.flush()
+        except IOError:
+            pass
+
+    def _pack(self, response):
+        # type: (Dict[str,Any]) -> bytes
+        if not any(isinstance(value, PackedValue) for value in response.values()):
+            return self._packer.pack(response)
+        # Build the map manually, so the already packed values can be inserted as-is
+        data = self._packer.pack_map_header(len(response))
+        for key, value in six.iteritems(response):
+            data += self._packer.pack(key)
+            data += value.packed if isinstance(value, PackedValue) else self._packer.pack(value)
+        return data
+
 
 class Toolbox(object):
     @staticmethod
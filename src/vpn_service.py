@@ -545,13 +545,21 @@ class HeartbeatService(object):
                 'last_cycle': self._last_cycle}
 
     def _handle_event(self, event, payload):
-        _ = self, payload
+        _ = self
         if event == OMBusEvents.TIME_CHANGED:
             time.tzset()  # Refresh timezone
             logger.info('Timezone changed to {0}'.format(time.tzname[0]))
+        if event == OMBusEvents.CONFIG_CHANGE:
+            Config.invalidate(payload.get('keys'))
+
+    def _send_config_change(self, keys):
+        # type: (List[str]) -> None
+        if self._message_client is not None:
+            self._message_client.send_event(OMBusEvents.CONFIG_CHANGE, {'keys': keys})
 
     def start(self):
         # type: () -> None
+        Config.add_change_handler(self._send_config_change)
         self._executor.start()
         self._debug_collector.start()
         for collector in self._collectors.values():
@@ -17,12 +17,16 @@ class Packer(Generic[T]):
                  unicode_errors='strict') -> None:
         ...
 
-    def pack(self, obj: T) -> bytes: ...
+    def pack(self, obj: Any) -> bytes: ...
+
+    def pack_array_header(self, n: int) -> bytes: ...
+
+    def pack_map_header(self, n: int) -> bytes: ...
 
 
 class Unpacker(Iterator[T]):
     def __init__(self,
-                 file_like: IO[bytes],
+                 file_like: Optional[IO[bytes]] = None,
                  read_size=0,
                  use_list=True,
                  raw=False,
@@ -43,6 +47,8 @@ class Unpacker(Iterator[T]):
 
     def __next__(self) -> T: ...
 
+    def feed(self, next_bytes: bytes) -> None: ...
+
     def unpack(self) -> T: ...
 
 
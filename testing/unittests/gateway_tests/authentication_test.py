@@ -197,6 +197,37 @@ class AuthenticationControllerTest(unittest.TestCase):
             self.assertIsNotNone(result_1)
             self.assertEqual(token_1, result_1)
 
+    def test_token_expiry_purge(self):
+        user_dto_1 = UserDTO(id=5, username='tester', role='ADMIN', pin_code='1234', accepted_terms=1)
+        user_dto_2 = UserDTO(id=7, username='other', role='ADMIN', pin_code='5678', accepted_terms=1)
+
+        with mock.patch.object(self.token_store, '_get_full_user_dto') as full_user_mock:
+            full_user_mock.return_value = user_dto_1
+            short_token = self.token_store.create_token(user_dto_1, timeout=2, login_method=LoginMethod.PASSWORD)
+            long_token = self.token_store.create_token(user_dto_1, timeout=10, login_method=LoginMethod.PASSWORD)
+            removed_token = self.token_store.create_token(user_dto_1, timeout=2, login_method=LoginMethod.PASSWORD)
+            full_user_mock.return_value = user_dto_2
+            other_token = self.token_store.create_token(user_dto_2, timeout=10, login_method=LoginMethod.PASSWORD)
+            self.token_store.remove_token(removed_token)
+            self.assertEqual(3, len(self.token_store.tokens))
+
+            time.sleep(3)
+            # Any lookup purges the expired tokens
+            self.assertEqual(long_token, self.token_store.check_token(long_token))
+            self.assertEqual({long_token.token, other_token.token}, set(self.token_store.tokens.keys()))
+            self.assertIsNone(self.token_store.check_token(short_token))
+            self.assertEqual(2, len(self.token_store._expiry_heap))
+
+            # Tokens are removed for a user without loading it from the database
+            full_user_mock.reset_mock()
+            self.token_store.remove_tokens_for_user(UserDTO(id=5, username='tester'))
+            full_user_mock.assert_not_called()
+            self.assertIsNone(self.token_store.check_token(long_token))
+            self.assertEqual(other_token, self.token_store.check_token(other_token))
+            self.token_store.remove_tokens_for_user(UserDTO(username='Other'))
+            self.assertEqual({}, self.token_store.tokens)
+
+
 from sqlalchemy import create_engine, select
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.pool import StaticPool
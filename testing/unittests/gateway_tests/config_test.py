@@ -19,6 +19,9 @@ Tests for the config module.
 from __future__ import absolute_import
 
 import mock
+import os
+import shutil
+import tempfile
 import unittest
 import logging
 from sqlalchemy import create_engine, select
@@ -26,7 +29,7 @@ from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.pool import StaticPool
 from logs import Logs
 from ioc import SetTestMode
-from gateway.models import Config, Database, Base
+from gateway.models import Config, Database, Base, EngineSettings
 
 MODELS = [Config]
 
@@ -118,3 +121,68 @@ class ConfigControllerTest(unittest.TestCase):
 
         res = Config.get_entry('bool', None)
         self.assertEqual(res, True)
+
+    def test_cache(self):
+        """ Test the write-through cache """
+        value = ['foo']
+        Config.set_entry('Test', value)
+        value.append('bar')  # Changing the given value doesn't change the cached value
+        with mock.patch.object(Database, 'get_session') as session:
+            self.assertEqual(['foo'], Config.get_entry('test', None))
+            session.assert_not_called()
+
+        self.assertEqual('fallback', Config.get_entry('unknown', 'fallback'))
+        with mock.patch.object(Database, 'get_session') as session:
+            self.assertIsNone(Config.get_entry('unknown', None))
+            session.assert_not_called()
+
+        # A change by another process invalidates the cached setting
+        self.session.query(Config).where(Config.setting == 'test').one().data = '["baz"]'
+        self.session.commit()
+        self.assertEqual(['foo'], Config.get_entry('test', None))
+        Config.invalidate(['test'])
+        self.assertEqual(['baz'], Config.get_entry('test', None))
+
+    def test_change_handlers(self):
+        """ Test notifying changes """
+        handler = mock.Mock()
+        with mock.patch.object(Config, 'CHANGE_HANDLERS', [handler]):
+            generation = Config.GENERATION
+            Config.set_entry('Test', 'test')
+            handler.assert_called_with(['test'])
+            Config.remove_entry('test')
+            handler.assert_called_with(['test'])
+            self.assertEqual(2, handler.call_count)
+            self.assertEqual(generation + 2, Config.GENERATION)
+
+
+class EngineSettingsTest(unittest.TestCase):
+    """ Tests for the SQLite engine configuration. """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.engine = EngineSettings.create_engine('sqlite:///{0}'.format(os.path.join(self.folder, 'test.db')))
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(self.engine)
+
+    def test_pragmas(self):
+        with self.engine.connect() as connection:
+            self.assertEqual('wal', connection.exec_driver_sql('PRAGMA journal_mode').scalar())
+            self.assertEqual(1, connection.exec_driver_sql('PRAGMA foreign_keys').scalar())
+            self.assertEqual(1, connection.exec_driver_sql('PRAGMA synchronous').scalar())  # NORMAL
+
+    def test_statistics(self):
+        Database.get_statistics()
+        session = sessionmaker(bind=self.engine)()
+        session.add(Config(setting='foo', data='"bar"'))
+        session.commit()
+        self.assertEqual(1, session.query(Config).count())
+        with mock.patch.object(EngineSettings, 'SLOW_QUERY_DURATION', -1):
+            session.query(Config).count()
+        session.close()
+        statistics = Database.get_statistics()
+        self.assertLessEqual(3, statistics['queries'])
+        self.assertLessEqual(1, statistics['slow_queries'])
+        self.assertEqual(0, statistics['locked'])
+        self.assertEqual(0, Database.get_statistics()['queries'])
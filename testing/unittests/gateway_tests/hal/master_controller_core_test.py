@@ -19,6 +19,7 @@ from ioc import SetTestMode
 from master.core.can_feedback import CANFeedbackController
 from master.core.core_api import CoreAPI
 from master.core.core_communicator import BackgroundConsumer
+from master.core.memory_file import MemoryTypes
 from master.core.memory_models import InputConfiguration, \
     InputModuleConfiguration, OutputConfiguration, OutputModuleConfiguration, \
     SensorModuleConfiguration, ShutterConfiguration, GlobalConfiguration
@@ -178,8 +179,8 @@ class MasterCoreControllerTest(unittest.TestCase):
         global_configuration.save()
 
         input_modules = list(map(get_core_input_dummy, range(16)))
-        with mock.patch.object(gateway.hal.master_controller_core, 'InputConfiguration',
-                               side_effect=input_modules):
+        with mock.patch.object(InputConfiguration, 'load_batch',
+                               return_value=input_modules):
             inputs = self.controller.load_inputs()
             self.assertEqual([x.id for x in inputs], list(range(16)))
 
@@ -268,6 +269,47 @@ class MasterCoreControllerTest(unittest.TestCase):
         self.assertEqual(shutter.outputs.output_0, 510)  # disabled
         self.assertEqual(shutter.outputs.output_1, 511)
 
+    def test_load_output_status(self):
+        global_configuration = GlobalConfiguration()
+        global_configuration.number_of_output_modules = 2
+        global_configuration.save()
+        self.mocked_core.memory[MemoryTypes.FRAM][1] = bytearray([0] * 256)
+        self.mocked_core.memory[MemoryTypes.FRAM][1][9] = 0b00000100  # Output 2 is locked
+        self.return_data['OD'] = {'device_nr': 0, 'status': 1, 'dimmer': 255, 'dimmer_min': 0, 'dimmer_max': 255,
+                                  'timer_type': 0, 'timer_type_standard': 0, 'timer': 0, 'timer_standard': 0,
+                                  'group_action': 0, 'dali_output': 0, 'output_lock': 0}
+
+        def fram_reads():
+            return len([call for call in read.call_args_list
+                        if any(address.memory_type == MemoryTypes.FRAM for address in call[0][0])])
+
+        with mock.patch.object(self.mocked_core.memory_file, 'read', wraps=self.mocked_core.memory_file.read) as read:
+            output_status = self.controller.load_output_status()
+            self.assertEqual(16, len(output_status))
+            self.assertEqual([2], [dto.id for dto in output_status if dto.locked])
+            self.assertEqual(1, fram_reads())  # All locking bytes are read at once
+
+            # Locking events update the flags, without reading the memory again
+            self.controller._handle_event({'type': 0, 'device_nr': 5, 'action': 2, 'data': bytearray([1, 0, 0, 0])})
+            output_status = self.controller.load_output_status()
+            self.assertEqual([2, 5], [dto.id for dto in output_status if dto.locked])
+            self.assertEqual(1, fram_reads())
+
+            # Configuration changes reload the flags
+            self.controller._handle_master_event(MasterEvent(MasterEvent.Types.EEPROM_CHANGE, {}))
+            output_status = self.controller.load_output_status()
+            self.assertEqual([2], [dto.id for dto in output_status if dto.locked])
+            self.assertEqual(2, fram_reads())
+
+            # A Core restart or communication recovery reloads the flags, as events might have been missed
+            self.controller._handle_event({'type': 248, 'device_nr': 0, 'action': 0, 'data': bytearray([0, 0, 0, 0])})
+            self.controller.load_output_status()
+            self.assertEqual(3, fram_reads())
+            self.controller._set_master_state(False)
+            self.controller._set_master_state(True)
+            self.controller.load_output_status()
+            self.assertEqual(4, fram_reads())
+
     def test_inputs_with_status(self):
         from gateway.hal.master_controller_core import MasterInputState
         with mock.patch.object(MasterInputState, 'get_inputs', return_value=[]) as get:
@@ -345,6 +387,42 @@ class MasterCoreControllerTest(unittest.TestCase):
         self.pubsub._publish_all_events(blocking=False)
         assert self.controller._output_last_updated == 0
 
+    def test_memory_statistics(self):
+        before = self.controller.get_memory_statistics()
+        global_configuration = GlobalConfiguration()
+        global_configuration.number_of_output_modules = 1
+        global_configuration.save()
+        statistics = self.controller.get_memory_statistics()
+        self.assertEqual(before['commits'] + 1, statistics['commits'])
+        self.assertGreater(statistics['bytes_written'], before['bytes_written'])
+        self.assertEqual(statistics['commits'] - statistics['activations'], statistics['activations_avoided'])
+
+    def test_module_discovery_invalidation(self):
+        memory_file = self.mocked_core.memory_file
+        with mock.patch.object(memory_file, 'invalidate_cache') as invalidate_cache:
+            self.controller._handle_new_module({'module_type': 0, 'line_number': 2, 'address': '79.0.0.2'})
+            self.controller._finish_module_discovery(reason='test')
+            addresses = invalidate_cache.call_args[1]['addresses']
+            self.assertEqual({('E', 0), ('E', 3), ('E', 392), ('F', 0), ('F', 1)},
+                             set((address.memory_type, address.page) for address in addresses))
+
+            invalidate_cache.reset_mock()
+            self.controller._handle_new_module({'module_type': 3, 'line_number': 0, 'address': '67.0.0.0'})
+            self.controller._finish_module_discovery(reason='test')
+            invalidate_cache.assert_called_once_with(reason='test', addresses=None)
+
+            invalidate_cache.reset_mock()
+            self.controller._finish_module_discovery(reason='test')
+            invalidate_cache.assert_not_called()
+
+    def test_virtual_module_invalidation(self):
+        memory_file = self.mocked_core.memory_file
+        with mock.patch.object(memory_file, 'invalidate_cache') as invalidate_cache, \
+                mock.patch.object(self.controller, '_do_basic_action'):
+            self.controller.add_virtual_output_module()
+            invalidate_cache.assert_called_once_with(reason='virtual module added', addresses=None)
+            self.assertEqual([], self.controller._discovered_addresses)
+
     def test_can_feedback_controller_calls(self):
         with mock.patch.object(CANFeedbackController, 'load_global_led_feedback_configuration') as call:
             self.controller.load_global_feedback(0)
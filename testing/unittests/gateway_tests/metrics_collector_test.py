@@ -14,11 +14,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import absolute_import
 
+import time
 import unittest
+from threading import Event
 import mock
 from gateway.dto import SensorDTO, SensorStatusDTO, RealtimeEnergyDTO, EnergyModuleDTO, TotalEnergyDTO
 from gateway.dto.shutter import ShutterStatusDTO, ShutterDTO
-from gateway.metrics_collector import MetricsCollector
+from gateway.metrics_collector import CollectorScheduler, MetricsCollector
 from gateway.sensor_controller import SensorController
 from gateway.shutter_controller import ShutterController
 from ioc import Scope, SetTestMode, SetUpTestInjections
@@ -89,6 +91,31 @@ class MetricsCollectorTest(unittest.TestCase):
                                       values={'temperature': 21.0})
             assert enqueue.call_args_list == [expected_call]
 
+    def test_sensor_metrics_delta(self):
+        sensor_dto = SensorDTO(id=42, source='master', external_id='0', physical_quantity='temperature', unit='celcius', name='foo')
+        self.controller._environment_sensors = {42: sensor_dto}
+        self.sensor_controller.get_sensors_status.return_value = [SensorStatusDTO(id=42, value=21.0)]
+        with mock.patch.object(self.controller, '_enqueue_metrics') as enqueue, \
+                mock.patch.object(time, 'time', return_value=1000.0) as now:
+            self.controller._process_sensors('sensor')
+            self.assertEqual(1, enqueue.call_count)
+            now.return_value = 1005.0
+            self.controller._process_sensors('sensor')
+            self.assertEqual(1, enqueue.call_count)  # Unchanged
+            self.sensor_controller.get_sensors_status.return_value = [SensorStatusDTO(id=42, value=21.5)]
+            self.controller._process_sensors('sensor')
+            self.assertEqual(2, enqueue.call_count)
+            self.assertEqual({'temperature': 21.5}, enqueue.call_args_list[-1][1]['values'])
+            now.return_value = 1005.0 + MetricsCollector.KEYFRAME_INTERVAL
+            self.controller._process_sensors('sensor')
+            self.assertEqual(3, enqueue.call_count)  # Keyframe
+            now.return_value = 1800.0
+            self.controller._process_sensors('sensor')
+            self.assertEqual(4, enqueue.call_count)  # New cloud interval
+            self.controller._reset_last_values('sensor')
+            self.controller._process_sensors('sensor')
+            self.assertEqual(5, enqueue.call_count)
+
     def test_realtime_energy_metrics(self):
         self.em_controller.get_realtime_energy.return_value = {'10': [RealtimeEnergyDTO(voltage=10.0,
                                                                                         frequency=2.1,
@@ -227,3 +254,33 @@ class MetricsCollectorTest(unittest.TestCase):
                                       tags={'type': 'openmotics', 'id': 'C11.0', 'name': 'foo'},
                                       values={'counter_day': 10, 'counter_night': 2, 'counter': 12})
             self.assertEqual([expected_call], enqueue.call_args_list)
+
+    def test_scheduler(self):
+        runs = {'fast': 0, 'slow': 0}
+        intervals = {'fast': 0.01, 'slow': 60}
+        events = {'fast': Event(), 'slow': Event()}
+
+        def _run(name):
+            runs[name] += 1
+            if name == 'fast' and runs[name] < 3:
+                return
+            events[name].set()
+
+        scheduler = CollectorScheduler(name='test', workers=2)
+        for name in runs:
+            scheduler.add_job(name, lambda name=name: _run(name), lambda name=name: intervals[name])
+        scheduler.start()
+        try:
+            self.assertTrue(events['slow'].wait(5))
+            self.assertTrue(events['fast'].wait(5))  # The fast job keeps running
+            self.assertEqual(1, runs['slow'])  # While the slow one waits for its next deadline
+            events['slow'].clear()
+            intervals['slow'] = 0.01
+            scheduler.reschedule('slow', 0.01)  # Runs right away, since the previous run is longer ago
+            self.assertTrue(events['slow'].wait(5))
+            self.assertTrue(runs['slow'] >= 2)
+        finally:
+            scheduler.stop()
+        statistics = scheduler.get_statistics()
+        self.assertEqual({'fast', 'slow'}, set(statistics.keys()))
+        self.assertTrue(statistics['fast']['max_lateness'] >= statistics['fast']['lateness'] >= 0)
@@ -0,0 +1,95 @@
+# Copyright (C) 2021 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the metrics history.
+"""
+from __future__ import absolute_import
+
+import unittest
+
+from gateway.metrics_history import MetricRing, MetricsHistory
+
+
+class MetricsHistoryTest(unittest.TestCase):
+    """ Tests for MetricsHistory. """
+
+    def test_ring(self):
+        ring = MetricRing(3)
+        self.assertEqual([], ring.get_samples())
+        for i in range(5):
+            ring.append(float(i), i * 10.0)
+        self.assertEqual(3, len(ring))
+        self.assertEqual([[2.0, 20.0], [3.0, 30.0], [4.0, 40.0]], ring.get_samples())
+        self.assertEqual([[3.0, 30.0]], ring.get_samples(start=3, end=3.5))
+
+    def test_history(self):
+        history = MetricsHistory()
+
+        def _add(timestamp, power, name='foo'):
+            history.add({'source': 'OpenMotics',
+                         'type': 'energy',
+                         'timestamp': timestamp,
+                         'tags': {'name': name},
+                         'values': {'power': power, 'state': 'on', 'on': True}}, 'name={0}'.format(name))
+
+        for timestamp in range(0, 180, 10):
+            _add(timestamp, timestamp)
+        _add(0, 1, name='bar')
+
+        result = history.query('OpenMotics', 'energy', tags={'name': 'foo'})
+        self.assertEqual(1, len(result))
+        self.assertEqual({'name': 'foo'}, result[0]['tags'])
+        self.assertEqual(['power'], list(result[0]['values'].keys()))
+        self.assertEqual(18, len(result[0]['values']['power']))
+
+        result = history.query('OpenMotics', 'energy', resolution='1m', tags={'name': 'foo'})
+        self.assertEqual([[0.0, 25.0], [60.0, 85.0]], result[0]['values']['power'])
+        result = history.query('OpenMotics', 'energy', resolution='1m', tags={'name': 'foo'}, start=30)
+        self.assertEqual([[60.0, 85.0]], result[0]['values']['power'])
+
+        self.assertEqual(2, len(history.query('OpenMotics', 'energy')))
+        self.assertEqual([], history.query('OpenMotics', 'counter'))
+        with self.assertRaises(ValueError):
+            history.query('OpenMotics', 'energy', resolution='1h')
+
+    def test_max_series(self):
+        history = MetricsHistory(max_series=2)
+
+        def _add(timestamp, metric_type, name, values):
+            history.add({'source': 'OpenMotics',
+                         'type': metric_type,
+                         'timestamp': timestamp,
+                         'tags': {'name': name},
+                         'values': values}, 'name={0}'.format(name))
+
+        _add(0, 'system', 'gateway', {'cpu_percent': 10})  # Not kept
+        _add(0, 'event', 'foo', {'event': 'pressed'})  # No numeric values
+        _add(0, 'energy', 'foo', {'power': 1, 'voltage': 2, 'current': 3})
+        _add(0, 'energy', 'bar', {'power': 1})  # Full
+        self.assertEqual([], history.query('OpenMotics', 'system'))
+        self.assertEqual([], history.query('OpenMotics', 'event'))
+        result = history.query('OpenMotics', 'energy')
+        self.assertEqual(1, len(result))
+        self.assertEqual(2, len(result[0]['values']))
+
+        # Idle series are removed, making room for new series
+        _add(MetricsHistory.IDLE_TIMEOUT + 1, 'energy', 'foo', {'power': 1})
+        _add(MetricsHistory.IDLE_TIMEOUT + 2, 'energy', 'bar', {'power': 1})
+        result = history.query('OpenMotics', 'energy')
+        self.assertEqual({'foo': ['power'], 'bar': ['power']},
+                         {entry['tags']['name']: list(entry['values'].keys()) for entry in result})
+
+if __name__ == '__main__':
+    unittest.main()
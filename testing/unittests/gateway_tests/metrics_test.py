@@ -166,6 +166,24 @@ class MetricsTest(unittest.TestCase):
         needs_upload = self.controller._needs_upload_to_cloud(metric)
         self.assertFalse(needs_upload)
 
+    def test_routes(self):
+        Config.set_entry('cloud_enabled', True)
+        Config.set_entry('cloud_metrics_types', ['foobar'])
+        route = self.controller._get_route('OpenMotics', 'foobar')
+        self.assertIs(route, self.controller._get_route('OpenMotics', 'foobar'))
+        self.assertEqual('id=0|name=name', route.get_identifier({'name': 'name', 'id': 0, 'other': 1}))
+        self.assertEqual({'counter': True}, route.buffer_counters)
+
+        metric = {'source': 'OpenMotics', 'type': 'foobar', 'timestamp': 0, 'tags': {'name': 'name', 'id': 0}, 'values': {}}
+        self.assertTrue(self.controller._needs_upload_to_cloud(metric))
+        with patch.object(Config, 'get_entry', side_effect=AssertionError('Config should be cached')):
+            self.assertTrue(self.controller._needs_upload_to_cloud(metric))
+        Config.set_entry('cloud_metrics_types', [])  # Any change refreshes the cached configuration
+        self.assertFalse(self.controller._needs_upload_to_cloud(metric))
+
+        self.controller.set_plugin_definitions({})
+        self.assertIsNot(route, self.controller._get_route('OpenMotics', 'foobar'))
+
     def test_startup(self):
         self.controller._needs_upload_to_cloud = lambda *args, **kwargs: True
         self.assertEqual(self.controller._buffer_counters, {'OpenMotics': {'foobar': {'counter': True}}})
@@ -173,7 +191,7 @@ class MetricsTest(unittest.TestCase):
         # Validate initial state
         self.assert_fields(cache={},
                            queue=[],
-                           stats={'queue': 0, 'buffer': 0, 'time_ago_send': 0, 'time_ago_try': 0},
+                           stats={'queue': 0, 'buffer': 0, 'spool': 0, 'time_ago_send': 0, 'time_ago_try': 0},
                            buffer=[],
                            last_send=0,
                            last_try=0,
@@ -196,7 +214,7 @@ class MetricsTest(unittest.TestCase):
 
         self.assert_fields(cache={'OpenMotics': {'foobar': {'id=0|name=name': {'timestamp': 10}}}},
                            queue=[[metric_1]],
-                           stats={'queue': 1, 'buffer': 0, 'time_ago_send': 10, 'time_ago_try': 10},  # Nothing buffered yet
+                           stats={'queue': 1, 'buffer': 0, 'spool': 0, 'time_ago_send': 10, 'time_ago_try': 10},  # Nothing buffered yet
                            buffer=[],
                            last_send=0,
                            last_try=10,
@@ -222,7 +240,7 @@ class MetricsTest(unittest.TestCase):
 
         self.assert_fields(cache={'OpenMotics': {'foobar': {'id=0|name=name': {'timestamp': 20}}}},
                            queue=[[metric_1], [metric_2]],
-                           stats={'queue': 2, 'buffer': 1, 'time_ago_send': 20, 'time_ago_try': 10},
+                           stats={'queue': 2, 'buffer': 1, 'spool': 0, 'time_ago_send': 20, 'time_ago_try': 10},
                            buffer=[],
                            last_send=0,
                            last_try=20,
@@ -264,7 +282,7 @@ class MetricsTest(unittest.TestCase):
 
         self.assert_fields(cache={'OpenMotics': {'foobar': {'id=0|name=name': {'timestamp': 30}}}},
                            queue=[],  # empty
-                           stats={'queue': 3, 'buffer': 1, 'time_ago_send': 30, 'time_ago_try': 10},
+                           stats={'queue': 3, 'buffer': 1, 'spool': 0, 'time_ago_send': 30, 'time_ago_try': 10},
                            buffer=[],
                            last_send=30,
                            last_try=30,
@@ -285,7 +303,7 @@ class MetricsTest(unittest.TestCase):
 
         self.assert_fields(cache={'OpenMotics': {'foobar': {'id=0|name=name': {'timestamp': 60}}}},
                            queue=[],
-                           stats={'queue': 1, 'buffer': 0, 'time_ago_send': 30, 'time_ago_try': 30},
+                           stats={'queue': 1, 'buffer': 0, 'spool': 0, 'time_ago_send': 30, 'time_ago_try': 30},
                            buffer=[],
                            last_send=60,
                            last_try=60,
@@ -294,6 +312,29 @@ class MetricsTest(unittest.TestCase):
         self.assertEqual(buffered_metrics, [])
 
 
+    def test_cloud_spool(self):
+        self.controller._needs_upload_to_cloud = lambda *args, **kwargs: True
+        self.cloud_api_client.send_metrics.side_effect = Exception('Cloud error')
+
+        metrics = []
+        with patch.object(MetricsController, 'CLOUD_QUEUE_LENGTH', 2), \
+                patch.object(MetricsController, 'CLOUD_SPOOL_BATCH_SIZE', 1):
+            for i in range(4):
+                time.sleep(10)
+                metrics.append(self._send_metric(counter=i))
+            self.assertEqual(2, self.controller.cloud_stats['spool'])
+            self.assertEqual([[metrics[2]], [metrics[3]]], list(self.controller._cloud_queue))
+
+            self.cloud_api_client.send_metrics.side_effect = None
+            time.sleep(10)
+            metrics.append(self._send_metric(counter=4))
+
+        # The spooled metrics are replayed before the queued ones
+        sent_metrics = self.cloud_api_client.send_metrics.call_args[0][0]
+        self.assertEqual([[metric] for metric in metrics], sent_metrics[-5:])
+        self.assertEqual(0, self.metrics_cache_controller.get_spool_length())
+        self.assertEqual([], list(self.controller._cloud_queue))
+
     def test_send_batch(self):
         Config.set_entry('cloud_metrics_batch_size', 2)
         Config.set_entry('cloud_metrics_min_interval', 300)
@@ -325,7 +366,7 @@ class MetricsTest(unittest.TestCase):
 
         self.assert_fields(cache={'OpenMotics': {'foobar': {'id=0|name=name': {'timestamp': 20}}}},
                            queue=[],
-                           stats={'queue': 2, 'buffer': 0, 'time_ago_send': 20, 'time_ago_try': 20},
+                           stats={'queue': 2, 'buffer': 0, 'spool': 0, 'time_ago_send': 20, 'time_ago_try': 20},
                            buffer=[],
                            last_send=20,
                            last_try=20,
@@ -354,9 +395,27 @@ class MetricsTest(unittest.TestCase):
         self.assertEqual(3, len(buffered_metrics))
         self.assertEqual(expected_metrics[2:], buffered_metrics)
 
+    def test_counter_cache(self):
+        tags = {'name': 'name', 'id': 0}
+        controller = self.metrics_cache_controller
+        self.assertEqual(10, controller.process_counter('OpenMotics', 'foobar', tags, 'counter', 10, 100))
+        self.assertEqual(15, controller.process_counter('OpenMotics', 'foobar', tags, 'counter', 15, 105))
+        self.assertEqual(18, controller.process_counter('OpenMotics', 'foobar', tags, 'counter', 3, 110))  # Counter reset
+        query = "SELECT last_value, counter, timestamp FROM counters;"
+        self.assertEqual([], controller._execute(query).fetchall())  # Not yet persisted
+        controller.flush()
+        self.assertEqual([(3, 18, 110)], controller._execute(query).fetchall())
+        self.assertEqual(20, controller.process_counter('OpenMotics', 'foobar', tags, 'counter', 5, 115))
+        controller.flush()
+        self.assertEqual([(5, 20, 115)], controller._execute(query).fetchall())
+
+        # A new controller continues from the persisted state
+        controller._counters = {}
+        self.assertEqual(22, controller.process_counter('OpenMotics', 'foobar', tags, 'counter', 7, 120))
+
     def assert_fields(self, cache, queue, stats, buffer, last_send, last_try, retry_interval):
         self.assertDictEqual(self.controller._cloud_cache, cache)
-        self.assertListEqual(self.controller._cloud_queue, queue)
+        self.assertListEqual(list(self.controller._cloud_queue), queue)
         self.assertDictEqual(self.controller.cloud_stats, stats)
         self.assertListEqual(self.controller._cloud_buffer, buffer)
         self.assertEqual(self.controller._cloud_last_send, last_send)
@@ -84,6 +84,22 @@ class OutputControllerTest(unittest.TestCase):
             assert GatewayEvent(GatewayEvent.Types.CONFIG_CHANGE, {'type': 'output'}) in events
             assert len(events) == 1
 
+    def test_orm_sync_changes(self):
+        with self.session as db:
+            db.add_all([Output(number=1, name='foo'), Output(number=2, name='bar')])
+            db.commit()
+
+        with mock.patch.object(self.master_controller, 'load_outputs', return_value=[OutputDTO(id=i) for i in [2, 3, 4]]), \
+             mock.patch.object(self.master_controller, 'load_output_status', return_value=[]):
+            self.controller._sync_structures = True
+            self.controller.run_sync_orm()
+            with self.session as db:
+                outputs = {output.number: output for output in db.query(Output)}
+                self.assertEqual([2, 3, 4], sorted(outputs.keys()))
+                self.assertEqual('bar', outputs[2].name)  # Existing outputs are kept as is
+                self.assertEqual('', outputs[3].name)
+                self.assertTrue(outputs[3].in_use)
+
     def test_output_sync_change(self):
         events = []
 
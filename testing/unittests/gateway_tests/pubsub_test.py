@@ -23,8 +23,9 @@ import unittest
 
 from mock import Mock, patch, call
 
+from gateway.dto import InputStatusDTO, OutputStatusDTO
 from gateway.events import GatewayEvent
-from gateway.pubsub import PubSub
+from gateway.pubsub import EventStructure, PubSub
 from gateway.hal.master_event import MasterEvent
 from ioc import SetTestMode, SetUpTestInjections
 
@@ -106,3 +107,107 @@ class PubSubTest(unittest.TestCase):
 
         master_callback_mock.assert_called_once_with(master_event)
         gateway_callback_mock.assert_called_once_with(gw_event)
+
+    def test_slow_subscriber(self):
+        slow_events = []
+        fast_events = []
+
+        class Slow(object):
+            def handle_event(self, event):
+                time.sleep(0.5)
+                slow_events.append(event)
+
+        class Fast(object):
+            def handle_event(self, event):
+                fast_events.append(event)
+
+        slow, fast = Slow(), Fast()
+        self.pubsub.subscribe_gateway_events(PubSub.GatewayTopics.CONFIG, slow.handle_event)
+        self.pubsub.subscribe_gateway_events(PubSub.GatewayTopics.CONFIG, fast.handle_event)
+        events = [GatewayEvent(GatewayEvent.Types.CONFIG_CHANGE, {'type': str(i)}) for i in range(3)]
+        self.pubsub.start()
+        try:
+            for event in events:
+                self.pubsub.publish_gateway_event(PubSub.GatewayTopics.CONFIG, event)
+            time.sleep(0.4)
+            self.assertEqual(events, fast_events)  # Not delayed by the slow subscriber
+            self.assertEqual([], slow_events)
+            time.sleep(1.5)
+            self.assertEqual(events, slow_events)  # In order
+        finally:
+            self.pubsub.stop()
+        statistics = self.pubsub.get_statistics()
+        self.assertEqual(3, sum(statistics['Fast']['latency'].values()))
+        self.assertEqual(3, statistics['Slow']['latency'].get('<1s', 0) + statistics['Slow']['latency'].get('>=1s', 0))
+
+    def test_bounded_state_events(self):
+        events = []
+        with patch.object(PubSub, 'MAX_QUEUED_STATE_EVENTS', 2):
+            pubsub = PubSub()
+            pubsub.subscribe_gateway_events(PubSub.GatewayTopics.STATE, events.append)
+            pubsub.subscribe_gateway_events(PubSub.GatewayTopics.CONFIG, events.append)
+        subscriber = pubsub._gateway_topics[PubSub.GatewayTopics.STATE][0][0]
+        states = [GatewayEvent(GatewayEvent.Types.OUTPUT_CHANGE, {'id': i % 2, 'status': {'on': i > 1}}) for i in range(4)]
+        config = GatewayEvent(GatewayEvent.Types.CONFIG_CHANGE, {'type': 'output'})
+        sensor = GatewayEvent(GatewayEvent.Types.SENSOR_CHANGE, {'id': 0, 'value': 1.0})
+        for event in states[:2]:
+            subscriber.enqueue(events.append, EventStructure(PubSub.GatewayTopics.STATE, event), is_state=True)
+        subscriber.enqueue(events.append, EventStructure(PubSub.GatewayTopics.CONFIG, config), is_state=False)
+        for event in states[2:] + [sensor]:
+            subscriber.enqueue(events.append, EventStructure(PubSub.GatewayTopics.STATE, event), is_state=True)
+        subscriber.deliver(max_events=10)
+        # The latest output states replaced the queued ones, the last state of an output is never dropped
+        self.assertEqual([states[2], states[3], config, sensor], events)
+        self.assertEqual((0, 2, 1), (subscriber.dropped, subscriber.merged, subscriber.overflowed))
+
+    def test_bounded_state_events_superseded(self):
+        events = []
+        with patch.object(PubSub, 'MAX_QUEUED_STATE_EVENTS', 2):
+            pubsub = PubSub()
+            pubsub.subscribe_gateway_events(PubSub.GatewayTopics.STATE, events.append)
+        subscriber = pubsub._gateway_topics[PubSub.GatewayTopics.STATE][0][0]
+        states = [GatewayEvent(GatewayEvent.Types.OUTPUT_CHANGE, {'id': 0, 'status': {'on': on}}) for on in [True, False]]
+        sensors = [GatewayEvent(GatewayEvent.Types.SENSOR_CHANGE, {'id': i, 'value': 1.0}) for i in range(2)]
+        for event in states + sensors:
+            subscriber.enqueue(events.append, EventStructure(PubSub.GatewayTopics.STATE, event), is_state=True)
+        self.assertEqual(3, len(subscriber))
+        subscriber.deliver(max_events=10)
+        # Only the superseded output state is dropped
+        self.assertEqual([states[1], sensors[0], sensors[1]], events)
+        self.assertEqual((1, 0, 1), (subscriber.dropped, subscriber.merged, subscriber.overflowed))
+        self.assertEqual(0, len(subscriber))
+
+    def test_bounded_master_state_events(self):
+        events = []
+        with patch.object(PubSub, 'MAX_QUEUED_STATE_EVENTS', 2):
+            pubsub = PubSub()
+            pubsub.subscribe_master_events(PubSub.MasterTopics.OUTPUT, events.append)
+        subscriber = pubsub._master_topics[PubSub.MasterTopics.OUTPUT][0][0]
+        outputs = [MasterEvent(MasterEvent.Types.OUTPUT_STATUS, {'state': OutputStatusDTO(id=i % 2, status=i > 1)}) for i in range(4)]
+        lock = MasterEvent(MasterEvent.Types.OUTPUT_STATUS, {'state': OutputStatusDTO(id=1, locked=True)})
+        inputs = [MasterEvent(MasterEvent.Types.INPUT_CHANGE, {'state': InputStatusDTO(id=1, status=status)}) for status in [True, False]]
+        for event in outputs + [inputs[0], lock, inputs[1]]:
+            subscriber.enqueue(events.append, EventStructure(PubSub.MasterTopics.OUTPUT, event), is_state=True)
+        subscriber.deliver(max_events=10)
+        # Output states are merged per output, the lock event (other fields) is queued as well,
+        # input edges are never merged nor dropped
+        self.assertEqual([outputs[2], outputs[3], inputs[0], lock, inputs[1]], events)
+        self.assertEqual((0, 2), (subscriber.dropped, subscriber.merged))
+
+    def test_state_coalescing(self):
+        self.pubsub.set_state_coalescing(window=0.5)
+        outputs = [GatewayEvent(GatewayEvent.Types.OUTPUT_CHANGE, {'id': 1, 'status': {'on': True, 'value': i}}) for i in range(5)]
+        sensor = GatewayEvent(GatewayEvent.Types.SENSOR_CHANGE, {'id': 1, 'value': 21.5})
+        inputs = [GatewayEvent(GatewayEvent.Types.INPUT_CHANGE, {'id': 1, 'status': status}) for status in [True, False]]
+        for event in outputs[:3] + [sensor] + outputs[3:] + inputs:
+            self.pubsub.publish_gateway_event(PubSub.GatewayTopics.STATE, event)
+        self.pubsub._publish_all_events(blocking=False)
+        # Input edges are never coalesced, only the latest output state is delivered
+        self.assertEqual([call(event) for event in inputs + [outputs[4], sensor]], self.sub_gateway_mock.call_args_list)
+
+        self.sub_gateway_mock.reset_mock()
+        self.pubsub.set_state_coalescing(window=0)
+        for event in outputs:
+            self.pubsub.publish_gateway_event(PubSub.GatewayTopics.STATE, event)
+        self.pubsub._publish_all_events(blocking=False)
+        self.assertEqual([call(event) for event in outputs], self.sub_gateway_mock.call_args_list)
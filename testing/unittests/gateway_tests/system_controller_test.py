@@ -0,0 +1,124 @@
+# Copyright (C) 2021 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the system controller.
+"""
+
+from __future__ import absolute_import
+
+import io
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import unittest
+from threading import Lock
+
+import mock
+
+import constants
+from gateway.metrics_caching import MetricsCacheController
+from gateway.system_controller import SystemController
+from ioc import SetTestMode, SetUpTestInjections
+
+
+class SystemControllerTest(unittest.TestCase):
+    """ Tests for SystemController. """
+
+    @classmethod
+    def setUpClass(cls):
+        SetTestMode()
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_backup_restore_wal_database(self):
+        path = os.path.join(self.folder, 'gateway.db')
+        connection = sqlite3.connect(path)
+        self.addCleanup(connection.close)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA wal_autocheckpoint=0')  # Keep the committed data in the write-ahead log
+        connection.execute('CREATE TABLE config (setting TEXT, data TEXT)')
+        connection.execute("INSERT INTO config VALUES ('foo', 'bar')")
+        connection.commit()
+        self.assertTrue(os.path.getsize(path + '-wal') > 0)
+
+        backup_path = os.path.join(self.folder, 'backup.db')
+        SystemController._backup_sqlite_db(path, backup_path)
+        backup_connection = sqlite3.connect(backup_path)
+        self.assertEqual([('foo', 'bar')], backup_connection.execute('SELECT * FROM config').fetchall())
+        backup_connection.close()
+
+        # Changes made after the backup are in the write-ahead log, the restore should replace them
+        connection.execute("UPDATE config SET data = 'baz'")
+        connection.commit()
+        SystemController._restore_sqlite_db(backup_path, path)
+        self.assertEqual([('foo', 'bar')], connection.execute('SELECT * FROM config').fetchall())
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')  # The live connection can't bring back old pages
+        connection.close()
+        restored_connection = sqlite3.connect(path)
+        self.assertEqual([('foo', 'bar')], restored_connection.execute('SELECT * FROM config').fetchall())
+        restored_connection.close()
+
+    def test_backup_restore_metrics_database(self):
+        path = os.path.join(self.folder, 'metrics.db')
+        SetUpTestInjections(metrics_db=path, metrics_db_lock=Lock())
+        metrics_cache_controller = MetricsCacheController()
+        self.addCleanup(metrics_cache_controller._connection.close)
+        metrics_cache_controller._execute('PRAGMA wal_autocheckpoint=0')
+        metrics_cache_controller.process_counter('OpenMotics', 'energy', {'id': 1}, 'power', 10.0, 1000)
+        metrics_cache_controller.flush()
+        self.assertTrue(os.path.getsize(path + '-wal') > 0)
+
+        # Backup while the cache controller is still using the database
+        backup_path = os.path.join(self.folder, 'backup.db')
+        SystemController._backup_sqlite_db(path, backup_path)
+        backup_connection = sqlite3.connect(backup_path)
+        self.assertEqual([('power', 10.0)], backup_connection.execute('SELECT name, counter FROM counters').fetchall())
+        backup_connection.close()
+
+        metrics_cache_controller.process_counter('OpenMotics', 'energy', {'id': 1}, 'power', 20.0, 1001)
+        metrics_cache_controller.flush()
+        SystemController._restore_sqlite_db(backup_path, path)
+        self.assertEqual([('power', 10.0)], metrics_cache_controller._execute('SELECT name, counter FROM counters').fetchall())
+
+    def test_full_backup_flushes_metrics(self):
+        etc_folder = os.path.join(self.folder, 'etc')
+        plugin_folder = os.path.join(self.folder, 'plugins')
+        os.mkdir(etc_folder)
+        os.mkdir(plugin_folder)
+        for filename in ['openmotics.conf', 'https.key', 'https.crt']:
+            with open(os.path.join(etc_folder, filename), 'w') as config_file:
+                config_file.write('')
+        with mock.patch.object(constants, 'OPENMOTICS_PREFIX', self.folder), \
+                mock.patch.object(constants, 'get_plugin_dir', return_value=plugin_folder + '/'):
+            SetUpTestInjections(metrics_db=constants.get_metrics_database_file(), metrics_db_lock=Lock())
+            metrics_cache_controller = MetricsCacheController()
+            self.addCleanup(metrics_cache_controller._connection.close)
+            metrics_cache_controller.process_counter('OpenMotics', 'energy', {'id': 1}, 'power', 10.0, 1000)
+            module_controller = mock.Mock(get_master_backup=mock.Mock(return_value=b'\xff' * 10))
+            SetUpTestInjections(master_controller=mock.Mock(),
+                                module_controller=module_controller,
+                                message_client=None,
+                                metrics_cache_controller=metrics_cache_controller)
+            backup = SystemController().get_full_backup()
+
+        with tarfile.open(fileobj=io.BytesIO(backup)) as backup_tar:
+            backup_tar.extract('sqlite/metrics.db', self.folder)
+        backup_connection = sqlite3.connect(os.path.join(self.folder, 'sqlite/metrics.db'))
+        self.assertEqual([('power', 10.0)], backup_connection.execute('SELECT name, counter FROM counters').fetchall())
+        backup_connection.close()
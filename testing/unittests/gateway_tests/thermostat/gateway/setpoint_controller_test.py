@@ -66,6 +66,7 @@ class SetpointControllerTest(unittest.TestCase):
 
         SetUpTestInjections(master_controller=self.master_controller,
                             message_client=None,
+                            metrics_cache_controller=None,
                             module_controller=None,
                             pubsub=mock.Mock(PubSub))
         SetUpTestInjections(system_controller=SystemController())
@@ -15,8 +15,11 @@
 from __future__ import absolute_import
 
 import json
+import threading
+import time
 import unittest
 
+import cherrypy
 import mock
 
 from bus.om_bus_client import MessageClient
@@ -29,10 +32,12 @@ from gateway.dto import DimmerConfigurationDTO, EnergyModuleDTO, ModuleDTO, \
     UserDTO, VentilationDTO, VentilationSourceDTO, VentilationStatusDTO
 from gateway.energy_module_controller import EnergyModuleController
 from gateway.enums import ModuleType
+from gateway.events import GatewayEvent
 from gateway.group_action_controller import GroupActionController
 from gateway.hal.frontpanel_controller import FrontpanelController
 from gateway.input_controller import InputController
 from gateway.maintenance_controller import MaintenanceController
+from gateway.models import Config
 from gateway.module_controller import ModuleController
 from gateway.output_controller import OutputController
 from gateway.pulse_counter_controller import PulseCounterController
@@ -44,6 +49,7 @@ from gateway.thermostat.thermostat_controller import ThermostatController
 from gateway.user_controller import UserController
 from gateway.ventilation_controller import VentilationController
 from gateway.webservice import WebInterface
+from gateway.websockets import WebSocketBroadcaster
 from ioc import SetTestMode, SetUpTestInjections
 
 
@@ -510,3 +516,61 @@ class WebInterfaceTest(unittest.TestCase):
                                                'error': {'code': 0, 'description': 'no error'},
                                                'type': 'NOTIFICATION'},
                               'success': True}, api_response)
+
+    def test_send_event_websocket(self):
+        sockets = [mock.Mock(), mock.Mock()]
+        receivers = {'a': {'token': 'foo', 'subscribed_types': [GatewayEvent.Types.OUTPUT_CHANGE], 'socket': sockets[0]},
+                     'b': {'token': 'bar', 'subscribed_types': [GatewayEvent.Types.OUTPUT_CHANGE], 'socket': sockets[1]}}
+        event = GatewayEvent(event_type=GatewayEvent.Types.OUTPUT_CHANGE, data={'id': 1, 'status': {'on': True}})
+        self.user_controller.check_token.return_value = True
+        with mock.patch.object(cherrypy.engine, 'publish', return_value=[receivers]), \
+                mock.patch.object(cherrypy.request, 'remote', mock.Mock(ip='10.0.0.1')), \
+                mock.patch.object(Config, 'get_entry', return_value=False):
+            self.web.send_event_websocket(event)
+            self.web.send_event_websocket(event)
+        self.assertEqual(2, self.user_controller.check_token.call_count)  # Once per connection
+        encoded_events = [socket.send_encoded.call_args_list[0][0][0] for socket in sockets]
+        self.assertIs(encoded_events[0], encoded_events[1])  # Shared by all sockets
+        self.assertEqual(event.serialize(), encoded_events[0].data)
+
+    def test_websocket_broadcaster(self):
+        def _wait_for(condition):
+            start = time.time()
+            while not condition() and time.time() - start < 5:
+                time.sleep(0.01)
+
+        broadcaster = WebSocketBroadcaster()
+        slow_socket, fast_socket = mock.Mock(), mock.Mock()
+        event = threading.Event()
+        slow_socket.send_encoded.side_effect = lambda data: event.wait(5)
+        slow_receiver = {'socket': slow_socket}
+        fast_receiver = {'socket': fast_socket}
+        on_error = mock.Mock()
+        broadcaster.start()
+        try:
+            with mock.patch.object(WebSocketBroadcaster, 'QUEUE_LENGTH', 3):
+                broadcaster.send('slow', slow_receiver, {'i': 0}, drop_oldest=True, on_error=on_error)
+                _wait_for(lambda: slow_socket.send_encoded.called)
+                for i in range(1, 5):
+                    broadcaster.send('slow', slow_receiver, {'i': i}, drop_oldest=True, on_error=on_error)
+            for i in range(5):
+                broadcaster.send('fast', fast_receiver, {'i': i}, drop_oldest=False, on_error=on_error)
+            _wait_for(lambda: fast_socket.send_encoded.call_count == 5)
+            # A slow client doesn't block the other clients
+            self.assertEqual([{'i': i} for i in range(5)], [call[0][0] for call in fast_socket.send_encoded.call_args_list])
+            on_error.assert_not_called()
+            statistics = WebSocketBroadcaster.get_statistics({'slow': slow_receiver, 'fast': fast_receiver})
+            self.assertEqual(0, statistics['fast']['queue_length'])
+            self.assertEqual(3, statistics['slow']['queue_length'])
+            self.assertEqual(1, statistics['slow']['dropped'])  # Oldest data is dropped when the queue is full
+
+            # A client of which the data can't be dropped is disconnected when its queue is full
+            with mock.patch.object(WebSocketBroadcaster, 'QUEUE_LENGTH', 3):
+                blocked_receiver = {'socket': slow_socket}
+                for i in range(5):
+                    broadcaster.send('blocked', blocked_receiver, {'i': i}, drop_oldest=False, on_error=on_error)
+            on_error.assert_called_with('blocked', None)
+            slow_socket.close.assert_called()
+        finally:
+            event.set()
+            broadcaster.stop()
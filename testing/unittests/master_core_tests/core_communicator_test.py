@@ -14,14 +14,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import absolute_import
 
+import os
+import struct
 import unittest
 
 import time
 import mock
 
-from threading import Thread
+from threading import Lock, Thread
 from ioc import SetTestMode
-from master.core.core_communicator import CoreCommunicator, CommunicationBlocker, CommunicationTimedOutException
+from master.core.core_communicator import CoreCommunicator, CommunicationBlocker, CommunicationTimedOutException, \
+    Consumer, ReplyBuffer
 from master.core.core_api import CoreAPI
 
 
@@ -71,3 +74,121 @@ class CoreCommunicatorTest(unittest.TestCase):
         communicator.report_blockage(CommunicationBlocker.RESTART, active=False)
         communicator.do_command(CoreAPI.device_information_list_inputs(), {}, timeout=None)
         self.assertEqual(3, communicator._send_command.call_count)
+
+    def test_do_commands_pipelined(self):
+        serial = CoreSerialLoopback(batch_size=4)
+        communicator = CoreCommunicator(controller_serial=serial)
+        communicator.start()
+        try:
+            commands = [(CoreAPI.output_detail(), {'device_nr': i}) for i in range(10)]
+            responses = communicator.do_commands(commands, timeout=2, window=4)
+        finally:
+            communicator.stop()
+            serial.close()
+        self.assertEqual(list(range(10)), [response['device_nr'] for response in responses])
+        self.assertEqual([i % 2 for i in range(10)], [response['status'] for response in responses])
+        # Requests are written back-to-back, without waiting for the answers
+        self.assertEqual(4, serial.max_in_flight)
+        self.assertEqual(set(), communicator._cids_in_use)
+
+    def test_do_commands_timeout_cancels_in_flight(self):
+        communicator = CoreCommunicator(controller_serial=mock.Mock())
+        communicator._send_command = mock.Mock()
+        commands = [(CoreAPI.output_detail(), {'device_nr': i}) for i in range(4)]
+        with self.assertRaises(CommunicationTimedOutException):
+            communicator.do_commands(commands, timeout=0.1, window=2)
+        self.assertEqual(2, communicator._send_command.call_count)
+        self.assertEqual(set(), communicator._cids_in_use)
+        self.assertEqual([], [c for consumers in communicator._consumers.values() for c in consumers])
+
+    def test_read_frames(self):
+        serial = CoreSerialLoopback(batch_size=1)
+        communicator = CoreCommunicator(controller_serial=serial)
+        consumers = [Consumer(CoreAPI.output_detail(), cid) for cid in [3, 4, 5]]
+        for consumer in consumers:
+            communicator.register_consumer(consumer)
+        communicator.start()
+        try:
+            corrupt = CoreSerialLoopback.build_reply(3, 1)
+            corrupt[-3] = (corrupt[-3] + 1) % 256
+            data = (bytearray(b'\x00TR') + corrupt +
+                    CoreSerialLoopback.build_reply(3, 7) +
+                    bytearray(b'\xffRR') + CoreSerialLoopback.build_reply(4, 8) +
+                    CoreSerialLoopback.build_reply(5, 9))
+            serial.feed(data[:10])
+            time.sleep(0.1)
+            serial.feed(data[10:])
+            self.assertEqual([7, 8, 9], [consumer.get(2)['device_nr'] for consumer in consumers])
+        finally:
+            communicator.stop()
+            serial.close()
+        self.assertEqual({}, {key: value for key, value in communicator._consumers.items() if value})
+        self.assertEqual(4, len(communicator.get_debug_buffer()['read']))
+
+    def test_reply_buffer(self):
+        buffer = ReplyBuffer(size=8)
+        buffer.append(bytearray(b'abcRTR'))
+        self.assertEqual(3, buffer.find(bytearray(b'RTR')))
+        buffer.consume(3)
+        buffer.append(bytearray(b'\x00\x01\x02\x03'))  # Compacts
+        self.assertEqual(7, len(buffer))
+        self.assertEqual(0x0102, buffer.unpack_word(4))
+        buffer.append(bytearray(b'0123456789'))  # Grows
+        self.assertEqual(bytearray(b'RTR\x00\x01\x02\x030123456789'), buffer.copy(len(buffer)))
+        buffer.consume(100)
+        self.assertEqual(0, len(buffer))
+        self.assertEqual(-1, buffer.find(bytearray(b'RTR')))
+
+
+class CoreSerialLoopback(object):
+    """
+    Fake Core serial port, answering output detail requests. Requests are answered in
+    batches and in reversed order, so the read thread has to route the replies by CID.
+    """
+
+    def __init__(self, batch_size):
+        self._read_fd, self._write_fd = os.pipe()
+        self._lock = Lock()
+        self._available = 0
+        self._batch_size = batch_size
+        self._pending = []
+        self.max_in_flight = 0
+
+    def fileno(self):
+        return self._read_fd
+
+    def inWaiting(self):
+        with self._lock:
+            return self._available
+
+    def read(self, size):
+        data = os.read(self._read_fd, size)
+        with self._lock:
+            self._available -= len(data)
+        return data
+
+    def write(self, data):
+        cid = data[3]
+        device_nr = struct.unpack('>H', bytes(data[8:10]))[0]
+        self._pending.append((cid, device_nr))
+        self.max_in_flight = max(self.max_in_flight, len(self._pending))
+        if len(self._pending) == self._batch_size or device_nr == 9:
+            for cid, device_nr in reversed(self._pending):
+                self.feed(CoreSerialLoopback.build_reply(cid, device_nr))
+            self._pending = []
+
+    def feed(self, data):
+        with self._lock:
+            self._available += len(data)
+        os.write(self._write_fd, bytes(data))
+
+    @staticmethod
+    def build_reply(cid, device_nr):
+        payload = bytearray(struct.pack('>HBBBBBBHHHBB', device_nr, device_nr % 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+        checked_payload = bytearray([cid]) + bytearray(b'OD') + bytearray(struct.pack('>H', len(payload))) + payload
+        return (bytearray(b'RTR') + checked_payload + bytearray(b'C') +
+                bytearray([sum(checked_payload) % 256]) + bytearray(b'\r\n'))
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
@@ -20,6 +20,9 @@ from __future__ import absolute_import
 import unittest
 import logging
 import mock
+import os
+import shutil
+import tempfile
 import threading
 import time
 from threading import Thread
@@ -169,3 +172,166 @@ class MemoryFileTest(unittest.TestCase):
         time.sleep(MemoryFile.ACTIVATION_HOLD_TIME + 0.1)
         self.assertFalse(memory_file._needs_activation.isSet())
         memory_file.stop()
+
+    def test_write_coalescing(self):
+        MemoryFile.ACTIVATION_HOLD_TIME = 0.2
+        mocked_core = MockedCore()
+        memory = mocked_core.memory[MemoryTypes.EEPROM]
+        memory_file = mocked_core.memory_file
+
+        memory[5] = bytearray([255] * 256)
+        memory_file.read([MemoryAddress(memory_type=MemoryTypes.EEPROM, page=5, offset=0, length=1)])
+
+        memory_file.write({MemoryAddress(memory_type=MemoryTypes.EEPROM, page=5, offset=10, length=5): bytearray([1, 2, 255, 255, 255]),
+                           MemoryAddress(memory_type=MemoryTypes.EEPROM, page=5, offset=16, length=1): bytearray([3]),
+                           MemoryAddress(memory_type=MemoryTypes.EEPROM, page=5, offset=40, length=1): bytearray([4]),
+                           MemoryAddress(memory_type=MemoryTypes.EEPROM, page=5, offset=126, length=4): bytearray([5, 6, 7, 8])})
+        memory_file.commit()
+        # Unchanged bytes are skipped, nearby ranges are merged but never over the 127/128 boundary
+        self.assertEqual([{'type': MemoryTypes.EEPROM, 'page': 5, 'start': 10, 'data': bytearray([1, 2, 255, 255, 255, 255, 3])},
+                          {'type': MemoryTypes.EEPROM, 'page': 5, 'start': 40, 'data': bytearray([4])},
+                          {'type': MemoryTypes.EEPROM, 'page': 5, 'start': 126, 'data': bytearray([5, 6])},
+                          {'type': MemoryTypes.EEPROM, 'page': 5, 'start': 128, 'data': bytearray([7, 8])}],
+                         mocked_core.write_log)
+
+        # Nothing changed, so nothing to write
+        mocked_core.write_log = []
+        memory_file.write({MemoryAddress(memory_type=MemoryTypes.EEPROM, page=5, offset=10, length=2): bytearray([1, 2])})
+        memory_file.commit()
+        self.assertEqual([], mocked_core.write_log)
+
+        # Subsequent commits are activated at once
+        memory_file.write({MemoryAddress(memory_type=MemoryTypes.EEPROM, page=5, offset=10, length=1): bytearray([9])})
+        memory_file.commit()
+        memory_file.start()
+        time.sleep(0.1)
+        memory_file.write({MemoryAddress(memory_type=MemoryTypes.EEPROM, page=5, offset=11, length=1): bytearray([9])})
+        memory_file.commit()
+        time.sleep(MemoryFile.ACTIVATION_HOLD_TIME + 0.2)
+        memory_file.stop()
+        statistics = memory_file.get_write_statistics()
+        self.assertEqual(3, statistics['commits'])
+        self.assertEqual(1, statistics['activations'])
+        self.assertEqual(2, statistics['activations_avoided'])
+        self.assertEqual(6, statistics['write_commands'])
+        self.assertEqual(5, statistics['bytes_skipped'])
+
+    def test_bulk_read(self):
+        mocked_core = MockedCore()
+        memory = mocked_core.memory[MemoryTypes.EEPROM]
+        memory_file = mocked_core.memory_file
+
+        for page in range(3):
+            memory[page] = bytearray([page] * 256)
+        addresses = [MemoryAddress(memory_type=MemoryTypes.EEPROM, page=page, offset=10, length=2) for page in range(3)]
+
+        with mock.patch.object(mocked_core.communicator, 'do_commands', wraps=mocked_core.communicator.do_commands) as do_commands:
+            memory_file.prefetch(addresses)
+            self.assertEqual(1, do_commands.call_count)  # All pages are read in a single pipelined batch
+            self.assertEqual(3 * 256 // MemoryFile.READ_CHUNK_SIZE, len(do_commands.call_args[1]['commands']))
+            self.assertEqual({address: bytearray([address.page] * 2) for address in addresses},
+                             memory_file.read(addresses))
+            self.assertEqual(1, do_commands.call_count)  # Served from cache
+
+    def test_partial_invalidation(self):
+        mocked_core = MockedCore()
+        memory = mocked_core.memory[MemoryTypes.EEPROM]
+        memory_file = mocked_core.memory_file
+
+        for page in range(3):
+            memory[page] = bytearray([page] * 256)
+        addresses = [MemoryAddress(memory_type=MemoryTypes.EEPROM, page=page, offset=0, length=1) for page in range(3)]
+        memory_file.prefetch(addresses)
+        memory[0] = bytearray([10] * 256)
+        memory[1] = bytearray([11] * 256)
+
+        memory_file.invalidate_cache(reason='test', addresses=[addresses[1]])
+        self.assertEqual({addresses[0]: bytearray([0]), addresses[1]: bytearray([11]), addresses[2]: bytearray([2])},
+                         memory_file.read(addresses))
+        memory_file.invalidate_cache(reason='test')
+        self.assertEqual({addresses[0]: bytearray([10]), addresses[1]: bytearray([11]), addresses[2]: bytearray([2])},
+                         memory_file.read(addresses))
+
+    def test_invalidation_during_read(self):
+        mocked_core = MockedCore()
+        memory = mocked_core.memory[MemoryTypes.EEPROM]
+        memory_file = mocked_core.memory_file
+
+        for page in range(2):
+            memory[page] = bytearray([page] * 256)
+        addresses = [MemoryAddress(memory_type=MemoryTypes.EEPROM, page=page, offset=0, length=1) for page in range(2)]
+        memory_file.prefetch(addresses[:1])
+        do_commands = mocked_core.communicator.do_commands
+
+        def _do_commands(*args, **kwargs):
+            memory_file.invalidate_cache(reason='test')  # E.g. an external activation while reading
+            return do_commands(*args, **kwargs)
+
+        with mock.patch.object(mocked_core.communicator, 'do_commands', side_effect=_do_commands):
+            self.assertEqual({addresses[0]: bytearray([0]), addresses[1]: bytearray([1])},
+                             memory_file.read(addresses))
+
+    def test_activation_events(self):
+        mocked_core = MockedCore()
+        memory_file = mocked_core.memory_file
+        activate_event = {'type': 248, 'action': 0, 'device_nr': 0, 'data': bytearray([1, 0])}
+        with mock.patch.object(memory_file, 'invalidate_cache') as invalidate_cache:
+            # The event of an own activation can arrive late
+            memory_file._sent_activations.append(time.time() - 70)
+            memory_file._handle_event(activate_event)
+            invalidate_cache.assert_not_called()
+            memory_file._handle_event(activate_event)
+            invalidate_cache.assert_called_once_with(reason='external activation')
+            # Expired activations (e.g. lost events) are not matched
+            invalidate_cache.reset_mock()
+            memory_file._sent_activations.append(time.time() - MemoryFile.ACTIVATION_EVENT_TIMEOUT - 1)
+            memory_file._handle_event(activate_event)
+            invalidate_cache.assert_called_once_with(reason='external activation')
+
+    def test_persistent_cache(self):
+        cache_folder = tempfile.mkdtemp()
+        cache_path = os.path.join(cache_folder, 'memory_cache.bin')
+        try:
+            mocked_core = MockedCore()
+            mocked_core.return_data['ST'] = {'info_type': 0, 'version': '1.2.3'}
+            memory = mocked_core.memory[MemoryTypes.EEPROM]
+            for page in range(3):
+                memory[page] = bytearray([page] * 256)
+            addresses = [MemoryAddress(memory_type=MemoryTypes.EEPROM, page=page, offset=10, length=2) for page in range(3)]
+
+            memory_file = MemoryFile(cache_path=cache_path)
+            memory_file._restore_persistent_cache()
+            memory_file.prefetch(addresses)
+            memory_file.stop()
+
+            # A new instance only needs page 0 to validate the cache
+            memory_file = MemoryFile(cache_path=cache_path)
+            with mock.patch.object(mocked_core.communicator, 'do_commands', wraps=mocked_core.communicator.do_commands) as do_commands:
+                memory_file._restore_persistent_cache()
+                self.assertEqual(1, do_commands.call_count)
+                self.assertEqual({address: bytearray([address.page] * 2) for address in addresses},
+                                 memory_file.read(addresses))
+                self.assertEqual(1, do_commands.call_count)
+            memory_file.stop()
+
+            # Changes to other pages are picked up by the background verification
+            memory[2] = bytearray([20] * 256)
+            memory_file = MemoryFile(cache_path=cache_path)
+            memory_file._restore_persistent_cache()
+            self.assertEqual(bytearray([2] * 2), memory_file.read([addresses[2]])[addresses[2]])
+            with mock.patch.object(memory_file, '_notify_eeprom_changed') as notify:
+                while memory_file._unverified_pages:
+                    memory_file._verify_pages()
+                notify.assert_called_once_with(activation=False)
+            self.assertEqual(bytearray([20] * 2), memory_file.read([addresses[2]])[addresses[2]])
+            memory_file.stop()
+
+            # Changes to the global page invalidate the cache
+            memory[0] = bytearray([255] * 256)
+            memory[1] = bytearray([10] * 256)
+            memory_file = MemoryFile(cache_path=cache_path)
+            memory_file._restore_persistent_cache()
+            self.assertEqual(bytearray([10] * 2), memory_file.read([addresses[1]])[addresses[1]])
+            memory_file.stop()
+        finally:
+            shutil.rmtree(cache_folder)
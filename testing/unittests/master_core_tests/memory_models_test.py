@@ -19,6 +19,7 @@ Tests for the models
 from __future__ import absolute_import
 import unittest
 import logging
+import mock
 from ioc import SetTestMode
 from master.core.memory_models import *
 from master.core.memory_file import MemoryTypes, MemoryFile, MemoryAddress
@@ -104,6 +105,32 @@ class MemoryModelsTest(unittest.TestCase):
                     self._enumerate_instance(orm_type(i), code)
         self._validate_and_report(print_overview=False)  # Set to `True` when debugging or when a visual overview is wanted
 
+    def test_prefetch(self):
+        memory_file = self.mocked_core.memory_file
+        memory_file.read([MemoryAddress(MemoryTypes.EEPROM, 0, 0, 1)])  # Load the global configuration
+        with mock.patch.object(self.mocked_core.communicator, 'do_commands', wraps=self.mocked_core.communicator.do_commands) as do_commands:
+            OutputConfiguration.prefetch(list(range(16)))
+            self.assertEqual(1, do_commands.call_count)
+            # Outputs 0-15 use EEPROM pages 1-2, FRAM page 1
+            self.assertEqual({(MemoryTypes.EEPROM, 1), (MemoryTypes.EEPROM, 2), (MemoryTypes.FRAM, 1)},
+                             set((fields['type'], fields['page']) for _, fields in do_commands.call_args[1]['commands']))
+            for i in range(16):
+                _ = OutputConfiguration(i).name
+            self.assertEqual(1, do_commands.call_count)
+
+    def test_load_batch(self):
+        memory = self.mocked_core.memory[MemoryTypes.EEPROM]
+        memory_file = self.mocked_core.memory_file
+        memory_file.read([MemoryAddress(MemoryTypes.EEPROM, 0, 0, 1)])  # Load the global configuration
+        memory[1] = bytearray([255] * 128 + [ord('A') + i for i in range(128)])
+        with mock.patch.object(memory_file, 'read', wraps=memory_file.read) as read:
+            outputs = OutputConfiguration.load_batch(list(range(8)))
+            self.assertEqual(2, read.call_count)  # The id limits and all fields
+            self.assertEqual(list(range(8)), [output.id for output in outputs])
+            self.assertEqual('ABCDEFGHIJKLMNOP', outputs[0].name)
+            self.assertTrue(outputs[1].locking.locked)  # Unwritten FRAM (255)
+            self.assertEqual(2, read.call_count)
+
     def _enumerate_instance(self, instance, code):
         fields = instance._get_fields()
         if isinstance(instance, GlobalConfiguration):
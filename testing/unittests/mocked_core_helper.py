@@ -37,6 +37,7 @@ class MockedCore(object):
 
         self.communicator = mock.Mock(CoreCommunicator)
         self.communicator.do_command = self._do_command
+        self.communicator.do_commands = self._do_commands
         self.pubsub = PubSub()
         SetUpTestInjections(master_communicator=self.communicator,
                             pubsub=self.pubsub)
@@ -53,6 +54,11 @@ class MockedCore(object):
         self.controller = MasterCoreController()
         self.write_log = []
 
+    def _do_commands(self, commands, timeout=None, bypass_blockers=None, window=None):
+        _ = window
+        return [self._do_command(command, fields, timeout=timeout, bypass_blockers=bypass_blockers)
+                for command, fields in commands]
+
     def _do_command(self, command, fields, timeout=None, bypass_blockers=None):
         _ = timeout
         instruction = ''.join(str(chr(c)) for c in command.instruction)
@@ -21,9 +21,12 @@ import os
 import plugin_runtime
 import shutil
 import tempfile
+import time
 import unittest
+from threading import Thread
 import mock
 from plugins.runner import PluginRunner, RunnerWatchdog
+from toolbox import PackedValue, PluginIPCReader, PluginIPCWriter
 
 
 class PluginRunnerTest(unittest.TestCase):
@@ -56,6 +59,105 @@ class PluginRunnerTest(unittest.TestCase):
                               logger=self._log)
         self.assertEqual(runner.get_queue_length(), 0)
 
+    def test_ipc_batch(self):
+        read_fd, write_fd = os.pipe()
+        received = []
+        reader = PluginIPCReader(stream=os.fdopen(read_fd, 'rb', 0),
+                                 logger=self._log,
+                                 command_receiver=received.append)
+        writer = PluginIPCWriter(stream=os.fdopen(write_fd, 'wb', 0))
+        reader.start()
+        try:
+            writer.write({'cid': 1, 'action': 'foo'})
+            writer.write_batch([{'cid': 2, 'action': 'bar'},
+                                {'cid': 3, 'action': 'baz', 'payload': 'x' * 100000}])
+            event = PackedValue({'type': 'OUTPUT_CHANGE', 'data': {'id': 1}})
+            writer.write_batch([{'cid': 4, 'action': 'output_status', 'event': event},
+                                {'cid': 5, 'action': 'output_status', 'event': event}])
+            start = time.time()
+            while len(received) < 5 and time.time() - start < 5:
+                time.sleep(0.01)
+            self.assertEqual([1, 2, 3, 4, 5], [command['cid'] for command in received])
+            self.assertEqual(100000, len(received[2]['payload']))
+            self.assertEqual({'type': 'OUTPUT_CHANGE', 'data': {'id': 1}}, received[4]['event'])
+        finally:
+            reader._running = False
+            writer._stream.close()
+
+    def test_ipc_invalid_command(self):
+        read_fd, write_fd = os.pipe()
+        received = []
+        reader = PluginIPCReader(stream=os.fdopen(read_fd, 'rb', 0),
+                                 logger=self._log,
+                                 command_receiver=received.append)
+        writer = PluginIPCWriter(stream=os.fdopen(write_fd, 'wb', 0))
+        writer._stream.write(writer._packer.pack([{'cid': 1}, 'invalid', {'cid': 2}]) +
+                             writer._pack({'cid': 3}))
+        reader.start()
+        try:
+            start = time.time()
+            while len(received) < 3 and time.time() - start < 5:
+                time.sleep(0.01)
+            self.assertEqual([1, 2, 3], [command['cid'] for command in received])
+        finally:
+            reader._running = False
+            writer._stream.close()
+
+    def test_command_futures(self):
+        runner = PluginRunner(name='foo',
+                              runtime_path=self.RUNTIME_PATH,
+                              plugin_path=self.PLUGIN_PATH,
+                              logger=self._log)
+        runner._process_running = True
+        runner._proc = mock.Mock(poll=mock.Mock(return_value=None))
+
+        def _write(command):
+            # Respond to an unknown cid first, which should be ignored
+            runner._process_command({'cid': command['cid'] + 1, 'action': command['action']})
+            runner._process_command({'cid': command['cid'], 'action': command['action'], 'value': 1})
+
+        runner._writer = mock.Mock(write=_write)
+        response = runner._do_command('foo')
+        self.assertEqual(1, response['value'])
+        self.assertEqual({}, runner._pending_commands)
+        statistics = runner.get_latency_statistics()
+        self.assertEqual(1, sum(statistics['histogram'].values()))
+        statistics = runner.get_latency_statistics()
+        self.assertEqual(1, sum(statistics['histogram'].values()))  # The histogram is cumulative
+        self.assertEqual(0.0, statistics['average'])
+
+        runner._writer = mock.Mock()
+        with self.assertRaises(Exception):
+            runner._do_command('foo', timeout=0.1)
+        self.assertEqual({}, runner._pending_commands)
+
+    def test_concurrent_commands(self):
+        runner = PluginRunner(name='foo',
+                              runtime_path=self.RUNTIME_PATH,
+                              plugin_path=self.PLUGIN_PATH,
+                              logger=self._log)
+        runner._process_running = True
+        runner._proc = mock.Mock(poll=mock.Mock(return_value=None))
+        commands = {}
+
+        def _write(command):
+            commands[command['action']] = command
+            if command['action'] == 'fast':
+                runner._process_command({'cid': command['cid'], 'action': 'fast'})
+
+        runner._writer = mock.Mock(write=_write)
+        responses = []
+        thread = Thread(target=lambda: responses.append(runner._do_command('slow', timeout=5)))
+        thread.start()
+        while 'slow' not in commands:
+            time.sleep(0.01)
+        # The slow command does not block other commands
+        self.assertEqual('fast', runner._do_command('fast', timeout=1)['action'])
+        self.assertEqual([], responses)
+        runner._process_command({'cid': commands['slow']['cid'], 'action': 'slow'})
+        thread.join()
+        self.assertEqual('slow', responses[0]['action'])
+
     def test_watchog_always_stops_runner(self):
 
         def _set_side_effects(effects):